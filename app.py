@@ -1,30 +1,113 @@
-import os
+import math
+import mimetypes
+from datetime import datetime, timedelta
 
-from flask import Flask, render_template, request, flash, redirect, session, g
-from flask_debugtoolbar import DebugToolbarExtension
+# First, so that the startup timer covers the imports below
+from startup import StartupTimer, enable_bytecode_cache, warm_up
+
+import click
+from flask.cli import AppGroup
+from flask import (Flask, render_template, request, flash, redirect, session, g, abort,
+                   url_for, stream_with_context, jsonify, send_file)
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
 
+from compression import CompressionMiddleware
+from config import config_for
 from forms import UserAddForm, LoginForm, MessageForm, UserEditForm
-from models import db, connect_db, User, Message
+from availability import availability, FIELDS as AVAILABILITY_FIELDS
+from models import (db, connect_db, User, Message, Follows, Repost, Notification,
+                    follow_graph, thread_tree)
+from archive import MessageArchive
+from assets import Assets, ENCODINGS, build as build_assets, vendor as vendor_assets
+from cache import cache
+from deletion import soft_delete_user, schedule_purge, purge_pending
+from export import export, DATASETS, FORMATS
+from image_proxy import ImageProxy, DiskCache, ImageProxyError
+from notifications import Notifier, unread_count, mark_read, forget_unread
+import partitions
+from rate_limit import RateLimiter, MemoryBackend
+from recommendations import recommender
+from sessions import session_interface_for
+from timeline import home_timeline, BucketPool
+from trending import trends, WINDOWS
+from write_batching import GroupCommitter
+
+startup_timer = StartupTimer()
+startup_timer.lap('import')
 
 CURR_USER_KEY = "curr_user"
 
 app = Flask(__name__)
 
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
+app.config.from_object(config_for())
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-toolbar = DebugToolbarExtension(app)
+# Debug tooling only in development; production doesn't even import it
+if app.config['DEBUG_TB_ENABLED']:
+    from flask_debugtoolbar import DebugToolbarExtension
+    toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
 
+# Pages and JSON go out compressed to clients that accept it
+if app.config['COMPRESSION_ENABLED']:
+    app.wsgi_app = CompressionMiddleware(app.wsgi_app,
+                                         app.config['COMPRESSION_MIN_SIZE'],
+                                         app.config['COMPRESSION_LEVEL'],
+                                         app.config['COMPRESSION_BROTLI_QUALITY'])
+
+# Session data stays on the server; the cookie only carries its id
+app.session_interface = session_interface_for(app.config, CURR_USER_KEY)
+
+# Shares one transaction between concurrent posts when MESSAGE_GROUP_COMMIT is on
+message_writer = GroupCommitter(app, Message.insert_many,
+                                app.config['MESSAGE_GROUP_COMMIT_MAX_BATCH'],
+                                app.config['MESSAGE_GROUP_COMMIT_MAX_WAIT'])
+image_proxy = ImageProxy(DiskCache(app.config['IMAGE_CACHE_DIR'],
+                                   app.config['IMAGE_CACHE_MAX_BYTES']),
+                         app.config['SECRET_KEY'],
+                         failure_ttl=app.config['IMAGE_PROXY_FAILURE_TTL'])
+notifier = Notifier(app, app.config['NOTIFICATIONS_MAX_BATCH'],
+                    app.config['NOTIFICATIONS_MAX_WAIT'])
+rate_limiter = RateLimiter(MemoryBackend(), app.config['RATE_LIMITS'])
+follow_graph.max_age = app.config['FOLLOW_GRAPH_MAX_AGE']
+message_archive = MessageArchive(app.config['ARCHIVE_DIR'])
+static_assets = Assets(app.config['ASSETS_DIR'], app.static_folder)
+if app.config['TRENDS_DIR']:
+    trends.share(app.config['TRENDS_DIR'], app.config['TRENDS_SYNC_SECONDS'])
+timeline_pool = BucketPool(app.config['TIMELINE_WORKERS'])
+
+enable_bytecode_cache(app, app.config['TEMPLATE_CACHE_DIR'])
+startup_timer.lap('configure')
+
+
+##############################################################################
+# Rate limiting
+
+
+@app.before_request
+def check_rate_limit():
+    """Turn away clients over their quota for a write or login.
+
+    Registered before any other request hook, and keyed on the session
+    cookie or the remote address, so a rejected request never reaches
+    the database or bcrypt.
+    """
+
+    if not app.config['RATE_LIMIT_ENABLED'] or request.method != 'POST':
+        return None
+
+    if CURR_USER_KEY in session:
+        client = f"user:{session[CURR_USER_KEY]}"
+    else:
+        client = f"ip:{request.remote_addr}"
+
+    wait = rate_limiter.check(request.endpoint, client)
+    if wait:
+        return app.response_class(
+            "Too many requests, please slow down.", 429,
+            {'Retry-After': str(math.ceil(wait))}, mimetype='text/plain')
+
 
 ##############################################################################
 # User signup/login/logout
@@ -34,8 +117,15 @@ connect_db(app)
 def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+    if request.endpoint in ('static', 'assets_show'):
+        # Files are the same for everyone: don't load the session for them
+        g.user = None
+
+    elif CURR_USER_KEY in session:
+        g.user = (User
+                  .query
+                  .filter_by(id=session[CURR_USER_KEY], deleted_at=None)
+                  .first())
 
     else:
         g.user = None
@@ -79,7 +169,9 @@ def signup():
             db.session.commit()
 
         except IntegrityError:
-            # We will get an Integrity Error if the username already exist
+            # The form checks availability first, but another process can
+            # take the name in between; the unique indexes catch that
+            db.session.rollback()
             flash("Username already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
@@ -133,27 +225,63 @@ def list_users():
 
     search = request.args.get('q')
     # If there is no search term, we get the full list
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+    users = User.query.filter(User.deleted_at.is_(None))
+    if search:
+        users = users.filter(User.username.like(f"%{search}%"))
+    users = users.all()
 
     return render_template('users/index.html', users=users)
 
 
+@app.route('/users/available')
+def users_available():
+    """Is a username free? For checking as it is typed:
+
+    /users/available?username=bob -> {"field": "username", "value": "bob",
+                                      "available": false}
+
+    Usernames only: they are public anyway, but answering for emails
+    would tell anyone who has an account.
+    """
+
+    value = request.args.get('username', '').strip()
+    if not value:
+        abort(400)
+
+    taken = availability.is_taken('username', value, g.user.id if g.user else None)
+    return jsonify(field='username', value=value, available=not taken)
+
+
 @app.route('/users/<int:user_id>')
 def users_show(user_id):
     """Show user profile."""
 
     user = User.query.get_or_404(user_id)
-    # User's messages
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    if user.deleted_at:
+        abort(404)
+    # User's messages, a page at a time; past the ones left in the
+    # table, the page carries on into the archive
+    per_page = app.config['MESSAGES_PER_PAGE']
+    before = request.args.get('before')
+    try:
+        messages = Message.newest(Message.query.filter(Message.user_id == user_id),
+                                  per_page, before)
+        if len(messages) < per_page:
+            messages += message_archive.user_page(
+                user_id, messages[-1].cursor if messages else before,
+                per_page - len(messages))
+    except ValueError:
+        abort(400)
+
+    return render_template('users/show.html', user=user, messages=messages,
+                           more=len(messages) == per_page)
+
+
+@app.template_global()
+def message_count(user):
+    """How many messages `user` has written, archived ones included."""
+
+    return user.message_count() + message_archive.count(user.id)
 
 
 @app.route('/users/<int:user_id>/following')
@@ -165,7 +293,11 @@ def show_following(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    after = request.args.get('after', 0, type=int)
+    follows, next_after = User.following_page(
+        user.id, g.user.id, after, app.config['FOLLOWS_PER_PAGE'])
+    return render_template('users/following.html', user=user,
+                           follows=follows, next_after=next_after)
 
 
 @app.route('/users/<int:user_id>/followers')
@@ -177,7 +309,11 @@ def users_followers(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    after = request.args.get('after', 0, type=int)
+    follows, next_after = User.followers_page(
+        user.id, g.user.id, after, app.config['FOLLOWS_PER_PAGE'])
+    return render_template('users/followers.html', user=user,
+                           follows=follows, next_after=next_after)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -189,8 +325,17 @@ def add_follow(follow_id):
         return redirect("/")
 
     followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
-    db.session.commit()
+    if followed_user.deleted_at:
+        abort(404)
+    try:
+        added = Follows.add(g.user.id, followed_user.id)
+        db.session.commit()
+    except IntegrityError:
+        # Another request made the same follow in the meantime
+        db.session.rollback()
+        added = False
+    if added:
+        notifier.notify(followed_user.id, 'follow', g.user.id)
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -204,7 +349,7 @@ def stop_following(follow_id):
         return redirect("/")
 
     followed_user = User.query.get_or_404(follow_id)
-    g.user.following.remove(followed_user)
+    Follows.remove(g.user.id, followed_user.id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
@@ -218,25 +363,32 @@ def profile():
         flash("Access unauthorized.", "danger")
         return redirect("/")
     # Data to pass to the form to be pre-filled wit the user's data
-    data = {"username": g.user.username, "email": g.user.email, "image_url": g.user.image_url,
-            "header_image_url": g.user.header_image_url, "bio": g.user.bio}
+    data = {name: getattr(g.user, name) for name in User.PROFILE_FIELDS}
 
     form = UserEditForm(data=data)
+    # Keeping your own username or email is fine
+    form.user_id = g.user.id
 
     if form.validate_on_submit():
-        user = User.authenticate(g.user.username,
-                                 form.password.data)
-        # Change user's info to the form data
-        if user:
-            user.username = form.username.data
-            user.email = form.email.data
-            user.image_url = form.image_url.data
-            user.header_image_url = form.header_image_url.data
-            user.bio = form.bio.data
-            db.session.add(user)
-            db.session.commit()
-            flash(f"{user.username}, your changes were made successfully", "success")
-            return redirect(f"/users/{user.id}")
+        # g.user is already loaded: check its hash rather than look it up again
+        if g.user.check_password(form.password.data):
+            user_id = g.user.id
+            try:
+                changed = User.update_profile(
+                    g.user, {name: form[name].data for name in User.PROFILE_FIELDS})
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                flash("Username or email already taken.", 'danger')
+                return render_template('users/edit.html', form=form)
+
+            if changed:
+                # Cached message views embed the author's name and image
+                cache.invalidate_tag(f"user:{user_id}")
+                availability.add(**{field: changed[field] for field in AVAILABILITY_FIELDS
+                                    if field in changed})
+            flash(f"{form.username.data}, your changes were made successfully", "success")
+            return redirect(f"/users/{user_id}")
 
         flash("Invalid credentials.", 'danger')
 
@@ -245,7 +397,11 @@ def profile():
 
 @app.route('/users/delete', methods=["POST"])
 def delete_user():
-    """Delete user."""
+    """Delete user.
+
+    The account disappears right away; its rows are purged in batches
+    afterwards (see deletion.py).
+    """
     # If the user is not the one in session redirect
     if not g.user:
         flash("Access unauthorized.", "danger")
@@ -253,8 +409,15 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    user_id = g.user.id
+    soft_delete_user(g.user)
     db.session.commit()
+    follow_graph.remove_user(user_id)
+    cache.invalidate_tag(f"user:{user_id}")
+    # Log the account out everywhere else too
+    app.session_interface.revoke_user(user_id)
+
+    schedule_purge(app, user_id, message_archive)
 
     return redirect("/signup")
 
@@ -276,12 +439,17 @@ def like_dislike(mssg_id):
     user_likes = g.user.likes
     # If the messages is not prevoiusly liked, like
     # If the message is liked, remove like
-    if message in user_likes:
-        g.user.likes = [like for like in user_likes if like != message]
-    else:
+    liked = message not in user_likes
+    if liked:
         g.user.likes.append(message)
+    else:
+        g.user.likes = [like for like in user_likes if like != message]
 
     db.session.commit()
+    cache.delete(f"message:{message.id}")
+    trends.record_like(message.id, liked)
+    if liked:
+        notifier.notify(message.user_id, 'like', g.user.id, message.id)
 
     return redirect("/")
 
@@ -297,6 +465,25 @@ def show_likes(user_id):
     return render_template('users/likes.html', user=user, likes=user.likes)
 
 
+@app.route('/users/export/<dataset>.<any(csv, ndjson):file_format>', methods=["GET"])
+def export_user_data(dataset, file_format):
+    """Stream the logged-in user's profile, messages, follows or likes."""
+    # If the user is not the one in session redirect
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    if dataset not in DATASETS:
+        abort(404)
+
+    # No Content-Length, so the server sends it chunked as rows are read
+    chunks = export(dataset, file_format, g.user.id, archive=message_archive)
+    return app.response_class(
+        stream_with_context(chunks), mimetype=FORMATS[file_format],
+        headers={'Content-Disposition':
+                 f"attachment; filename=warbler-{dataset}.{file_format}"})
+
+
 ##############################################################################
 # Messages routes:
 
@@ -314,9 +501,19 @@ def messages_add():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
-        db.session.commit()
+        # Insert the row directly rather than through g.user.messages,
+        # which would load every message the user has written
+        if app.config['MESSAGE_GROUP_COMMIT']:
+            message_id = message_writer.submit({'text': form.text.data,
+                                                'user_id': g.user.id})
+        else:
+            message = Message(text=form.text.data, user_id=g.user.id)
+            db.session.add(message)
+            db.session.flush()
+            message_id = message.id
+            db.session.commit()
+        trends.record_message(form.text.data)
+        notifier.notify_mentions(form.text.data, g.user.id, message_id)
 
         return redirect(f"/users/{g.user.id}")
 
@@ -325,10 +522,78 @@ def messages_add():
 
 @app.route('/messages/<int:message_id>', methods=["GET"])
 def messages_show(message_id):
-    """Show a message."""
+    """Show a message and a page of the replies below it.
 
-    msg = Message.query.get_or_404(message_id)
-    return render_template('messages/show.html', message=msg)
+    Can take an 'after' param in querystring: the cursor of the last
+    reply on the previous page.
+    """
+
+    viewer_id = g.user.id if g.user else None
+    key = f"message:{message_id}"
+
+    msg = cache.get(key)
+    if msg is None:
+        msg, liked = Message.view(message_id, viewer_id)
+        if msg is None:
+            abort(404)
+        # Tagged with the author, whose profile is part of the view
+        cache.set(key, msg, tags=[f"user:{msg.user.id}"],
+                  ttl=app.config['MESSAGE_CACHE_TTL'])
+    else:
+        liked = viewer_id is not None and Message.liked_by(message_id, viewer_id)
+
+    try:
+        replies, next_after = Message.replies_page(
+            msg, request.args.get('after'), app.config['THREAD_PAGE_SIZE'],
+            app.config['THREAD_MAX_DEPTH'])
+    except ValueError:
+        abort(400)
+
+    return render_template('messages/show.html', message=msg, liked=liked,
+                           thread=thread_tree(replies), next_after=next_after,
+                           form=MessageForm())
+
+
+@app.route('/messages/<int:message_id>/reply', methods=["POST"])
+def messages_reply(message_id):
+    """Reply to a message."""
+    # If the user is not the one in session redirect
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    parent = Message.query.get_or_404(message_id)
+    form = MessageForm()
+
+    if form.validate_on_submit():
+        reply = Message.add_reply(parent, form.text.data, g.user.id)
+        db.session.flush()
+        reply_id = reply.id
+        db.session.commit()
+        cache.delete(f"message:{parent.id}")
+        trends.record_message(form.text.data)
+        notifier.notify_mentions(form.text.data, g.user.id, reply_id)
+
+    return redirect(f"/messages/{parent.root_id or parent.id}")
+
+
+@app.route('/messages/<int:message_id>/repost', methods=["POST"])
+def messages_repost(message_id):
+    """Repost a message to your followers, or undo the repost."""
+    # If the user is not the one in session redirect
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    message = Message.query.get_or_404(message_id)
+    if message.user_id == g.user.id:
+        flash("You can't repost your own messages.", "danger")
+        return redirect("/")
+
+    Repost.toggle(g.user.id, message.id)
+    db.session.commit()
+
+    return redirect("/")
 
 
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
@@ -344,12 +609,170 @@ def messages_destroy(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    db.session.delete(msg)
+    parent_id = msg.parent_id
+    if parent_id:
+        (Message
+         .query
+         .filter(Message.id == parent_id)
+         .update({Message.reply_count: Message.reply_count - 1},
+                 synchronize_session=False))
+
+    changed_ids = Message.remove(msg)
     db.session.commit()
+    # The message, and the replies deleted or orphaned with it
+    for changed_id in changed_ids:
+        cache.delete(f"message:{changed_id}")
+    if parent_id:
+        cache.delete(f"message:{parent_id}")
 
     return redirect(f"/users/{g.user.id}")
 
 
+@app.route('/trending')
+def trending():
+    """Show trending hashtags and mentions, and the most-liked recent messages.
+
+    Can take a 'window' param in querystring: one of `trending.WINDOWS`.
+    """
+
+    window = request.args.get('window', 'hour')
+    if window not in WINDOWS:
+        abort(404)
+
+    count = app.config['TRENDING_COUNT']
+    message_ids = trends.top_messages(count)
+    found = {msg.id: msg for msg in (Message
+                                     .query
+                                     .options(joinedload(Message.user))
+                                     .filter(Message.id.in_(message_ids)))}
+    messages = [found[message_id] for message_id in message_ids if message_id in found]
+
+    return render_template('trending.html', window=window, windows=WINDOWS,
+                           tags=trends.top_tags(window, count),
+                           mentions=trends.top_mentions(window, count),
+                           messages=messages)
+
+
+##############################################################################
+# Static assets
+
+
+@app.template_global()
+def asset_url(path):
+    """URL of the static file at `path`: its built, fingerprinted copy if
+    there is one (see assets.py), else the file itself."""
+
+    built = static_assets.built(path)
+    if built:
+        return url_for('assets_show', filename=built)
+
+    return static_assets.cdn_url(path) or url_for('static', filename=path)
+
+
+@app.route('/assets/<path:filename>', methods=["GET"])
+def assets_show(filename):
+    """Serve a built asset, precompressed if the client accepts that."""
+
+    accepted = [encoding for encoding in ENCODINGS if request.accept_encodings[encoding]]
+    path, encoding = static_assets.find(filename, accepted)
+    if path is None:
+        abort(404)
+
+    response = send_file(path, mimetype=mimetypes.guess_type(filename)[0],
+                         conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    # A fingerprinted name always serves the same file
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+##############################################################################
+# Image proxy
+
+
+@app.template_global()
+def image_url(url, size):
+    """URL of a `size` thumbnail of a user's image (see image_proxy.SIZES).
+
+    Local images (the defaults under /static) are linked as they are.
+    """
+
+    if url and url.startswith('/static/'):
+        return asset_url(url[len('/static/'):])
+    if not url or url.startswith('/'):
+        return url
+
+    return url_for('image_proxy_show', size=size, url=url, sig=image_proxy.sign(url))
+
+
+@app.route('/images/<size>', methods=["GET"])
+def image_proxy_show(size):
+    """Serve a thumbnail of the image at the 'url' querystring param.
+
+    Only URLs signed by `image_url` are served (the 'sig' param).
+    """
+
+    url = request.args.get('url')
+    if size not in image_proxy.sizes:
+        abort(404)
+    if not url:
+        abort(400)
+    if not image_proxy.verify(url, request.args.get('sig')):
+        abort(403)
+
+    try:
+        data, mimetype, etag = image_proxy.thumbnail(url, size)
+    except ImageProxyError:
+        abort(404)
+
+    response = app.response_class(data, mimetype=mimetype)
+    response.set_etag(etag)
+    # A proxy URL always serves the same thumbnail
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response.make_conditional(request)
+
+
+##############################################################################
+# Notifications
+
+
+@app.context_processor
+def notification_badge():
+    """`unread_notifications()` for the navbar badge, served from the cache."""
+
+    return {'unread_notifications':
+            lambda: unread_count(g.user.id, app.config['NOTIFICATIONS_UNREAD_TTL'])
+            if g.user else 0}
+
+
+@app.route('/notifications')
+def notifications_show():
+    """Show the user's latest notifications, and mark the ones shown read."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    seen_at = datetime.utcnow()
+    notifications = (Notification
+                     .query
+                     .options(joinedload(Notification.actor))
+                     .filter(Notification.user_id == g.user.id)
+                     .order_by(Notification.updated_at.desc(), Notification.id.desc())
+                     .limit(app.config['NOTIFICATIONS_PER_PAGE'])
+                     .all())
+    # Render first: committing expires the loaded rows
+    html = render_template('notifications.html', notifications=notifications)
+
+    mark_read(g.user.id, [notification.id for notification in notifications], seen_at)
+    db.session.commit()
+    forget_unread([g.user.id])
+
+    return html
+
+
 ##############################################################################
 # Homepage and error pages
 
@@ -359,26 +782,163 @@ def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: 100 most recent messages and reposts of followed_users
     """
     # If the user is not the one in session render the anonym root route
     if g.user:
-        follow_id = [fw.id for fw in g.user.following]
-        messages = (Message
-                    .query
-                    .filter(or_(Message.user_id.in_(follow_id), Message.user_id == g.user.id))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
+        follow_id = sorted(g.user.following_ids())
+        items = home_timeline(g.user.id, follow_id, 100, timeline_pool,
+                              app.config['TIMELINE_BUCKET_SIZE'])
+
+        # Only the like/repost state of the messages on the page
+        page_ids = [item.message.id for item in items]
+        liked_mssg_ids = Message.liked_among(g.user.id, page_ids)
+        reposted_ids = Repost.reposted_among(g.user.id, page_ids)
 
-        liked_mssg_ids = [msg.id for msg in g.user.likes]
+        suggested_ids = recommender.suggest(g.user.id, app.config['SUGGESTIONS_COUNT'])
+        suggestions = (User
+                       .query
+                       .filter(User.id.in_(suggested_ids), User.deleted_at.is_(None))
+                       .all()) if suggested_ids else []
 
-        return render_template('home.html', messages=messages, likes=liked_mssg_ids)
+        return render_template('home.html', items=items, likes=liked_mssg_ids,
+                               reposts=reposted_ids, suggestions=suggestions)
 
     else:
         return render_template('home-anon.html')
 
 
+##############################################################################
+# Maintenance commands
+
+
+@app.cli.command('purge-deleted-users')
+def purge_deleted_users_command():
+    """Finish purging accounts whose deletion was interrupted."""
+
+    count = purge_pending(app.config['ACCOUNT_PURGE_BATCH_SIZE'], message_archive)
+    print(f"Purged {count} account(s).")
+
+
+@app.cli.command('sweep-sessions')
+def sweep_sessions_command():
+    """Remove expired sessions from the session directory."""
+
+    backend = app.session_interface.backend
+    if not hasattr(backend, 'sweep'):
+        raise click.ClickException("SESSION_BACKEND isn't 'file'; nothing to sweep")
+    print(f"Removed {backend.sweep()} session(s).")
+
+
+@app.cli.command('recommend-all')
+def recommend_all_command():
+    """Recompute and store "who to follow" suggestions for every user."""
+
+    count = recommender.recompute_all(app.config['SUGGESTIONS_COUNT'])
+    print(f"Stored suggestions for {count} user(s).")
+
+
+@app.cli.command('export')
+@click.argument('dataset', type=click.Choice(sorted(DATASETS)))
+@click.option('--format', 'file_format', type=click.Choice(sorted(FORMATS)),
+              default='csv', show_default=True)
+@click.option('--user', 'user_id', type=int, help="Only this user's data.")
+@click.option('--output', type=click.File('w'), default='-',
+              help="File to write to, instead of stdout.")
+def export_command(dataset, file_format, user_id, output):
+    """Stream a dataset, or one user's share of it, as CSV or NDJSON.
+
+    A full CSV export of users, messages and follows can be loaded back
+    with seed.py.
+    """
+
+    for chunk in export(dataset, file_format, user_id, archive=message_archive):
+        output.write(chunk)
+
+
+@app.cli.command('archive-messages')
+@click.option('--older-than-days', type=int, default=None,
+              help="Archive messages older than this (default: ARCHIVE_AFTER_DAYS).")
+def archive_messages_command(older_than_days):
+    """Move old messages out of the database into compressed files."""
+
+    days = older_than_days or app.config['ARCHIVE_AFTER_DAYS']
+    count = message_archive.archive(datetime.utcnow() - timedelta(days=days))
+    print(f"Archived {count} message(s).")
+
+
+@app.cli.command('vendor-assets')
+def vendor_assets_command():
+    """Download the pinned CDN dependencies into static/vendor."""
+
+    try:
+        written = vendor_assets(app.static_folder)
+    except OSError as error:
+        raise click.ClickException(f"download failed: {error}")
+    for path in written:
+        print(path)
+
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint, minify and precompress static/ into ASSETS_DIR."""
+
+    built = build_assets(app.static_folder, app.config['ASSETS_DIR'])
+    static_assets.reload()
+    print(f"Built {len(built)} asset(s) into {app.config['ASSETS_DIR']}.")
+
+
+partitions_cli = AppGroup('partitions', help="Manage the monthly partitions of messages.")
+
+
+def require_partitioned():
+    if not partitions.is_partitioned():
+        raise click.ClickException(
+            "messages isn't partitioned; apply migrations/0006_partition_messages.sql")
+
+
+@partitions_cli.command('list')
+def partitions_list_command():
+    """Show the partitions of the messages table and their ranges."""
+
+    require_partitioned()
+    for partition in sorted(partitions.list_partitions(),
+                            key=lambda partition: partition.end or datetime.max):
+        print(f"{partition.name:<24} {partition.start or '-'} .. {partition.end or '-'}")
+
+
+@partitions_cli.command('create')
+@click.option('--months-ahead', type=int, default=3, show_default=True)
+def partitions_create_command(months_ahead):
+    """Create partitions for this month and the coming ones."""
+
+    require_partitioned()
+    created = partitions.create_partitions(months_ahead)
+    print(f"Created {len(created)} partition(s): {' '.join(created)}")
+
+
+@partitions_cli.command('detach')
+@click.option('--keep-months', type=int, required=True,
+              help="Months of messages to keep in the live table.")
+def partitions_detach_command(keep_months):
+    """Archive messages older than the retention period, and drop the
+    partitions left empty."""
+
+    require_partitioned()
+    dropped = partitions.detach_partitions(message_archive, keep_months)
+    print(f"Dropped {len(dropped)} partition(s): {' '.join(dropped)}")
+
+
+app.cli.add_command(partitions_cli)
+
+
+@app.cli.command('startup-report')
+def startup_report_command():
+    """Show how long each phase of starting the app took."""
+
+    print(startup_timer.report())
+
+
 ##############################################################################
 # Turn off all caching in Flask
 #   (useful for dev; in production, this kind of stuff is typically
@@ -388,10 +948,30 @@ def homepage():
 
 @app.after_request
 def add_header(req):
-    """Add non-caching headers on every request."""
+    """Add non-caching headers on every request.
+
+    Responses marked immutable (proxied images, built assets) keep their
+    caching headers. Pages carrying a CSRF token are marked no-transform,
+    so that they aren't compressed: compressing a secret next to text an
+    attacker controls leaks it through the response size (BREACH).
+    """
+
+    if 'immutable' in req.headers.get('Cache-Control', ''):
+        return req
 
     req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
     req.headers["Pragma"] = "no-cache"
     req.headers["Expires"] = "0"
     req.headers['Cache-Control'] = 'public, max-age=0'
+    if app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token') in g:
+        req.headers['Cache-Control'] += ', no-transform'
     return req
+
+
+##############################################################################
+# Startup: compile templates and connect before the first request
+
+if app.config['STARTUP_WARMUP']:
+    warm_up(app, db, startup_timer)
+
+app.logger.info("Startup times:\n%s", startup_timer.report())
@@ -0,0 +1,466 @@
+"""Cold storage for old messages.
+
+`MessageArchive.archive` moves messages older than a cutoff out of the
+messages table into a segment file, one per run. A user's profile pages
+read them back with `user_page` once they run past the messages left in
+the table.
+
+A segment is NDJSON, one message per line, sorted by user and then newest
+first, as on a profile page. Lines are gzipped in blocks of a few hundred,
+each block its own gzip member, so the file as a whole is a valid .gz
+file, but one block can be read on its own. Next to it, a small index
+records each block's offset and length and the (user, time) key of its
+first and last message. Reading a page seeks straight to the first block
+that can hold it, and usually reads only one or two blocks.
+
+Conversations are archived whole: a message stays in the table as long as
+anything in its conversation is newer than the cutoff, so no live message
+ends up replying to one in the archive. Archiving drops the likes and
+reposts of the archived messages, and notifications about them; the
+archive keeps the like count.
+
+Runs are crash-safe. A segment is written under a temporary name and
+renamed once complete, its messages are deleted from the table, and only
+then is it added to the manifest; a segment missing from the manifest is
+finished by the next run.
+
+Purging an account (see deletion.py) tombstones its archived messages,
+and the replies in conversations it started: reads skip them at once, and
+the next run rewrites the segments holding any under a new name, then
+drops the tombstones. The manifest switching over to a rewritten segment
+is what commits it; until the replaced files are gone, the manifest lists
+them as retired.
+"""
+
+import bisect
+import gzip
+import itertools
+import json
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from models import db, Message, Likes, Repost, Notification
+
+MANIFEST = 'manifest.json'
+TOMBSTONES = 'tombstones.json'
+# Marks the name of a segment rewritten without tombstoned messages
+REWRITTEN = '-rewritten-'
+BLOCK_SIZE = 256
+DELETE_BATCH_SIZE = 1000
+
+EPOCH = datetime(1970, 1, 1)
+
+COLUMNS = ['id', 'text', 'timestamp', 'user_id', 'parent_id', 'root_id',
+           'depth', 'reply_count', 'like_count']
+
+
+class ArchivedMessage(namedtuple('ArchivedMessage', COLUMNS)):
+    """A message read back from the archive."""
+
+    archived = True
+
+    @property
+    def cursor(self):
+        """Position in `Message.newest_first` order, as `Message.cursor`."""
+
+        return f"{self.timestamp.isoformat()}_{self.id}"
+
+
+def _sort_key(user_id, timestamp, message_id):
+    """Key ordering a segment: by user, then newest first."""
+
+    return (user_id, -((timestamp - EPOCH) // timedelta(microseconds=1)), -message_id)
+
+
+def _user_start(user_id):
+    """Sort key just before `user_id`'s first message."""
+
+    return (user_id, float('-inf'), float('-inf'))
+
+
+def _row_key(row):
+    return _sort_key(row['user_id'], row['timestamp'], row['id'])
+
+
+def _row_line(row):
+    return json.dumps(dict(row, timestamp=row['timestamp'].isoformat())) + '\n'
+
+
+def _write_json(path, value):
+    """Write `value` to `path` atomically."""
+
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(value, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class MessageArchive:
+    """Segments of archived messages in `directory`."""
+
+    def __init__(self, directory, block_size=BLOCK_SIZE):
+        self.directory = directory
+        self.block_size = block_size
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def _path(self, name, suffix):
+        return os.path.join(self.directory, name + suffix)
+
+    def _manifest(self):
+        try:
+            with open(os.path.join(self.directory, MANIFEST)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'segments': []}
+
+    def _tombstones(self):
+        """(user ids, conversation root ids) whose messages are purged."""
+
+        try:
+            with open(os.path.join(self.directory, TOMBSTONES)) as f:
+                tombstones = json.load(f)
+        except FileNotFoundError:
+            return set(), set()
+        return set(tombstones['users']), set(tombstones['roots'])
+
+    def _write_tombstones(self, users, roots):
+        _write_json(os.path.join(self.directory, TOMBSTONES),
+                    {'users': sorted(users), 'roots': sorted(roots)})
+
+    def _index(self, name):
+        """A segment's block index, read once."""
+
+        with self._lock:
+            index = self._indexes.get(name)
+            if index is None:
+                with open(self._path(name, '.idx.json')) as f:
+                    index = json.load(f)
+                for block in index['blocks']:
+                    block['first'] = tuple(block['first'])
+                    block['last'] = tuple(block['last'])
+                index['lasts'] = [block['last'] for block in index['blocks']]
+                self._indexes[name] = index
+            return index
+
+    # Writing
+
+    @staticmethod
+    def archivable(cutoff):
+        """Filter for messages older than `cutoff` whose whole conversation is."""
+
+        live_conversations = (db.session.query(Message.root_id)
+                              .filter(Message.timestamp >= cutoff,
+                                      Message.root_id.isnot(None)))
+        return db.and_(Message.timestamp < cutoff,
+                       Message.id.notin_(live_conversations),
+                       db.or_(Message.root_id.is_(None),
+                              Message.root_id.notin_(live_conversations)))
+
+    def _rows(self, cutoff, batch_size):
+        like_count = (db.select([db.func.count(Likes.id)])
+                      .where(Likes.message_id == Message.id)
+                      .scalar_subquery())
+        columns = [getattr(Message, name) for name in COLUMNS[:-1]] + [like_count]
+
+        return (db.session.query(*columns)
+                .filter(self.archivable(cutoff))
+                .order_by(Message.user_id, *Message.newest_first())
+                .execution_options(stream_results=True)
+                .yield_per(batch_size))
+
+    def _write_blocks(self, f, rows):
+        """Write `rows` to `f` in gzipped blocks; returns the block index
+        and the number of messages per user."""
+
+        blocks = []
+        counts = {}
+
+        def flush(block):
+            data = gzip.compress(''.join(map(_row_line, block)).encode())
+            blocks.append({'offset': f.tell(), 'length': len(data),
+                           'first': _row_key(block[0]), 'last': _row_key(block[-1])})
+            f.write(data)
+
+        block = []
+        for row in rows:
+            row = dict(zip(COLUMNS, row))
+            counts[row['user_id']] = counts.get(row['user_id'], 0) + 1
+            block.append(row)
+            if len(block) == self.block_size:
+                flush(block)
+                block = []
+        if block:
+            flush(block)
+
+        return blocks, counts
+
+    def _write_segment(self, name, rows):
+        """Write `rows`, in segment order, as segment `name`. Returns how
+        many there were; for none, nothing is written."""
+
+        data_path = self._path(name, '.ndjson.gz')
+        with open(data_path + '.tmp', 'wb') as f:
+            blocks, counts = self._write_blocks(f, rows)
+            f.flush()
+            os.fsync(f.fileno())
+        if not blocks:
+            os.remove(data_path + '.tmp')
+            return 0
+        os.replace(data_path + '.tmp', data_path)
+        _write_json(self._path(name, '.idx.json'), {'blocks': blocks, 'counts': counts})
+
+        return sum(counts.values())
+
+    def _remove_segment(self, name):
+        for suffix in ('.ndjson.gz', '.idx.json'):
+            try:
+                os.remove(self._path(name, suffix))
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._indexes.pop(name, None)
+
+    def archive(self, cutoff, batch_size=DELETE_BATCH_SIZE):
+        """Move the messages older than `cutoff` into a new segment.
+
+        Finishes any interrupted earlier run first. Returns how many
+        messages were archived by this run.
+        """
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._finish_interrupted(batch_size)
+        self._apply_tombstones()
+
+        name = f"segment-{cutoff:%Y%m%dT%H%M%S}"
+        if not self._write_segment(name, self._rows(cutoff, batch_size)):
+            return 0
+
+        return self._finish(name, batch_size)
+
+    def _finish_interrupted(self, batch_size):
+        """Finish segments that were written but never made the manifest,
+        and remove the remains of interrupted rewrites."""
+
+        manifest = self._manifest()
+        finished = {segment['name'] for segment in manifest['segments']}
+        retired = set(manifest.get('retired', ()))
+        filenames = sorted(os.listdir(self.directory))
+        for filename in filenames:
+            # Partly written files, and data whose index never got written
+            if (filename.endswith('.tmp')
+                    or filename.endswith('.ndjson.gz')
+                    and filename.replace('.ndjson.gz', '.idx.json') not in filenames):
+                os.remove(os.path.join(self.directory, filename))
+            elif filename.endswith('.idx.json'):
+                name = filename[:-len('.idx.json')]
+                if name in retired or REWRITTEN in name and name not in finished:
+                    self._remove_segment(name)
+                elif name not in finished:
+                    self._finish(name, batch_size)
+
+        if retired:
+            manifest['retired'] = []
+            _write_json(os.path.join(self.directory, MANIFEST), manifest)
+
+    def _apply_tombstones(self):
+        """Rewrite the segments holding tombstoned messages without them,
+        then drop the tombstones."""
+
+        users, roots = self._tombstones()
+        if not users and not roots:
+            return
+
+        def purged(row):
+            return row.user_id in users or row.root_id in roots
+
+        for segment in self._manifest()['segments']:
+            name = segment['name']
+            if not any(map(purged, self._segment_rows(name))):
+                continue
+
+            rewritten = (f"{name.split(REWRITTEN)[0]}{REWRITTEN}"
+                         f"{datetime.utcnow():%Y%m%dT%H%M%S%f}")
+            count = self._write_segment(rewritten, itertools.filterfalse(
+                purged, self._segment_rows(name)))
+
+            manifest = self._manifest()
+            manifest['segments'] = [other for other in manifest['segments']
+                                    if other['name'] != name]
+            if count:
+                manifest['segments'].append(dict(segment, name=rewritten, count=count))
+            manifest.setdefault('retired', []).append(name)
+            _write_json(os.path.join(self.directory, MANIFEST), manifest)
+
+            self._remove_segment(name)
+            manifest['retired'].remove(name)
+            _write_json(os.path.join(self.directory, MANIFEST), manifest)
+
+        # Keep any tombstones added meanwhile
+        with self._lock:
+            now_users, now_roots = self._tombstones()
+            self._write_tombstones(now_users - users, now_roots - roots)
+
+    def purge_user(self, user_id):
+        """Tombstone `user_id`'s archived messages, and the replies in the
+        conversations they started (as deletion.purge_user does in the
+        table). Reads skip them from now on; the next `archive` run
+        removes them from the files.
+        """
+
+        segments = self._manifest()['segments']
+        found = False
+        roots = set()
+        for segment in segments:
+            for row in self._rows_after(segment['name'], user_id, _user_start(user_id)):
+                found = True
+                if row.root_id is None and row.reply_count:
+                    roots.add(row.id)
+        if not found:
+            return
+
+        with self._lock:
+            users, known_roots = self._tombstones()
+            self._write_tombstones(users | {user_id}, known_roots | roots)
+
+    def _finish(self, name, batch_size):
+        """Delete a written segment's messages from the table and add it to
+        the manifest. Returns the segment's message count."""
+
+        ids = []
+        min_ts = max_ts = None
+        for block in self._index(name)['blocks']:
+            for row in self._read_block(name, block):
+                ids.append(row.id)
+                min_ts = min(min_ts or row.timestamp, row.timestamp)
+                max_ts = max(max_ts or row.timestamp, row.timestamp)
+
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            for model in (Likes, Repost, Notification):
+                (model.query
+                 .filter(model.message_id.in_(batch))
+                 .delete(synchronize_session=False))
+            Message.query.filter(Message.id.in_(batch)).delete(synchronize_session=False)
+            db.session.commit()
+
+        manifest = self._manifest()
+        manifest['segments'].append({'name': name, 'count': len(ids),
+                                     'min_ts': min_ts.isoformat(),
+                                     'max_ts': max_ts.isoformat()})
+        _write_json(os.path.join(self.directory, MANIFEST), manifest)
+
+        return len(ids)
+
+    # Reading
+
+    def _read_block(self, name, block):
+        with open(self._path(name, '.ndjson.gz'), 'rb') as f:
+            f.seek(block['offset'])
+            data = gzip.decompress(f.read(block['length']))
+
+        for line in data.decode().splitlines():
+            row = json.loads(line)
+            row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+            yield ArchivedMessage(**row)
+
+    def _segment_rows(self, name):
+        """Every message in segment `name`, in segment order."""
+
+        for block in self._index(name)['blocks']:
+            yield from self._read_block(name, block)
+
+    def _rows_after(self, name, user_id, start):
+        """`user_id`'s messages in segment `name` that come after sort key
+        `start`, newest first."""
+
+        index = self._index(name)
+        position = bisect.bisect_right(index['lasts'], start)
+        for block in index['blocks'][position:]:
+            if block['first'][0] > user_id:
+                return
+            for row in self._read_block(name, block):
+                if row.user_id > user_id:
+                    return
+                if _sort_key(row.user_id, row.timestamp, row.id) > start:
+                    yield row
+
+    def _segment_page(self, name, user_id, start, limit, roots):
+        """Up to `limit` of `user_id`'s messages in segment `name` that come
+        after sort key `start`, leaving out replies under `roots`."""
+
+        rows = self._rows_after(name, user_id, start)
+        return list(itertools.islice((row for row in rows if row.root_id not in roots),
+                                     limit))
+
+    def user_page(self, user_id, before=None, limit=100):
+        """Up to `limit` of `user_id`'s archived messages, newest first,
+        starting after the `before` cursor if given.
+
+        Raises ValueError if `before` is malformed.
+        """
+
+        if before:
+            timestamp, message_id = Message.parse_cursor(before)
+            start = _sort_key(user_id, timestamp, message_id)
+        else:
+            timestamp, start = None, _user_start(user_id)
+
+        users, roots = self._tombstones()
+        if user_id in users:
+            return []
+
+        segments = sorted(self._manifest()['segments'],
+                          key=lambda segment: segment['max_ts'], reverse=True)
+        page = []
+        for segment in segments:
+            if timestamp and datetime.fromisoformat(segment['min_ts']) > timestamp:
+                continue
+            # Segments normally cover disjoint times, newest first; stop once
+            # the page is full and nothing older can beat what it has
+            if (len(page) == limit
+                    and datetime.fromisoformat(segment['max_ts']) < page[-1].timestamp):
+                break
+            page += self._segment_page(segment['name'], user_id, start, limit, roots)
+            page.sort(key=lambda row: _sort_key(row.user_id, row.timestamp, row.id))
+            del page[limit:]
+
+        return page
+
+    def count(self, user_id):
+        """How many of `user_id`'s messages are in the archive."""
+
+        users, roots = self._tombstones()
+        if user_id in users:
+            return 0
+
+        segments = self._manifest()['segments']
+        if roots:
+            return sum(row.root_id not in roots
+                       for segment in segments
+                       for row in self._rows_after(segment['name'], user_id,
+                                                   _user_start(user_id)))
+
+        return sum(self._index(segment['name'])['counts'].get(str(user_id), 0)
+                   for segment in segments)
+
+    def rows(self, user_id=None):
+        """Every archived message, or only `user_id`'s, a segment at a time."""
+
+        users, roots = self._tombstones()
+        if user_id in users:
+            return
+
+        for segment in self._manifest()['segments']:
+            name = segment['name']
+            if user_id is None:
+                rows = self._segment_rows(name)
+            else:
+                rows = self._rows_after(name, user_id, _user_start(user_id))
+            for row in rows:
+                if row.user_id not in users and row.root_id not in roots:
+                    yield row
@@ -0,0 +1,254 @@
+"""Static asset pipeline for Warbler.
+
+`flask build-assets` copies everything under static/ into ASSETS_DIR with
+a hash of its content in the file name (style.css becomes
+style.1a2b3c4d5e.css). Our CSS is minified and its url()s are pointed at
+the hashed names. Text files also get gzip copies, plus brotli copies if
+the brotli package is installed. manifest.json maps each static path to
+its built name.
+
+Templates link assets through `asset_url('stylesheets/style.css')`. A
+hashed name always has the same content, so /assets/ serves it with a
+year-long immutable Cache-Control and browsers never ask for it again.
+An edit gets a new name. Without a build (as in development),
+`asset_url` links the plain /static/ file.
+
+The CDN dependencies are to be vendored: `flask vendor-assets` downloads
+the pinned versions in VENDOR into static/vendor/, to be committed with
+the app. That hasn't happened yet, so for now `asset_url` links the same
+versions on their CDNs.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+import urllib.request
+from urllib.parse import urljoin, urlsplit
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+# Static path: pinned CDN URL
+VENDOR = {
+    'vendor/bootstrap.min.css':
+        'https://unpkg.com/bootstrap@4.1.3/dist/css/bootstrap.min.css',
+    'vendor/jquery.min.js':
+        'https://unpkg.com/jquery@3.3.1/dist/jquery.min.js',
+    'vendor/popper.min.js':
+        'https://unpkg.com/popper.js@1.14.3/dist/umd/popper.min.js',
+    'vendor/bootstrap.min.js':
+        'https://unpkg.com/bootstrap@4.1.3/dist/js/bootstrap.min.js',
+    'vendor/fontawesome/css/all.css':
+        'https://use.fontawesome.com/releases/v5.3.1/css/all.css',
+}
+
+# Worth compressing; images and web fonts already are
+COMPRESSIBLE = {'.css', '.js', '.json', '.svg', '.ico', '.ttf', '.eot', '.txt'}
+
+# Best first; the names are Content-Encoding values
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+MANIFEST = 'manifest.json'
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+def fetch_url(url, timeout=30):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.read()
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _local_refs(css):
+    """The relative url()s in `css`, without their query or fragment."""
+
+    for _, ref in CSS_URL.findall(css):
+        parts = urlsplit(ref)
+        if not parts.scheme and not parts.netloc and not parts.path.startswith('/'):
+            yield parts.path
+
+
+def vendor(static_dir, fetch=fetch_url):
+    """Download VENDOR, and the fonts and images its CSS uses, into
+    `static_dir`. Returns the static paths written."""
+
+    written = []
+    for path, url in VENDOR.items():
+        data = fetch(url)
+        _write(os.path.join(static_dir, path), data)
+        written.append(path)
+        if path.endswith('.css'):
+            for ref in sorted(set(_local_refs(data.decode()))):
+                ref_path = posixpath.normpath(posixpath.join(posixpath.dirname(path), ref))
+                _write(os.path.join(static_dir, ref_path), fetch(urljoin(url, ref)))
+                written.append(ref_path)
+
+    return written
+
+
+def minify_css(css):
+    """Drop comments and the whitespace around punctuation."""
+
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r'(?<=[{;])([\w-]+):\s+', r'\1:', css)
+    return css.replace(';}', '}').strip()
+
+
+def fingerprint(path, data):
+    """`path` with a hash of `data` before its extension."""
+
+    root, ext = posixpath.splitext(path)
+    return f"{root}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+
+
+def _rewrite_urls(css, path, assets):
+    """Point `css`'s url()s to static files at their built names, relative
+    to the stylesheet at static `path`."""
+
+    def replace(match):
+        quote, ref = match.groups()
+        parts = urlsplit(ref)
+        if parts.scheme or parts.netloc:
+            return match.group(0)
+        if parts.path.startswith('/static/'):
+            target = parts.path[len('/static/'):]
+        else:
+            target = posixpath.normpath(posixpath.join(posixpath.dirname(path), parts.path))
+        if target not in assets:
+            return match.group(0)
+        url = posixpath.relpath(assets[target], posixpath.dirname(path) or '.')
+        if parts.query:
+            url += '?' + parts.query
+        if parts.fragment:
+            url += '#' + parts.fragment
+        return f"url({quote}{url}{quote})"
+
+    return CSS_URL.sub(replace, css)
+
+
+def _compressed(data):
+    """{encoding: compressed data}, for the encodings that save space."""
+
+    found = {'gzip': gzip.compress(data, 9, mtime=0)}
+    if brotli:
+        found['br'] = brotli.compress(data, quality=11)
+
+    return {encoding: packed for encoding, packed in found.items() if len(packed) < len(data)}
+
+
+def build(static_dir, out_dir):
+    """Build every file under `static_dir` into `out_dir` and write the
+    manifest. Returns {static path: built path}.
+
+    Earlier builds are left in place, for pages still linking them.
+    """
+
+    paths = []
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = [name for name in dirs if not name.startswith('.')]
+        for name in files:
+            if not name.startswith('.'):
+                rel = os.path.relpath(os.path.join(root, name), static_dir)
+                paths.append(rel.replace(os.sep, '/'))
+
+    # Stylesheets last, so the files they use already have built names
+    paths.sort(key=lambda path: (path.endswith('.css'), path))
+
+    assets = {}
+    encodings = {}
+    for path in paths:
+        with open(os.path.join(static_dir, path), 'rb') as f:
+            data = f.read()
+
+        if path.endswith('.css'):
+            css = data.decode()
+            if not path.endswith('.min.css'):
+                css = minify_css(css)
+            # Hashed with the names it links to, so it changes with them
+            data = _rewrite_urls(css, path, assets).encode()
+
+        built = assets[path] = fingerprint(path, data)
+        _write(os.path.join(out_dir, built), data)
+
+        if posixpath.splitext(path)[1] in COMPRESSIBLE:
+            compressed = _compressed(data)
+            for encoding, packed in compressed.items():
+                _write(os.path.join(out_dir, built + SUFFIXES[encoding]), packed)
+            encodings[built] = [encoding for encoding in ENCODINGS if encoding in compressed]
+        else:
+            encodings[built] = []
+
+    _write(os.path.join(out_dir, MANIFEST),
+           json.dumps({'assets': assets, 'encodings': encodings}, indent=1).encode())
+
+    return assets
+
+
+class Assets:
+    """The built assets in `directory`, as listed by its manifest."""
+
+    def __init__(self, directory, static_dir):
+        self.directory = directory
+        self.static_dir = static_dir
+        self._manifest = None
+        self._cdn = {}
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            try:
+                with open(os.path.join(self.directory, MANIFEST)) as f:
+                    self._manifest = json.load(f)
+            except FileNotFoundError:
+                self._manifest = {'assets': {}, 'encodings': {}}
+        return self._manifest
+
+    def reload(self):
+        """Read the manifest again, after a build."""
+
+        self._manifest = None
+        self._cdn = {}
+
+    def built(self, path):
+        """The built name of static `path`, or None if it wasn't built."""
+
+        return self.manifest['assets'].get(path)
+
+    def cdn_url(self, path):
+        """The CDN URL of a vendored `path` that hasn't been downloaded."""
+
+        if path not in self._cdn:
+            missing = not os.path.exists(os.path.join(self.static_dir, path))
+            self._cdn[path] = VENDOR.get(path) if missing else None
+        return self._cdn[path]
+
+    def find(self, filename, accepted):
+        """(file path, content encoding) to serve built `filename` to a
+        client accepting the encodings in `accepted`; (None, None) if
+        `filename` isn't a built asset."""
+
+        encodings = self.manifest['encodings'].get(filename)
+        if encodings is None:
+            return None, None
+
+        path = os.path.join(self.directory, *filename.split('/'))
+        for encoding in encodings:
+            if encoding in accepted:
+                return path + SUFFIXES[encoding], encoding
+
+        return path, None
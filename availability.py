@@ -0,0 +1,118 @@
+"""Username and email availability for Warbler.
+
+Signing up hashes a password with bcrypt, which is slow on purpose, so a
+taken username should be turned away before that, not by the unique
+index after it. `Availability.is_taken` answers from a Bloom filter of
+every username and email in use, lowercased: a miss means the name is
+free, with no query at all; a hit (a taken name, or rarely a false
+positive) is confirmed with one lookup on the case-insensitive unique
+index.
+
+The filters are filled from the users table on first use and kept up to
+date as this process inserts users and edits profiles. Another process's
+new users aren't in them, so the unique indexes still have the last word.
+"""
+
+import hashlib
+import math
+import threading
+
+import numpy as np
+from sqlalchemy import event
+
+from models import db, User
+
+FIELDS = {
+    'username': User.username,
+    'email': User.email,
+}
+
+
+class BloomFilter:
+    """Set membership with no false negatives and about `error_rate`
+    false positives, for up to `capacity` items."""
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = np.zeros(self.size, dtype=bool)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + n * second) % self.size for n in range(self.hashes)]
+
+    def add(self, item):
+        self._bits[self._positions(item)] = True
+
+    def __contains__(self, item):
+        return bool(self._bits[self._positions(item)].all())
+
+
+class Availability:
+    """Which usernames and emails are taken, case-insensitively."""
+
+    def __init__(self, headroom=100000, batch_size=10000):
+        self.headroom = headroom
+        self.batch_size = batch_size
+        self._filters = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """Fill the filters from the users table, once."""
+
+        with self._lock:
+            if self._filters is None:
+                count = db.session.query(db.func.count(User.id)).scalar()
+                filters = {field: BloomFilter(count * 2 + self.headroom)
+                           for field in FIELDS}
+                rows = (db.session
+                        .query(db.func.lower(User.username), db.func.lower(User.email))
+                        .execution_options(stream_results=True)
+                        .yield_per(self.batch_size))
+                for username, email in rows:
+                    filters['username'].add(username)
+                    filters['email'].add(email)
+                self._filters = filters
+
+            return self._filters
+
+    def _inserted(self, mapper, connection, user):
+        # Before the filters are loaded, loading will pick the row up
+        if self._filters is not None:
+            self.add(username=user.username, email=user.email)
+
+    def add(self, **values):
+        """Record newly taken values, e.g. `add(username='bob')`."""
+
+        filters = self._load()
+        for field, value in values.items():
+            filters[field].add(value.lower())
+
+    def is_taken(self, field, value, user_id=None):
+        """Is `value` already someone's `field` ('username' or 'email')?
+
+        `user_id`'s own values don't count, for profile edits.
+        """
+
+        value = value.lower()
+        if value not in self._load()[field]:
+            return False
+
+        column = FIELDS[field]
+        query = User.query.filter(db.func.lower(column) == value)
+        if user_id is not None:
+            query = query.filter(User.id != user_id)
+
+        return db.session.query(query.exists()).scalar()
+
+    def clear(self):
+        """Forget the filters; they are reloaded on next use."""
+
+        with self._lock:
+            self._filters = None
+
+
+availability = Availability()
+event.listen(User, 'after_insert', availability._inserted)
@@ -0,0 +1,201 @@
+"""Benchmark harness for Warbler.
+
+Runs the app in-process with Flask's test client and reports throughput
+and latency. It drops and re-seeds the tables of the database in
+DATABASE_URL, so point it at a scratch database:
+
+    DATABASE_URL=postgresql:///warbler-bench python benchmark.py posts
+    DATABASE_URL=postgresql:///warbler-bench python benchmark.py posts --group-commit
+    DATABASE_URL=postgresql:///warbler-bench python benchmark.py routes
+
+- posts: concurrent POST /messages/new, reported as posts/sec
+- routes: GET on the main pages as a logged-in user, reported per route
+  with the mean response size
+
+To weigh response compression (see compression.py) against its CPU
+cost, ask for an encoding, and optionally a gzip level:
+
+    DATABASE_URL=... python benchmark.py routes
+    DATABASE_URL=... python benchmark.py routes --encoding gzip --compression-level 1
+    DATABASE_URL=... python benchmark.py routes --encoding gzip --compression-level 9
+
+The configuration profile comes from WARBLER_ENV as usual (see config.py),
+so the cost of the development tooling can be compared directly:
+
+    WARBLER_ENV=development DATABASE_URL=... python benchmark.py routes
+    WARBLER_ENV=production SECRET_KEY=... DATABASE_URL=... python benchmark.py routes
+
+Each run ends with the process's peak resident memory.
+"""
+
+import argparse
+import resource
+import statistics
+import threading
+import time
+from csv import DictReader
+
+from app import app, CURR_USER_KEY
+from compression import CompressionMiddleware
+from models import db, User, Message, Follows
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['RATE_LIMIT_ENABLED'] = False
+
+# Hash from generator/users.csv, so seeding doesn't spend time in bcrypt
+PASSWORD_HASH = next(DictReader(open('generator/users.csv')))['password']
+
+
+def seed(users, messages_per_user, follows_per_user):
+    """Recreate the tables and fill them with synthetic data."""
+
+    db.drop_all()
+    db.create_all()
+
+    db.session.bulk_insert_mappings(User, [
+        dict(id=i, username=f"bench{i}", email=f"bench{i}@example.com",
+             password=PASSWORD_HASH, bio="Benchmarking Warbler.")
+        for i in range(1, users + 1)])
+    db.session.bulk_insert_mappings(Message, [
+        dict(text=f"Warble {n} from bench{i} #bench", user_id=i)
+        for i in range(1, users + 1) for n in range(messages_per_user)])
+    db.session.bulk_insert_mappings(Follows, [
+        dict(user_following_id=i, user_being_followed_id=(i + n) % users + 1)
+        for i in range(1, users + 1) for n in range(1, follows_per_user + 1)])
+    db.session.commit()
+
+
+def client_for(user_id):
+    """Test client logged in as `user_id`."""
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = user_id
+    return client
+
+
+def run_concurrently(request, total, concurrency, users):
+    """Call `request(client, i)` `total` times from `concurrency` threads.
+
+    Returns (elapsed seconds, latencies in seconds, responses).
+    """
+
+    latencies = []
+    responses = []
+    lock = threading.Lock()
+
+    def worker(worker_id):
+        client = client_for(worker_id % users + 1)
+        for i in range(worker_id, total, concurrency):
+            start = time.perf_counter()
+            response = request(client, i)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                responses.append(response)
+
+    threads = [threading.Thread(target=worker, args=(worker_id,))
+               for worker_id in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return time.perf_counter() - start, latencies, responses
+
+
+def report(label, elapsed, latencies, unit="req", size=None):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    line = (f"{label:<28} {len(latencies) / elapsed:>9.1f} {unit}/s"
+            f"   p50 {statistics.median(latencies) * 1000:>7.2f} ms"
+            f"   p95 {p95 * 1000:>7.2f} ms")
+    if size is not None:
+        line += f"   {size / 1024:>7.1f} KB"
+    print(line)
+
+
+def bench_posts(args):
+    app.config['MESSAGE_GROUP_COMMIT'] = args.group_commit
+
+    def post(client, i):
+        return client.post("/messages/new", data={"text": f"Burst warble {i}"})
+
+    elapsed, latencies, responses = run_concurrently(
+        post, args.requests, args.concurrency, args.users)
+    assert all(response.status_code == 302 for response in responses)
+
+    mode = "group commit" if args.group_commit else "commit per post"
+    report(f"posts ({mode})", elapsed, latencies, unit="posts")
+
+
+ROUTES = [
+    "/",
+    "/users",
+    "/users/1",
+    "/users/1/following",
+    "/users/1/followers",
+    "/messages/1",
+]
+
+
+def bench_routes(args):
+    headers = {'Accept-Encoding': args.encoding}
+    if args.compression_level is not None:
+        if not isinstance(app.wsgi_app, CompressionMiddleware):
+            raise SystemExit("--compression-level needs COMPRESSION_ENABLED")
+        app.wsgi_app.level = app.wsgi_app.brotli_quality = args.compression_level
+
+    for route in args.routes or ROUTES:
+        def get(client, i):
+            return client.get(route, headers=headers)
+
+        # Warm up (template compilation, caches) before measuring
+        run_concurrently(get, args.concurrency, args.concurrency, args.users)
+        elapsed, latencies, responses = run_concurrently(
+            get, args.requests, args.concurrency, args.users)
+        assert all(response.status_code == 200 for response in responses)
+
+        # Bytes as sent, compressed or not
+        size = statistics.mean(len(response.data) for response in responses)
+        report(route, elapsed, latencies, size=size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('benchmark', choices=['posts', 'routes'])
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--messages-per-user', type=int, default=20)
+    parser.add_argument('--follows-per-user', type=int, default=10)
+    parser.add_argument('--group-commit', action='store_true',
+                        help="posts: turn on MESSAGE_GROUP_COMMIT")
+    parser.add_argument('--routes', nargs='*',
+                        help="routes: paths to request instead of the defaults")
+    parser.add_argument('--encoding', choices=['identity', 'gzip', 'br'],
+                        default='identity',
+                        help="routes: the Accept-Encoding to send")
+    parser.add_argument('--compression-level', type=int,
+                        help="routes: gzip level (or brotli quality) to compress with")
+    args = parser.parse_args()
+
+    with app.app_context():
+        seed(args.users, args.messages_per_user, args.follows_per_user)
+
+    toolbar = "on" if app.config['DEBUG_TB_ENABLED'] else "off"
+    print(f"debug: {app.debug}, debug toolbar: {toolbar}")
+
+    if args.benchmark == 'posts':
+        bench_posts(args)
+    else:
+        bench_routes(args)
+
+    # ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"peak memory: {peak:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""In-process cache for Warbler.
+
+A bounded LRU map with a time-to-live per entry. Entries can carry tags
+(e.g. "user:42" on everything that embeds user 42's profile), so that a
+change invalidates every dependent entry at once with `invalidate_tag`.
+
+The cache is per process; the TTL bounds how stale another process's
+copy can get after an invalidation it didn't see.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class Cache:
+    """LRU cache with expiry and tag-based invalidation."""
+
+    def __init__(self, max_entries=10000, ttl=300, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Cached value of `key`, or `default` if missing or expired."""
+
+        with self._lock:
+            entry = self._entries.get(key, MISSING)
+            if entry is MISSING:
+                return default
+
+            value, expires_at, tags = entry
+            if expires_at <= self.clock():
+                self._remove(key)
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, tags=(), ttl=None):
+        """Cache `value` under `key`, tagged with `tags`."""
+
+        expires_at = self.clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, expires_at, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_tag(self, tag):
+        """Drop every entry tagged with `tag`."""
+
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, MISSING)
+        if entry is MISSING:
+            return
+
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+cache = Cache()
@@ -0,0 +1,224 @@
+"""Response compression for Warbler.
+
+`CompressionMiddleware` wraps the WSGI app and compresses text responses
+(pages, JSON, exports) with brotli or gzip, whichever the client's
+Accept-Encoding prefers. Brotli is used only if the brotli package is
+installed. Responses are left alone when they are:
+
+- smaller than `min_size` bytes, where compression saves too little to pay
+- not text, like images, which are compressed already
+- already encoded, like the precompressed files under /assets/
+- partial (206), or marked Cache-Control: no-transform, as the app marks
+  pages carrying a CSRF token, so the token can't be guessed from
+  compressed sizes (BREACH)
+
+A response with no Content-Length is buffered only until it is known to
+pass `min_size`. After that it is compressed as it streams, and each
+chunk the app yields is flushed, so a streamed export keeps trickling
+out instead of arriving at the end.
+
+`level` trades CPU for bandwidth: 1 (fast) to 9 for gzip, and
+`brotli_quality` 0 to 11 for brotli. Measure a route both ways with
+`python benchmark.py routes --encoding gzip --compression-level N`.
+"""
+
+import zlib
+
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+# Best first, on equal preference
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+
+MIMETYPES = (
+    'text/html',
+    'text/css',
+    'text/csv',
+    'text/plain',
+    'text/xml',
+    'application/json',
+    'application/javascript',
+    'application/x-ndjson',
+    'image/svg+xml',
+)
+
+
+class GzipCompressor:
+    def __init__(self, level):
+        self._zlib = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._zlib.compress(data)
+
+    def flush(self):
+        return self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._zlib.flush()
+
+
+class BrotliCompressor:
+    def __init__(self, quality):
+        self._brotli = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._brotli.process(data)
+
+    def flush(self):
+        return self._brotli.flush()
+
+    def finish(self):
+        return self._brotli.finish()
+
+
+def choose_encoding(accept_encoding, encodings=ENCODINGS):
+    """The one of `encodings` the Accept-Encoding header value prefers,
+    or None."""
+
+    accepted = parse_accept_header(accept_encoding or '')
+    best, best_quality = None, 0
+    for encoding in encodings:
+        quality = accepted[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+
+    return best
+
+
+def _header(headers, name):
+    name = name.lower()
+    return next((value for key, value in headers if key.lower() == name), None)
+
+
+class CompressionMiddleware:
+    """Compresses the responses of the WSGI app `app` (see module doc)."""
+
+    def __init__(self, app, min_size=500, level=6, brotli_quality=4, mimetypes=MIMETYPES):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.mimetypes = frozenset(mimetypes)
+
+    def compressor(self, encoding):
+        if encoding == 'br':
+            return BrotliCompressor(self.brotli_quality)
+        return GzipCompressor(self.level)
+
+    def __call__(self, environ, start_response):
+        encoding = choose_encoding(environ.get('HTTP_ACCEPT_ENCODING'))
+        if encoding is None or environ['REQUEST_METHOD'] == 'HEAD':
+            return self.app(environ, start_response)
+
+        started = []
+        written = []
+
+        def capture(status, headers, exc_info=None):
+            started[:] = [status, headers, exc_info]
+            return written.append
+
+        result = self.app(environ, capture)
+
+        # Most responses can be judged on their headers alone, and those
+        # left alone go out untouched (file wrappers included)
+        if started and not self._may_compress(*started[:2]):
+            start_response(*started)
+            if written:
+                return _prepend(written, result)
+            return result
+
+        return self._compress(result, started, written, start_response, encoding)
+
+    def _may_compress(self, status, headers):
+        """False if the response shouldn't be compressed whatever its body."""
+
+        content_type = (_header(headers, 'Content-Type') or '').split(';')[0].strip()
+        length = _header(headers, 'Content-Length')
+        return not (status.startswith(('204', '206', '304'))
+                    or content_type.lower() not in self.mimetypes
+                    or _header(headers, 'Content-Encoding')
+                    or 'no-transform' in (_header(headers, 'Cache-Control') or '')
+                    or (length is not None and int(length) < self.min_size))
+
+    def _compress(self, result, started, body, start_response, encoding):
+        chunks = iter(result)
+        try:
+            # Read until we have the headers, and either min_size bytes or
+            # the whole body
+            finished = False
+            size = sum(map(len, body))
+            while not started or (size < self.min_size
+                                  and _header(started[1], 'Content-Length') is None):
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    finished = True
+                    break
+                body.append(chunk)
+                size += len(chunk)
+
+            status, headers, exc_info = started
+            if (not self._may_compress(status, headers)
+                    or (finished and size < self.min_size)):
+                start_response(status, headers, exc_info)
+                yield from body
+                yield from chunks
+                return
+
+            start_response(status, self._compressed_headers(headers, encoding), exc_info)
+            compressor = self.compressor(encoding)
+            if finished:
+                yield compressor.compress(b''.join(body)) + compressor.finish()
+                return
+
+            # A body without a length is a stream: send what each chunk
+            # compresses to as it comes
+            streaming = _header(headers, 'Content-Length') is None
+            for part in (body, chunks):
+                for chunk in part:
+                    data = compressor.compress(chunk)
+                    if streaming:
+                        data += compressor.flush()
+                    if data:
+                        yield data
+            yield compressor.finish()
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    @staticmethod
+    def _compressed_headers(headers, encoding):
+        compressed = []
+        vary = []
+        for key, value in headers:
+            name = key.lower()
+            if name in ('content-length', 'accept-ranges'):
+                continue
+            if name == 'vary':
+                vary.extend(item.strip() for item in value.split(','))
+                continue
+            if name == 'etag' and not value.startswith('W/'):
+                # Same content, different bytes
+                value = 'W/' + value
+            compressed.append((key, value))
+
+        if 'accept-encoding' not in (item.lower() for item in vary):
+            vary.append('Accept-Encoding')
+        compressed.append(('Vary', ', '.join(vary)))
+        compressed.append(('Content-Encoding', encoding))
+        return compressed
+
+
+def _prepend(chunks, result):
+    """`chunks`, then the app iterable `result`, which is closed after."""
+
+    try:
+        yield from chunks
+        yield from result
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
@@ -0,0 +1,178 @@
+"""Configuration profiles for Warbler.
+
+app.py loads one of these classes, picked by the WARBLER_ENV environment
+variable (or FLASK_ENV if that isn't set), defaulting to production:
+
+    WARBLER_ENV=development flask run
+
+Only the development profile turns on debug mode and the debug toolbar,
+which instruments every request and injects itself into every page.
+Settings that come from the environment (DATABASE_URL, SECRET_KEY, the
+cache directories) are read when this module is imported. Production
+has no default SECRET_KEY, which signs sessions and image proxy URLs:
+`config_for` refuses a profile without one.
+"""
+
+import os
+
+INSTANCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+
+
+class Config:
+    """Settings shared by every profile."""
+
+    DEBUG = False
+    TESTING = False
+
+    # Get DB_URI from environ variable (useful for production/testing) or,
+    # if not set there, use development local db.
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgresql:///warbler')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    SQLALCHEMY_RECORD_QUERIES = False
+
+    SECRET_KEY = os.environ.get('SECRET_KEY', "it's a secret")
+
+    DEBUG_TB_ENABLED = False
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+
+    ACCOUNT_PURGE_ASYNC = True
+    ACCOUNT_PURGE_BATCH_SIZE = 1000
+
+    FOLLOWS_PER_PAGE = 48
+    MESSAGES_PER_PAGE = 100
+    THREAD_PAGE_SIZE = 50
+    THREAD_MAX_DEPTH = 4
+    SUGGESTIONS_COUNT = 5
+    # Home timelines of people following more than this many are read in
+    # buckets of this many, on up to TIMELINE_WORKERS threads
+    TIMELINE_BUCKET_SIZE = 500
+    TIMELINE_WORKERS = 8
+    TRENDING_COUNT = 10
+    # Each process keeps the follow graph in memory for recommendations and
+    # reloads it this many seconds after loading it, to pick up the others'
+    # follows; pages read the viewer's follows from the database instead
+    FOLLOW_GRAPH_MAX_AGE = 60
+    # Each process caches message views and only drops its own copies when
+    # a message is deleted, so the others may show it this many seconds more
+    MESSAGE_CACHE_TTL = 15
+    # Each worker counts trends itself, and pools its counts with the
+    # others' through this directory every SYNC_SECONDS (see trending.py)
+    TRENDS_DIR = os.environ.get('TRENDS_DIR', os.path.join(INSTANCE_DIR, 'trends'))
+    TRENDS_SYNC_SECONDS = 30
+
+    # Notifications arriving within MAX_WAIT seconds are written together
+    NOTIFICATIONS_ASYNC = True
+    NOTIFICATIONS_MAX_BATCH = 500
+    NOTIFICATIONS_MAX_WAIT = 1.0
+    NOTIFICATIONS_PER_PAGE = 50
+    # Each process caches unread counts and only drops its own copies when
+    # notifications arrive, so another's badge may lag by this many seconds
+    NOTIFICATIONS_UNREAD_TTL = 15
+
+    MESSAGE_GROUP_COMMIT = False
+    MESSAGE_GROUP_COMMIT_MAX_BATCH = 100
+    MESSAGE_GROUP_COMMIT_MAX_WAIT = 0.005
+
+    IMAGE_CACHE_DIR = os.environ.get(
+        'IMAGE_CACHE_DIR', os.path.join(INSTANCE_DIR, 'image-cache'))
+    IMAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+    # Seconds before retrying an image URL that couldn't be fetched or decoded
+    IMAGE_PROXY_FAILURE_TTL = 60
+
+    # Messages older than this move to compressed files (`flask archive-messages`)
+    ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', os.path.join(INSTANCE_DIR, 'archive'))
+    ARCHIVE_AFTER_DAYS = 365
+
+    # Where session data lives (see sessions.py): 'file', shared by every
+    # process on the machine, or 'memory', per process
+    SESSION_BACKEND = 'file'
+    SESSION_DIR = os.environ.get('SESSION_DIR', os.path.join(INSTANCE_DIR, 'sessions'))
+    SESSION_MAX_ENTRIES = 100000
+
+    # Built static files (`flask build-assets`, see assets.py)
+    ASSETS_DIR = os.environ.get('ASSETS_DIR', os.path.join(INSTANCE_DIR, 'assets'))
+
+    # Compress text responses of at least MIN_SIZE bytes (see compression.py);
+    # LEVEL is gzip's, 1-9, and BROTLI_QUALITY brotli's, 0-11
+    COMPRESSION_ENABLED = True
+    COMPRESSION_MIN_SIZE = 500
+    COMPRESSION_LEVEL = 6
+    COMPRESSION_BROTLI_QUALITY = 4
+
+    TEMPLATE_CACHE_DIR = os.environ.get(
+        'TEMPLATE_CACHE_DIR', os.path.join(INSTANCE_DIR, 'template-cache'))
+    STARTUP_WARMUP = True
+
+    # POST quotas per endpoint, per logged-in user or else per IP address
+    RATE_LIMIT_ENABLED = True
+    RATE_LIMITS = {
+        'signup': '5/hour',
+        'login': '10/minute',
+        'messages_add': '30/minute',
+        'messages_reply': '30/minute',
+        'messages_repost': '60/minute',
+        'add_follow': '60/minute',
+        'stop_following': '60/minute',
+        'like_dislike': '60/minute',
+    }
+
+
+class DevelopmentConfig(Config):
+    """Local development: debug mode, the debug toolbar and query recording."""
+
+    DEBUG = True
+    SQLALCHEMY_RECORD_QUERIES = True
+    DEBUG_TB_ENABLED = True
+    DEBUG_TB_INTERCEPT_REDIRECTS = True
+
+    # Templates are edited as the app runs; compile them on demand
+    STARTUP_WARMUP = False
+
+
+class TestingConfig(Config):
+    """The test suite: synchronous side effects, no CSRF, warm-up or
+    rate limits.
+    """
+
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgresql:///warbler-test')
+    WTF_CSRF_ENABLED = False
+    ACCOUNT_PURGE_ASYNC = False
+    NOTIFICATIONS_ASYNC = False
+    SESSION_BACKEND = 'memory'
+    TRENDS_DIR = None
+    STARTUP_WARMUP = False
+    RATE_LIMIT_ENABLED = False
+
+
+class ProductionConfig(Config):
+    """Deployed workers: no debug tooling, templates never reloaded."""
+
+    TEMPLATES_AUTO_RELOAD = False
+    # The shared default is in the source; production must be given its own
+    SECRET_KEY = os.environ.get('SECRET_KEY')
+
+
+CONFIGS = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
+
+
+def config_for(name=None):
+    """The profile called `name`, or the one the environment asks for.
+
+    Raises KeyError for an unknown name, and RuntimeError if the profile
+    has no SECRET_KEY.
+    """
+
+    if name is None:
+        name = os.environ.get('WARBLER_ENV') or os.environ.get('FLASK_ENV') or 'production'
+
+    config = CONFIGS[name]
+    if not config.SECRET_KEY:
+        raise RuntimeError(f"Set SECRET_KEY in the environment to run the {name} profile")
+
+    return config
@@ -0,0 +1,178 @@
+"""Account deletion for Warbler.
+
+Deleting a user happens in two phases:
+
+- a soft delete, which stamps `users.deleted_at` and is visible at once
+- a purge, which hard deletes the user's rows a batch at a time, each batch
+  in its own short transaction, recording progress in `account_deletions`
+
+That way no single transaction loads or locks the user's whole history.
+Messages already moved to the message archive are tombstoned there, if
+the purge is given the archive (see archive.py).
+"""
+
+import threading
+from datetime import datetime
+
+from models import (db, User, Message, Follows, Likes, Repost, Notification,
+                    NotificationActor, Suggestion, AccountDeletion)
+
+PURGE_BATCH_SIZE = 1000
+
+
+def soft_delete_user(user):
+    """Hide `user` and queue their account for purging.
+
+    Doesn't commit; the caller does.
+    """
+
+    user.deleted_at = datetime.utcnow()
+    db.session.add(AccountDeletion(user_id=user.id))
+
+
+def _purge_steps(user_id):
+    """(model, id column, criterion) for each kind of row to purge.
+
+    Ordered so that rows are gone before anything they reference.
+    """
+
+    owned_messages = (db.session
+                      .query(Message.id)
+                      .filter(Message.user_id == user_id))
+
+    # Their messages, and other people's replies in conversations they
+    # started. Foreign keys can't cascade these (see Message.remove).
+    in_conversation = Message.root_id.in_(owned_messages)
+    doomed_messages = (db.session
+                       .query(Message.id)
+                       .filter(db.or_(Message.user_id == user_id, in_conversation)))
+
+    return [
+        (Likes, Likes.id, Likes.user_id == user_id),
+        (Likes, Likes.id, Likes.message_id.in_(doomed_messages)),
+        (Repost, Repost.id, Repost.user_id == user_id),
+        (Repost, Repost.id, Repost.message_id.in_(doomed_messages)),
+        (NotificationActor, NotificationActor.actor_id,
+         NotificationActor.user_id == user_id),
+        (NotificationActor, NotificationActor.user_id,
+         NotificationActor.actor_id == user_id),
+        (Notification, Notification.id, Notification.user_id == user_id),
+        (Notification, Notification.id, Notification.message_id.in_(doomed_messages)),
+        (Suggestion, Suggestion.rank, Suggestion.user_id == user_id),
+        (Suggestion, Suggestion.user_id, Suggestion.suggested_id == user_id),
+        (Follows, Follows.user_being_followed_id,
+         Follows.user_following_id == user_id),
+        (Follows, Follows.user_following_id,
+         Follows.user_being_followed_id == user_id),
+        (Message, Message.id, in_conversation),
+        (Message, Message.id, Message.user_id == user_id),
+    ]
+
+
+def _delete_batch(model, id_column, criterion, batch_size):
+    """Delete up to `batch_size` rows of `model` matching `criterion`.
+
+    Returns how many rows were deleted.
+    """
+
+    ids = [row[0] for row in (db.session
+                              .query(id_column)
+                              .filter(criterion)
+                              .limit(batch_size))]
+    if not ids:
+        return 0
+
+    if model is Message:
+        _detach_replies(ids)
+
+    (model
+     .query
+     .filter(criterion, id_column.in_(ids))
+     .delete(synchronize_session=False))
+
+    return len(ids)
+
+
+def _detach_replies(message_ids):
+    """Before the messages `message_ids` go, take them off their parents'
+    reply counts, and leave the replies to them without a parent (as
+    Message.remove does).
+
+    In the batch's transaction, so an interrupted purge never counts a
+    reply twice.
+    """
+
+    parents = (db.session
+               .query(Message.parent_id, db.func.count(Message.id))
+               .filter(Message.id.in_(message_ids), Message.parent_id.isnot(None))
+               .group_by(Message.parent_id)
+               .all())
+    for parent_id, count in parents:
+        (Message.query
+         .filter(Message.id == parent_id)
+         .update({Message.reply_count: Message.reply_count - count},
+                 synchronize_session=False))
+
+    (Message.query
+     .filter(Message.parent_id.in_(message_ids))
+     .update({Message.parent_id: None}, synchronize_session=False))
+
+
+def purge_user(user_id, batch_size=PURGE_BATCH_SIZE, archive=None):
+    """Hard delete a soft-deleted user, one batch per transaction, and
+    their messages in `archive` (a MessageArchive) if given.
+
+    Safe to call again after an interruption: it picks up where the
+    recorded progress left off.
+    """
+
+    progress = AccountDeletion.query.get(user_id)
+    if progress is None or progress.finished_at is not None:
+        return
+
+    if archive is not None:
+        archive.purge_user(user_id)
+
+    for model, id_column, criterion in _purge_steps(user_id):
+        while True:
+            deleted = _delete_batch(model, id_column, criterion, batch_size)
+            if not deleted:
+                break
+            progress.rows_deleted += deleted
+            db.session.commit()
+
+    User.query.filter_by(id=user_id).delete(synchronize_session=False)
+    progress.rows_deleted += 1
+    progress.finished_at = datetime.utcnow()
+    db.session.commit()
+
+
+def schedule_purge(app, user_id, archive=None):
+    """Purge `user_id` off the request thread (or inline, if configured)."""
+
+    batch_size = app.config.get('ACCOUNT_PURGE_BATCH_SIZE', PURGE_BATCH_SIZE)
+
+    if not app.config.get('ACCOUNT_PURGE_ASYNC', True):
+        purge_user(user_id, batch_size, archive)
+        return
+
+    def run():
+        with app.app_context():
+            try:
+                purge_user(user_id, batch_size, archive)
+            finally:
+                db.session.remove()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def purge_pending(batch_size=PURGE_BATCH_SIZE, archive=None):
+    """Finish every purge that was interrupted. Returns how many ran."""
+
+    pending = [row.user_id for row in (AccountDeletion
+                                       .query
+                                       .filter(AccountDeletion.finished_at.is_(None)))]
+    for user_id in pending:
+        purge_user(user_id, batch_size, archive)
+
+    return len(pending)
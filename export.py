@@ -0,0 +1,153 @@
+"""Streaming export of Warbler data as CSV or NDJSON.
+
+Rows are read through a server-side cursor (`yield_per`), turned into
+lines and handed out in chunks as they come, so exporting a million rows
+takes no more memory than exporting ten. Queries select plain columns,
+not ORM objects, so nothing piles up in the session either.
+
+The CSV columns are the ones seed.py reads from generator/*.csv, plus the
+ids that rows refer to each other by, so a full export can be loaded back
+with seed.py. Exports of a single user's data leave out the password hash.
+Messages include those moved to the message archive, if given one (see
+archive.py), read back a block at a time after the ones in the table.
+"""
+
+import csv
+import io
+import itertools
+import json
+
+from sqlalchemy import or_
+
+from models import db, User, Message, Follows, Likes
+
+BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+USER_COLUMNS = ['id', 'email', 'username', 'image_url', 'password', 'bio',
+                'header_image_url', 'location']
+
+
+def _users(user_id):
+    if user_id is None:
+        columns = USER_COLUMNS
+        criterion = None
+    else:
+        columns = [name for name in USER_COLUMNS if name != 'password']
+        criterion = User.id == user_id
+
+    return [getattr(User, name) for name in columns], criterion, User.id
+
+
+def _messages(user_id):
+    columns = [Message.id, Message.text, Message.timestamp, Message.user_id]
+    criterion = None if user_id is None else Message.user_id == user_id
+    return columns, criterion, Message.id
+
+
+def _follows(user_id):
+    columns = [Follows.user_being_followed_id, Follows.user_following_id]
+    criterion = None if user_id is None else or_(
+        Follows.user_being_followed_id == user_id,
+        Follows.user_following_id == user_id)
+    return columns, criterion, Follows.user_being_followed_id
+
+
+def _likes(user_id):
+    columns = [Likes.id, Likes.user_id, Likes.message_id]
+    criterion = None if user_id is None else Likes.user_id == user_id
+    return columns, criterion, Likes.id
+
+
+# dataset -> function of a user id (None for everyone) returning
+# (columns, filter or None, ordering column)
+DATASETS = {
+    'users': _users,
+    'messages': _messages,
+    'follows': _follows,
+    'likes': _likes,
+}
+
+
+def export_rows(dataset, user_id=None, batch_size=BATCH_SIZE, archive=None):
+    """(column names, iterator of row tuples) for `dataset`, with archived
+    messages from `archive` (a MessageArchive) if given.
+
+    Raises KeyError for an unknown dataset.
+    """
+
+    columns, criterion, order = DATASETS[dataset](user_id)
+    query = db.session.query(*columns)
+    if criterion is not None:
+        query = query.filter(criterion)
+
+    rows = (query
+            .order_by(order)
+            .execution_options(stream_results=True)
+            .yield_per(batch_size))
+
+    names = [column.key for column in columns]
+    if dataset == 'messages' and archive is not None:
+        archived = (tuple(getattr(row, name) for name in names)
+                    for row in archive.rows(user_id))
+        rows = itertools.chain(rows, archived)
+
+    return names, rows
+
+
+def csv_lines(names, rows):
+    """A header line, then one CSV line per row."""
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+
+    def line(values):
+        writer.writerow(values)
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+    yield line(names)
+    for row in rows:
+        yield line(row)
+
+
+def ndjson_lines(names, rows):
+    """One JSON object per row, per line."""
+
+    for row in rows:
+        yield json.dumps(dict(zip(names, row)), default=str) + '\n'
+
+
+def chunked(lines, size=CHUNK_SIZE):
+    """Join `lines` into strings of about `size` characters."""
+
+    chunk = []
+    length = 0
+    for line in lines:
+        chunk.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(chunk)
+            chunk = []
+            length = 0
+
+    if chunk:
+        yield ''.join(chunk)
+
+
+def export(dataset, file_format, user_id=None, batch_size=BATCH_SIZE, archive=None):
+    """Chunks of `dataset` in `file_format` ('csv' or 'ndjson'), streamed.
+
+    Raises KeyError for an unknown dataset or format.
+    """
+
+    lines = {'csv': csv_lines, 'ndjson': ndjson_lines}[file_format]
+    names, rows = export_rows(dataset, user_id, batch_size, archive)
+    return chunked(lines(names, rows))
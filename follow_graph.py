@@ -0,0 +1,302 @@
+"""In-memory follow graph for Warbler.
+
+The `follows` table is held as two CSR (compressed sparse row) matrices,
+one per direction, indexed directly by user id:
+
+- `indptr[u]:indptr[u + 1]` is the slice of `indices` holding u's
+  neighbours, sorted, so membership is a binary search
+
+Follows and unfollows land in small per-user overlays of added/removed
+ids, which are folded back into the CSR arrays once they grow past
+`compact_after` edges. Queries merge the base row with its overlay and
+work on NumPy arrays, so set operations (mutual follows, shared
+followees) are vectorized.
+
+The graph is per process: it is loaded lazily through `loader`, kept up
+to date by the ORM events in models.py, and reloaded every `max_age`
+seconds to pick up changes made by other processes.
+"""
+
+import threading
+import time
+from array import array
+
+import numpy as np
+
+EMPTY = np.empty(0, dtype=np.int32)
+
+
+class _Csr:
+    """Adjacency lists of one direction of the graph."""
+
+    def __init__(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+
+    @classmethod
+    def from_edges(cls, src, dst):
+        """Build from parallel arrays of edge sources and destinations."""
+
+        size = int(max(src.max(initial=-1), dst.max(initial=-1))) + 1
+        order = np.lexsort((dst, src))
+        counts = np.bincount(src, minlength=size)
+        indptr = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return cls(indptr, dst[order].astype(np.int32))
+
+    def row(self, user_id):
+        if user_id < 0 or user_id + 1 >= len(self.indptr):
+            return EMPTY
+        return self.indices[self.indptr[user_id]:self.indptr[user_id + 1]]
+
+    def edges(self):
+        """(src, dst) arrays of every edge."""
+
+        src = np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int32),
+                        np.diff(self.indptr))
+        return src, self.indices
+
+
+def _contains(row, user_id):
+    i = np.searchsorted(row, user_id)
+    return i < len(row) and row[i] == user_id
+
+
+class _Direction:
+    """A CSR matrix plus the not-yet-compacted changes to it."""
+
+    def __init__(self, csr):
+        self.csr = csr
+        self.added = {}
+        self.removed = {}
+
+    def row(self, user_id):
+        row = self.csr.row(user_id)
+        removed = self.removed.get(user_id)
+        if removed:
+            row = row[~np.isin(row, list(removed))]
+        added = self.added.get(user_id)
+        if added:
+            row = np.union1d(row, np.fromiter(added, dtype=np.int32))
+        return row
+
+    def has(self, src, dst):
+        if dst in self.added.get(src, ()):
+            return True
+        if dst in self.removed.get(src, ()):
+            return False
+        return _contains(self.csr.row(src), dst)
+
+    def degree(self, user_id):
+        return (len(self.csr.row(user_id))
+                - len(self.removed.get(user_id, ()))
+                + len(self.added.get(user_id, ())))
+
+    def add(self, src, dst):
+        removed = self.removed.get(src)
+        if removed and dst in removed:
+            removed.discard(dst)
+        elif not _contains(self.csr.row(src), dst):
+            self.added.setdefault(src, set()).add(dst)
+
+    def discard(self, src, dst):
+        added = self.added.get(src)
+        if added and dst in added:
+            added.discard(dst)
+        elif _contains(self.csr.row(src), dst):
+            self.removed.setdefault(src, set()).add(dst)
+
+    def pending(self):
+        return (sum(len(ids) for ids in self.added.values())
+                + sum(len(ids) for ids in self.removed.values()))
+
+    def compact(self):
+        """Fold the overlays into a fresh CSR matrix."""
+
+        src, dst = self.csr.edges()
+        if self.removed:
+            removed = np.array([(s << 32) | d
+                                for s, ids in self.removed.items() for d in ids],
+                               dtype=np.int64)
+            keep = ~np.isin((src.astype(np.int64) << 32) | dst, removed)
+            src, dst = src[keep], dst[keep]
+        if self.added:
+            added = [(s, d) for s, ids in self.added.items() for d in ids]
+            src = np.concatenate([src, np.array([s for s, d in added], dtype=np.int32)])
+            dst = np.concatenate([dst, np.array([d for s, d in added], dtype=np.int32)])
+
+        self.csr = _Csr.from_edges(src, dst)
+        self.added = {}
+        self.removed = {}
+
+
+def _empty_direction():
+    return _Direction(_Csr(np.zeros(1, dtype=np.int64), EMPTY))
+
+
+class FollowGraph:
+    """Who follows whom, answered from memory."""
+
+    def __init__(self, loader=None, max_age=600, compact_after=10000):
+        self.loader = loader
+        self.max_age = max_age
+        self.compact_after = compact_after
+        self.listeners = []
+        self._following = _empty_direction()
+        self._followers = _empty_direction()
+        self._loaded_at = None
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+
+    def load(self, pairs):
+        """Replace the graph with (follower id, followed id) `pairs`."""
+
+        src = array('i')
+        dst = array('i')
+        for follower_id, followed_id in pairs:
+            src.append(follower_id)
+            dst.append(followed_id)
+        src = np.frombuffer(src, dtype=np.int32) if src else EMPTY
+        dst = np.frombuffer(dst, dtype=np.int32) if dst else EMPTY
+
+        with self._lock:
+            self._following = _Direction(_Csr.from_edges(src, dst))
+            self._followers = _Direction(_Csr.from_edges(dst, src))
+            self._loaded_at = time.monotonic()
+
+        self._notify(None)
+
+    def rebuild(self):
+        """Reload the graph through `loader`."""
+
+        self.load(self.loader())
+
+    def clear(self):
+        """Forget the graph; it is reloaded on next use."""
+
+        with self._lock:
+            self._following = _empty_direction()
+            self._followers = _empty_direction()
+            self._loaded_at = None
+
+        self._notify(None)
+
+    def _stale(self):
+        return (self._loaded_at is None
+                or time.monotonic() - self._loaded_at > self.max_age)
+
+    def ensure_loaded(self):
+        """Load the graph if it never was, or is older than `max_age`."""
+
+        if self.loader is None or not self._stale():
+            return
+        with self._load_lock:
+            if self._stale():
+                self.rebuild()
+
+    @property
+    def loaded(self):
+        return self._loaded_at is not None
+
+    def _notify(self, user_ids):
+        for listener in self.listeners:
+            listener(user_ids)
+
+    def add_follow(self, follower_id, followed_id):
+        """Record that `follower_id` started following `followed_id`."""
+
+        with self._lock:
+            self._following.add(follower_id, followed_id)
+            self._followers.add(followed_id, follower_id)
+            self._maybe_compact()
+
+        self._notify((follower_id, followed_id))
+
+    def remove_follow(self, follower_id, followed_id):
+        """Record that `follower_id` stopped following `followed_id`."""
+
+        with self._lock:
+            self._following.discard(follower_id, followed_id)
+            self._followers.discard(followed_id, follower_id)
+            self._maybe_compact()
+
+        self._notify((follower_id, followed_id))
+
+    def remove_user(self, user_id):
+        """Drop every edge to or from `user_id`."""
+
+        with self._lock:
+            for followed_id in self._following.row(user_id).tolist():
+                self._following.discard(user_id, followed_id)
+                self._followers.discard(followed_id, user_id)
+            for follower_id in self._followers.row(user_id).tolist():
+                self._following.discard(follower_id, user_id)
+                self._followers.discard(user_id, follower_id)
+            self._maybe_compact()
+
+        self._notify(None)
+
+    def _maybe_compact(self):
+        for direction in (self._following, self._followers):
+            if direction.pending() > self.compact_after:
+                direction.compact()
+
+    def following(self, user_id):
+        """Sorted array of the ids `user_id` follows."""
+
+        self.ensure_loaded()
+        with self._lock:
+            return self._following.row(user_id)
+
+    def followers(self, user_id):
+        """Sorted array of the ids following `user_id`."""
+
+        self.ensure_loaded()
+        with self._lock:
+            return self._followers.row(user_id)
+
+    def is_following(self, follower_id, followed_id):
+        self.ensure_loaded()
+        with self._lock:
+            return bool(self._following.has(follower_id, followed_id))
+
+    def is_following_many(self, follower_id, user_ids):
+        """Boolean array: does `follower_id` follow each of `user_ids`?"""
+
+        return np.isin(np.asarray(user_ids, dtype=np.int32),
+                       self.following(follower_id))
+
+    def following_count(self, user_id):
+        self.ensure_loaded()
+        with self._lock:
+            return self._following.degree(user_id)
+
+    def follower_count(self, user_id):
+        self.ensure_loaded()
+        with self._lock:
+            return self._followers.degree(user_id)
+
+    def mutual_follows(self, user_id):
+        """Ids that `user_id` follows and that follow `user_id` back."""
+
+        return np.intersect1d(self.following(user_id), self.followers(user_id),
+                              assume_unique=True)
+
+    def common_following(self, user_id, other_id):
+        """Ids followed by both users."""
+
+        return np.intersect1d(self.following(user_id), self.following(other_id),
+                              assume_unique=True)
+
+    def user_ids(self):
+        """Ids of every user with at least one edge."""
+
+        self.ensure_loaded()
+        with self._lock:
+            has_edges = [np.nonzero(np.diff(direction.csr.indptr))[0]
+                         for direction in (self._following, self._followers)]
+            overlay = [user_id
+                       for direction in (self._following, self._followers)
+                       for user_id in direction.added]
+            ids = np.union1d(*has_edges)
+            return np.union1d(ids, np.array(overlay, dtype=ids.dtype))
@@ -1,6 +1,23 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, TextAreaField
-from wtforms.validators import DataRequired, Email, Length
+from wtforms.validators import DataRequired, Email, Length, ValidationError
+
+from availability import availability
+
+
+class Available:
+    """Validator: nobody else has this username or email, in any case.
+
+    Checked before the password is hashed (see availability.py). On an
+    edit form, a value left as it was needs no check, and the form's
+    `user_id` is the user whose own values are fine.
+    """
+
+    def __call__(self, form, field):
+        if not field.data or field.data.lower() == (field.object_data or '').lower():
+            return
+        if availability.is_taken(field.name, field.data, getattr(form, 'user_id', None)):
+            raise ValidationError(f"{field.label.text} already taken")
 
 
 class MessageForm(FlaskForm):
@@ -12,8 +29,8 @@ class MessageForm(FlaskForm):
 class UserAddForm(FlaskForm):
     """Form for adding users."""
 
-    username = StringField('Username', validators=[DataRequired()])
-    email = StringField('E-mail', validators=[DataRequired(), Email()])
+    username = StringField('Username', validators=[DataRequired(), Available()])
+    email = StringField('E-mail', validators=[DataRequired(), Email(), Available()])
     password = PasswordField('Password', validators=[Length(min=6)])
     image_url = StringField('(Optional) Image URL')
 
@@ -21,8 +38,8 @@ class UserAddForm(FlaskForm):
 class UserEditForm(FlaskForm):
     """Form for adding users."""
 
-    username = StringField('Username', validators=[DataRequired()])
-    email = StringField('E-mail', validators=[DataRequired(), Email()])
+    username = StringField('Username', validators=[DataRequired(), Available()])
+    email = StringField('E-mail', validators=[DataRequired(), Email(), Available()])
     image_url = StringField('(Optional) Image URL')
     header_image_url = StringField('(Optional) Header Image URL')
     bio = StringField('(Optional) Bio')
@@ -0,0 +1,344 @@
+"""Image proxy for Warbler.
+
+Profile and header images are arbitrary remote URLs. Rather than have
+every page hot-link them at full size, templates point at
+/images/<size>?url=..., which serves a thumbnail that is fetched from the
+origin once, resized with Pillow and kept in a disk cache.
+
+Cache entries are named by the SHA-256 of their source URL (plus the size,
+for thumbnails), spread over two-character subdirectories.
+The cache evicts least recently used files once it grows past its byte
+budget, and a served thumbnail never changes for a given proxy URL, so
+responses are marked immutable.
+
+The proxy only serves URLs the app signed (see `ImageProxy.sign`), so it
+can't be used to fetch arbitrary URLs. It fetches only http(s) URLs on
+public addresses, and connects to the address it checked, so a DNS answer
+that changes in between can't point it at the server's own network. An
+original is kept only if it is an image within FETCH_MAX_BYTES.
+
+A URL that couldn't be proxied isn't tried again for `failure_ttl`
+seconds, so a dead origin costs one FETCH_TIMEOUT per worker and period
+rather than one per page view.
+"""
+
+import hashlib
+import hmac
+import http.client
+import io
+import ipaddress
+import os
+import socket
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from PIL import Image
+
+from cache import Cache
+
+# name -> largest (width, height); thumbnails keep their aspect ratio
+SIZES = {
+    'thumb': (96, 96),
+    'avatar': (300, 300),
+    'header': (900, 300),
+}
+
+FETCH_TIMEOUT = 5
+FETCH_MAX_BYTES = 5 * 1024 * 1024
+
+# Cap decoded images too, so a small file can't expand into a huge bitmap
+MAX_PIXELS = 40 * 1000 * 1000
+
+
+class ImageProxyError(Exception):
+    """The image at a URL can't be proxied."""
+
+
+def _digest(*parts):
+    return hashlib.sha256('\0'.join(parts).encode()).hexdigest()
+
+
+class DiskCache:
+    """Files under `directory`, evicted least recently used first once
+    they take up more than `max_bytes`.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._sizes = None
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _load(self):
+        """Index the files already on disk, oldest access first."""
+
+        found = []
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                found.append((stat.st_mtime, name, stat.st_size))
+
+        self._sizes = OrderedDict((name, size) for mtime, name, size in sorted(found))
+        self._total = sum(self._sizes.values())
+
+    def get(self, key):
+        """The bytes stored under `key`, or None."""
+
+        with self._lock:
+            if self._sizes is None:
+                self._load()
+            if key not in self._sizes:
+                return None
+            self._sizes.move_to_end(key)
+
+        try:
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+            # mtime records the last access, for the index after a restart
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            with self._lock:
+                self._total -= self._sizes.pop(key, 0)
+            return None
+
+        return data
+
+    def set(self, key, data):
+        """Store `data` under `key`, evicting old entries to make room."""
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write then rename, so readers never see a partial file
+        partial = f"{path}.{threading.get_ident()}.tmp"
+        with open(partial, 'wb') as f:
+            f.write(data)
+        os.replace(partial, path)
+
+        with self._lock:
+            if self._sizes is None:
+                self._load()
+            self._total += len(data) - self._sizes.pop(key, 0)
+            self._sizes[key] = len(data)
+
+            while self._total > self.max_bytes and len(self._sizes) > 1:
+                oldest, size = self._sizes.popitem(last=False)
+                self._total -= size
+                try:
+                    os.remove(self._path(oldest))
+                except FileNotFoundError:
+                    pass
+
+    @property
+    def total_bytes(self):
+        with self._lock:
+            if self._sizes is None:
+                self._load()
+            return self._total
+
+
+def _public_address(host, port):
+    """A socket address of `host` to connect to, if all of its addresses
+    are public. Raises ImageProxyError otherwise."""
+
+    try:
+        addresses = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+    except socket.gaierror:
+        raise ImageProxyError(f"Can't resolve {host}")
+
+    for family, type_, proto, canonname, sockaddr in addresses:
+        if not ipaddress.ip_address(sockaddr[0]).is_global:
+            raise ImageProxyError(f"{host} isn't a public address")
+
+    return addresses[0][4]
+
+
+def check_url(url):
+    """Raise ImageProxyError unless `url` is http(s) on a public address."""
+
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ImageProxyError(f"Not an http(s) URL: {url}")
+
+    _public_address(parts.hostname, parts.port or None)
+
+
+def _connect_public(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+    """socket.create_connection, to the public address that was checked."""
+
+    host, port = address
+    return socket.create_connection(_public_address(host, port)[:2], timeout, source_address)
+
+
+class _PublicHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+
+class _PublicHTTPSConnection(http.client.HTTPSConnection):
+    # Certificates are still checked against the host name
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_PublicHTTPConnection, req)
+
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_PublicHTTPSConnection, req, context=self._context)
+
+
+class _CheckedRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Follows a redirect only if its target passes `check_url`."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_url(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+# No proxies from the environment: we connect to the origin ourselves
+_opener = urllib.request.build_opener(urllib.request.ProxyHandler({}),
+                                      _PublicHTTPHandler, _PublicHTTPSHandler,
+                                      _CheckedRedirectHandler)
+
+
+def fetch_url(url, timeout=FETCH_TIMEOUT, max_bytes=FETCH_MAX_BYTES):
+    """The body of `url`, checked with `check_url` first, if it is an image
+    of at most `max_bytes`."""
+
+    check_url(url)
+    request = urllib.request.Request(url, headers={'User-Agent': 'Warbler image proxy'})
+    try:
+        with _opener.open(request, timeout=timeout) as response:
+            if response.headers.get_content_maintype() != 'image':
+                raise ImageProxyError(f"{url} isn't an image")
+            length = response.headers.get('Content-Length')
+            if length and length.isdigit() and int(length) > max_bytes:
+                raise ImageProxyError(f"{url} is larger than {max_bytes} bytes")
+            data = response.read(max_bytes + 1)
+    except OSError as exc:
+        raise ImageProxyError(f"Can't fetch {url}: {exc}")
+
+    if len(data) > max_bytes:
+        raise ImageProxyError(f"{url} is larger than {max_bytes} bytes")
+
+    return data
+
+
+def make_thumbnail(data, size):
+    """`data` scaled down to fit `size`, as PNG if it has transparency
+    and JPEG otherwise.
+    """
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        if image.width * image.height > MAX_PIXELS:
+            raise ImageProxyError(f"Image is too large: {image.size}")
+        image.thumbnail(size)
+    except (OSError, Image.DecompressionBombError) as exc:
+        raise ImageProxyError(f"Not a usable image: {exc}")
+
+    out = io.BytesIO()
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image.save(out, 'PNG', optimize=True)
+    else:
+        image.convert('RGB').save(out, 'JPEG', quality=85, optimize=True,
+                                  progressive=True)
+
+    return out.getvalue()
+
+
+def _mimetype(data):
+    return 'image/png' if data.startswith(b'\x89PNG') else 'image/jpeg'
+
+
+class ImageProxy:
+    """Thumbnails of remote images, fetched once and cached on disk."""
+
+    def __init__(self, cache, secret, fetch=fetch_url, sizes=SIZES,
+                 failure_ttl=60, clock=time.monotonic):
+        """`secret` signs proxy URLs; `fetch(url)` returns the bytes at
+        `url` or raises ImageProxyError."""
+
+        self.cache = cache
+        # url -> why it couldn't be proxied
+        self.failures = Cache(ttl=failure_ttl, clock=clock)
+        self._key = hashlib.sha256(b'image proxy\0' + str(secret).encode()).digest()
+        self.fetch = fetch
+        self.sizes = sizes
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def _lock_for(self, key):
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def sign(self, url):
+        """The signature the proxy wants along with `url`."""
+
+        return hmac.new(self._key, url.encode(), hashlib.sha256).hexdigest()[:32]
+
+    def verify(self, url, signature):
+        """Did `sign` make `signature` for `url`?"""
+
+        return hmac.compare_digest(self.sign(url), signature or '')
+
+    def _make_thumbnail(self, url, box):
+        """Thumbnail of `url`, from its original, fetched only if it isn't
+        cached."""
+
+        key = _digest('original', url)
+        data = self.cache.get(key)
+        if data is not None:
+            return make_thumbnail(data, box)
+
+        failure = self.failures.get(url)
+        if failure is not None:
+            raise ImageProxyError(failure)
+
+        try:
+            data = self.fetch(url)
+            # Kept only once it has proved to be an image we can use
+            thumbnail = make_thumbnail(data, box)
+        except ImageProxyError as exc:
+            self.failures.set(url, str(exc))
+            raise
+        self.cache.set(key, data)
+        return thumbnail
+
+    def thumbnail(self, url, size):
+        """(bytes, mimetype, ETag) of `url` scaled to the named `size`.
+
+        Raises KeyError for an unknown size and ImageProxyError if the
+        image can't be fetched or decoded.
+        """
+
+        box = self.sizes[size]
+        key = _digest(size, url)
+
+        data = self.cache.get(key)
+        if data is None:
+            # One request per thumbnail does the work; the rest wait for it
+            with self._lock_for(key):
+                data = self.cache.get(key)
+                if data is None:
+                    data = self._make_thumbnail(url, box)
+                    self.cache.set(key, data)
+            with self._locks_lock:
+                self._locks.pop(key, None)
+
+        return data, _mimetype(data), hashlib.sha256(data).hexdigest()
@@ -0,0 +1,18 @@
+-- Soft delete of accounts and purge progress (see deletion.py), and the
+-- index behind "who does X follow" lookups.
+
+BEGIN;
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP;
+
+CREATE TABLE IF NOT EXISTS account_deletions (
+    user_id INTEGER PRIMARY KEY,
+    requested_at TIMESTAMP NOT NULL,
+    rows_deleted INTEGER NOT NULL,
+    finished_at TIMESTAMP
+);
+
+COMMIT;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_follows_following_followed
+    ON follows (user_following_id, user_being_followed_id);
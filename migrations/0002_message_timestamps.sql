@@ -0,0 +1,26 @@
+-- Message timestamps used to come from a default evaluated once per
+-- process, so every message a process wrote got the same timestamp. The
+-- database now stamps each row, and reads order by (timestamp, id).
+--
+-- Existing rows can't get their real times back. Rows sharing a timestamp
+-- are spread out a microsecond apart in id (insertion) order, so that the
+-- order they were written in survives.
+
+BEGIN;
+
+ALTER TABLE messages ALTER COLUMN timestamp SET DEFAULT TIMEZONE('utc', now());
+
+UPDATE messages
+SET timestamp = messages.timestamp + ties.rank * INTERVAL '1 microsecond'
+FROM (
+    SELECT id, ROW_NUMBER() OVER (PARTITION BY timestamp ORDER BY id) - 1 AS rank
+    FROM messages
+) AS ties
+WHERE messages.id = ties.id AND ties.rank > 0;
+
+COMMIT;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_timestamp_id
+    ON messages (timestamp, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_user_id_timestamp_id
+    ON messages (user_id, timestamp, id);
@@ -0,0 +1,9 @@
+-- likes.message_id was UNIQUE, so each message could only ever be liked
+-- by one user. The uniqueness now applies per (user, message).
+
+BEGIN;
+
+ALTER TABLE likes DROP CONSTRAINT IF EXISTS likes_message_id_key;
+ALTER TABLE likes ADD CONSTRAINT likes_user_id_message_id_key UNIQUE (user_id, message_id);
+
+COMMIT;
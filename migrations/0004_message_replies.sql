@@ -0,0 +1,17 @@
+-- Replies: each message can point at the message it replies to and at
+-- the top of its conversation, and keeps a count of its direct replies.
+
+BEGIN;
+
+ALTER TABLE messages
+    ADD COLUMN IF NOT EXISTS parent_id INTEGER REFERENCES messages (id) ON DELETE SET NULL,
+    ADD COLUMN IF NOT EXISTS root_id INTEGER REFERENCES messages (id) ON DELETE CASCADE,
+    ADD COLUMN IF NOT EXISTS depth INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS reply_count INTEGER NOT NULL DEFAULT 0;
+
+COMMIT;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_root_id_timestamp_id
+    ON messages (root_id, timestamp, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_parent_id_timestamp_id
+    ON messages (parent_id, timestamp, id);
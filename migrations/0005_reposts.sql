@@ -0,0 +1,14 @@
+-- Reposts: a user resharing someone else's message with their followers.
+
+CREATE TABLE IF NOT EXISTS reposts (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    message_id INTEGER NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+    timestamp TIMESTAMP NOT NULL DEFAULT TIMEZONE('utc', now()),
+    UNIQUE (user_id, message_id)
+);
+
+CREATE INDEX IF NOT EXISTS ix_reposts_user_id_timestamp
+    ON reposts (user_id, timestamp);
+CREATE INDEX IF NOT EXISTS ix_reposts_message_id
+    ON reposts (message_id);
@@ -0,0 +1,87 @@
+-- Partition messages by month of timestamp (see partitions.py).
+--
+-- The existing table becomes the messages_history partition, holding
+-- everything before the current month, so no rows are copied. A CHECK
+-- constraint matching its range lets ATTACH skip scanning it.
+--
+-- A partitioned table's primary key has to include the partition key,
+-- so it becomes (id, timestamp), and nothing can reference messages (id)
+-- by foreign key any more. Deleting a message now removes its likes,
+-- reposts and replies in the application (Message.remove).
+--
+-- Does nothing if messages is already partitioned. Afterwards, run
+-- `flask partitions create` regularly (e.g. daily from cron).
+--
+-- Needs PostgreSQL 12+. Not yet run against a real server; see the
+-- README for the checks to make on a copy of the database first.
+
+BEGIN;
+
+DO $$
+DECLARE
+    cutoff DATE := date_trunc('month', TIMEZONE('utc', now()))::DATE;
+    month DATE;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table
+               WHERE partrelid = 'messages'::regclass) THEN
+        RETURN;
+    END IF;
+
+    ALTER TABLE likes DROP CONSTRAINT IF EXISTS likes_message_id_fkey;
+    ALTER TABLE reposts DROP CONSTRAINT IF EXISTS reposts_message_id_fkey;
+    ALTER TABLE messages DROP CONSTRAINT IF EXISTS messages_parent_id_fkey;
+    ALTER TABLE messages DROP CONSTRAINT IF EXISTS messages_root_id_fkey;
+
+    ALTER TABLE messages RENAME TO messages_history;
+    ALTER TABLE messages_history DROP CONSTRAINT messages_pkey;
+    ALTER TABLE messages_history DROP CONSTRAINT IF EXISTS messages_user_id_fkey;
+    ALTER TABLE messages_history ALTER COLUMN id DROP DEFAULT;
+    ALTER INDEX IF EXISTS ix_messages_timestamp_id
+        RENAME TO messages_history_timestamp_id;
+    ALTER INDEX IF EXISTS ix_messages_user_id_timestamp_id
+        RENAME TO messages_history_user_id_timestamp_id;
+    ALTER INDEX IF EXISTS ix_messages_root_id_timestamp_id
+        RENAME TO messages_history_root_id_timestamp_id;
+    ALTER INDEX IF EXISTS ix_messages_parent_id_timestamp_id
+        RENAME TO messages_history_parent_id_timestamp_id;
+    EXECUTE format('ALTER TABLE messages_history ADD CONSTRAINT messages_history_range '
+                   'CHECK (timestamp < %L)', cutoff);
+
+    CREATE TABLE messages (
+        id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),
+        text VARCHAR(140) NOT NULL,
+        timestamp TIMESTAMP NOT NULL DEFAULT TIMEZONE('utc', now()),
+        user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        parent_id INTEGER,
+        root_id INTEGER,
+        depth INTEGER NOT NULL DEFAULT 0,
+        reply_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (id, timestamp)
+    ) PARTITION BY RANGE (timestamp);
+    ALTER SEQUENCE messages_id_seq OWNED BY messages.id;
+
+    -- Created on the parent, these are created (or matched) on every
+    -- partition, including messages_history's renamed ones
+    CREATE INDEX ix_messages_timestamp_id ON messages (timestamp, id);
+    CREATE INDEX ix_messages_user_id_timestamp_id ON messages (user_id, timestamp, id);
+    CREATE INDEX ix_messages_root_id_timestamp_id ON messages (root_id, timestamp, id);
+    CREATE INDEX ix_messages_parent_id_timestamp_id ON messages (parent_id, timestamp, id);
+    -- Lookups by id alone (Message.query.get) check each partition's index
+    CREATE INDEX ix_messages_id ON messages (id);
+
+    EXECUTE format('ALTER TABLE messages ATTACH PARTITION messages_history '
+                   'FOR VALUES FROM (MINVALUE) TO (%L)', cutoff);
+    ALTER TABLE messages_history DROP CONSTRAINT messages_history_range;
+
+    FOR i IN 0..3 LOOP
+        month := (cutoff + make_interval(months => i))::DATE;
+        EXECUTE format('CREATE TABLE messages_p%s PARTITION OF messages '
+                       'FOR VALUES FROM (%L) TO (%L)',
+                       to_char(month, 'YYYY_MM'), month,
+                       (month + INTERVAL '1 month')::DATE);
+    END LOOP;
+
+    CREATE TABLE messages_default PARTITION OF messages DEFAULT;
+END $$;
+
+COMMIT;
@@ -0,0 +1,16 @@
+-- Notifications: follows, likes and mentions, coalesced while unread
+-- (see notifications.py).
+
+CREATE TABLE IF NOT EXISTS notifications (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    kind VARCHAR(20) NOT NULL,
+    message_id INTEGER,
+    actor_id INTEGER REFERENCES users (id) ON DELETE SET NULL,
+    actor_count INTEGER NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP NOT NULL DEFAULT TIMEZONE('utc', now()),
+    read_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS ix_notifications_user_id_updated_at
+    ON notifications (user_id, updated_at);
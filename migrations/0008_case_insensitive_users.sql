@@ -0,0 +1,8 @@
+-- Usernames and emails are unique whatever their case (see availability.py).
+--
+-- Fails if two users already differ only in case; rename one of them
+-- first. Find them with:
+--   SELECT lower(username), count(*) FROM users GROUP BY 1 HAVING count(*) > 1;
+
+CREATE UNIQUE INDEX IF NOT EXISTS ux_users_username_lower ON users (lower(username));
+CREATE UNIQUE INDEX IF NOT EXISTS ux_users_email_lower ON users (lower(email));
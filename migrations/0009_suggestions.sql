@@ -0,0 +1,9 @@
+-- Stored "who to follow" suggestions, written by `flask recommend-all`
+-- and read by every web worker (see recommendations.py).
+
+CREATE TABLE IF NOT EXISTS suggestions (
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    rank INTEGER NOT NULL,
+    suggested_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    PRIMARY KEY (user_id, rank)
+);
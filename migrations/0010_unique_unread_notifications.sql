@@ -0,0 +1,37 @@
+-- At most one unread notification per recipient, kind and message, so
+-- that concurrent writers coalesce instead of adding rows
+-- (see notifications.deliver).
+--
+-- Needs PostgreSQL 12+. Not yet run against a real server; see the
+-- README for the checks to make on a copy of the database first.
+
+BEGIN;
+
+-- Fold existing duplicates into the newest row of each group
+WITH groups AS (
+    SELECT user_id, kind, COALESCE(message_id, 0) AS message_key,
+           MAX(id) AS keep_id, SUM(actor_count) AS actor_count
+    FROM notifications
+    WHERE read_at IS NULL
+    GROUP BY user_id, kind, COALESCE(message_id, 0)
+    HAVING COUNT(*) > 1
+)
+UPDATE notifications
+SET actor_count = groups.actor_count
+FROM groups
+WHERE notifications.id = groups.keep_id;
+
+DELETE FROM notifications
+USING notifications AS newer
+WHERE notifications.read_at IS NULL
+  AND newer.read_at IS NULL
+  AND newer.user_id = notifications.user_id
+  AND newer.kind = notifications.kind
+  AND COALESCE(newer.message_id, 0) = COALESCE(notifications.message_id, 0)
+  AND newer.id > notifications.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_notifications_unread
+    ON notifications (user_id, kind, COALESCE(message_id, 0))
+    WHERE read_at IS NULL;
+
+COMMIT;
@@ -0,0 +1,14 @@
+-- The actors counted in each unread notification, so that someone who
+-- likes, unlikes and likes again counts once (see notifications.deliver).
+-- Rows go when their notification is read.
+--
+-- Existing unread notifications keep the counts they have; their actors
+-- weren't recorded, so the next event from each counts once more.
+
+CREATE TABLE IF NOT EXISTS notification_actors (
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    kind VARCHAR(20) NOT NULL,
+    message_key INTEGER NOT NULL,
+    actor_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    PRIMARY KEY (user_id, kind, message_key, actor_id)
+);
@@ -1,13 +1,24 @@
 """SQLAlchemy models for Warbler."""
 
-from datetime import datetime
+from collections import namedtuple
+from datetime import datetime, timedelta
 
 from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+from follow_graph import FollowGraph
 
 bcrypt = Bcrypt()
 db = SQLAlchemy()
 
+# Lower bounds tried in turn by `Message.newest`, as distances back from
+# the newest row wanted. Most pages fill from the first window, so on a
+# partitioned messages table only the newest partitions are read.
+RECENT_WINDOWS = (timedelta(days=31), timedelta(days=366), None)
+
 
 class Follows(db.Model):
     """Connection of a follower <-> followed_user."""
@@ -26,6 +37,49 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # The primary key covers "who follows X"; this covers "who X follows".
+    __table_args__ = (
+        db.Index('ix_follows_following_followed',
+                 'user_following_id', 'user_being_followed_id'),
+    )
+
+    # The follow graph is per process and may lag other processes' writes,
+    # so these check the table, and bring this process's graph up to date
+    # if it was wrong.
+
+    @classmethod
+    def add(cls, follower_id, followed_id):
+        """Make `follower_id` follow `followed_id`, unless they already do.
+
+        Returns whether the follow is new. Doesn't commit; the caller does.
+        """
+
+        if cls.query.get((followed_id, follower_id)) is not None:
+            if follow_graph.loaded:
+                follow_graph.add_follow(follower_id, followed_id)
+            return False
+
+        db.session.add(cls(user_following_id=follower_id,
+                           user_being_followed_id=followed_id))
+        return True
+
+    @classmethod
+    def remove(cls, follower_id, followed_id):
+        """Make `follower_id` stop following `followed_id`, if they do.
+
+        Returns whether there was a follow to remove. Doesn't commit; the
+        caller does.
+        """
+
+        row = cls.query.get((followed_id, follower_id))
+        if row is None:
+            if follow_graph.loaded:
+                follow_graph.remove_follow(follower_id, followed_id)
+            return False
+
+        db.session.delete(row)
+        return True
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
@@ -45,7 +99,11 @@ class Likes(db.Model):
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+    )
+
+    # A user likes a message at most once; many users can like it.
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'message_id'),
     )
 
 
@@ -94,6 +152,12 @@ class User(db.Model):
         nullable=False,
     )
 
+    # Set when the account is deleted; the rows are purged afterwards in
+    # batches (see deletion.py), so until then the user is just hidden.
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
     messages = db.relationship('Message')
 
     followers = db.relationship(
@@ -115,20 +179,116 @@ class User(db.Model):
         secondary="likes"
     )
 
+    # "Alice" and "alice" are the same username (see availability.py)
+    __table_args__ = (
+        db.Index('ux_users_username_lower', db.func.lower(username), unique=True),
+        db.Index('ux_users_email_lower', db.func.lower(email), unique=True),
+    )
+
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
+    def message_count(self):
+        """How many messages this user has written."""
+
+        return Message.query.filter(Message.user_id == self.id).count()
+
+    # The follow graph is per process and may lag other processes' writes
+    # by up to FOLLOW_GRAPH_MAX_AGE, so what a page shows about follows --
+    # buttons, counts, the home timeline -- is read from the table instead.
+
+    def following_ids(self):
+        """Ids of the users this user follows, read once per instance."""
+
+        if '_following_ids' not in self.__dict__:
+            self._following_ids = {
+                followed_id for followed_id, in db.session
+                .query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == self.id)}
+        return self._following_ids
+
+    def following_count(self):
+        """How many users this user follows."""
+
+        return len(self.following_ids())
+
+    def follower_count(self):
+        """How many users follow this user."""
+
+        return (Follows.query
+                .filter(Follows.user_being_followed_id == self.id)
+                .count())
+
+    def like_count(self):
+        """How many messages this user has liked."""
+
+        return Likes.query.filter(Likes.user_id == self.id).count()
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return self.id in other_user.following_ids()
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.id in self.following_ids()
+
+    @classmethod
+    def following_page(cls, user_id, viewer_id, after=0, per_page=48):
+        """Page of user cards for the users `user_id` follows.
+
+        See `_follow_page` for what is returned.
+        """
+
+        return cls._follow_page(Follows.user_following_id,
+                                Follows.user_being_followed_id,
+                                user_id, viewer_id, after, per_page)
+
+    @classmethod
+    def followers_page(cls, user_id, viewer_id, after=0, per_page=48):
+        """Page of user cards for the users following `user_id`.
+
+        See `_follow_page` for what is returned.
+        """
+
+        return cls._follow_page(Follows.user_being_followed_id,
+                                Follows.user_following_id,
+                                user_id, viewer_id, after, per_page)
+
+    @classmethod
+    def _follow_page(cls, owner_column, listed_column, user_id, viewer_id,
+                     after, per_page):
+        """Keyset-paginated projection of the users on one side of `follows`.
+
+        Only the columns a user card shows are fetched, plus `is_followed`:
+        whether `viewer_id` follows that user. Rows come ordered by user id,
+        starting after `after`.
+
+        Returns (rows, after value for the next page or None).
+        """
+
+        viewer_follows = db.aliased(Follows)
+        is_followed = (db.exists()
+                       .where(viewer_follows.user_following_id == viewer_id)
+                       .where(viewer_follows.user_being_followed_id == cls.id)
+                       .label('is_followed'))
+
+        rows = (db.session
+                .query(cls.id, cls.username, cls.image_url,
+                       cls.header_image_url, cls.bio, is_followed)
+                .join(Follows, listed_column == cls.id)
+                .filter(owner_column == user_id,
+                        listed_column > after,
+                        cls.deleted_at.is_(None))
+                .order_by(listed_column)
+                .limit(per_page + 1)
+                .all())
+
+        if len(rows) > per_page:
+            return rows[:per_page], rows[per_page - 1].id
+
+        return rows, None
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -160,15 +320,69 @@ class User(db.Model):
         If can't find matching user (or if password is wrong), returns False.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = cls.query.filter_by(username=username, deleted_at=None).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = user.check_password(password)
             if is_auth:
                 return user
 
         return False
 
+    def check_password(self, password):
+        """Does `password` match this (already loaded) user's hash?"""
+
+        return bcrypt.check_password_hash(self.password, password)
+
+    # Columns a user can change from their profile page
+    PROFILE_FIELDS = ('username', 'email', 'image_url', 'header_image_url', 'bio')
+
+    @classmethod
+    def update_profile(cls, user, values):
+        """Write the `values` (of PROFILE_FIELDS) that differ from `user`'s,
+        in one UPDATE of just those columns.
+
+        Returns the changed {column: value}. Doesn't commit; the caller does.
+        """
+
+        changed = {name: values[name] for name in cls.PROFILE_FIELDS
+                   if name in values and values[name] != getattr(user, name)}
+        if changed:
+            (cls.query
+             .filter(cls.id == user.id)
+             .update(changed, synchronize_session=False))
+
+        return changed
+
+
+# What the message page shows; plain tuples, so they can be cached.
+AuthorView = namedtuple('AuthorView', 'id username image_url')
+MessageView = namedtuple('MessageView',
+                         'id text timestamp user like_count reply_count parent_id root_id')
+
+
+class utcnow(FunctionElement):
+    """Current UTC time, as computed by the database."""
+
+    type = db.DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow, 'postgresql')
+def _utcnow_postgresql(element, compiler, **kw):
+    return "TIMEZONE('utc', now())"
+
+
+@compiles(utcnow, 'sqlite')
+def _utcnow_sqlite(element, compiler, **kw):
+    # Microsecond text in the format SQLAlchemy stores datetimes in
+    return "(STRFTIME('%Y-%m-%d %H:%M:%f000', 'now'))"
+
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
 
 class Message(db.Model):
     """An individual message ("warble")."""
@@ -188,7 +402,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        server_default=utcnow(),
     )
 
     user_id = db.Column(
@@ -197,8 +411,609 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # Replies: the message replied to, and the top of the conversation
+    # (None on messages that start one). Deleting the top of a
+    # conversation deletes the conversation.
+    parent_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='SET NULL'),
+    )
+
+    root_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+    )
+
+    # How many replies up from the root (0 for the root itself)
+    depth = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Direct replies, kept up to date by `add_reply` and message deletion
+    reply_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
     user = db.relationship('User')
 
+    # Time-ordered reads walk (timestamp, id): timestamps can tie (rows
+    # written in one transaction share now()), ids break the tie.
+    __table_args__ = (
+        db.Index('ix_messages_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_messages_user_id_timestamp_id', 'user_id', 'timestamp', 'id'),
+        db.Index('ix_messages_root_id_timestamp_id', 'root_id', 'timestamp', 'id'),
+        db.Index('ix_messages_parent_id_timestamp_id', 'parent_id', 'timestamp', 'id'),
+    )
+
+    @classmethod
+    def newest_first(cls):
+        """ORDER BY clauses for the (timestamp, id) key, newest first."""
+
+        return (cls.timestamp.desc(), cls.id.desc())
+
+    @property
+    def cursor(self):
+        """Position of this message in `newest_first` order."""
+
+        return f"{self.timestamp.isoformat()}_{self.id}"
+
+    @staticmethod
+    def parse_cursor(cursor):
+        """(timestamp, id) out of a `cursor`; ValueError if malformed."""
+
+        timestamp, message_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(timestamp), int(message_id)
+
+    @classmethod
+    def before(cls, cursor):
+        """Filter for the messages after `cursor` in `newest_first` order.
+
+        Raises ValueError if `cursor` is malformed.
+        """
+
+        timestamp, message_id = cls.parse_cursor(cursor)
+        # The plain bound is redundant, but lets Postgres prune partitions
+        # where the row comparison doesn't
+        return db.and_(cls.timestamp <= timestamp,
+                       db.tuple_(cls.timestamp, cls.id) < (timestamp, message_id))
+
+    @classmethod
+    def after(cls, cursor):
+        """Filter for the messages after `cursor` in oldest-first order.
+
+        Raises ValueError if `cursor` is malformed.
+        """
+
+        timestamp, message_id = cls.parse_cursor(cursor)
+        return db.and_(cls.timestamp >= timestamp,
+                       db.tuple_(cls.timestamp, cls.id) > (timestamp, message_id))
+
+    @classmethod
+    def newest(cls, query, limit, before=None, windows=RECENT_WINDOWS):
+        """The first `limit` rows of `query` in `newest_first` order,
+        starting after the `before` cursor if given.
+
+        The query is first bounded to a window of time back from where the
+        page starts, which is widened only while the page comes up short,
+        so a page of recent messages reads only recent partitions.
+
+        Raises ValueError if `before` is malformed.
+        """
+
+        until = datetime.utcnow()
+        if before:
+            query = query.filter(cls.before(before))
+            until = cls.parse_cursor(before)[0]
+
+        for window in windows:
+            bounded = query if window is None else query.filter(
+                cls.timestamp >= until - window)
+            rows = bounded.order_by(*cls.newest_first()).limit(limit).all()
+            if len(rows) == limit:
+                break
+
+        return rows
+
+    @classmethod
+    def add_reply(cls, parent, text, user_id):
+        """Add a reply to `parent` and bump its reply count.
+
+        Doesn't commit; the caller does.
+        """
+
+        reply = cls(text=text,
+                    user_id=user_id,
+                    parent_id=parent.id,
+                    root_id=parent.root_id or parent.id,
+                    depth=parent.depth + 1)
+        db.session.add(reply)
+        (cls.query
+         .filter(cls.id == parent.id)
+         .update({cls.reply_count: cls.reply_count + 1},
+                 synchronize_session=False))
+
+        return reply
+
+    @classmethod
+    def remove(cls, message):
+        """Delete `message` with its likes, reposts and notifications, and
+        the rest of the conversation if it starts one; its other replies
+        lose their parent.
+
+        The database can't do this through foreign keys: nothing can
+        reference a partitioned messages table by id alone. Doesn't
+        commit; the caller does. Returns the ids of the messages deleted or
+        changed, whose cached views are out of date.
+        """
+
+        doomed = db.or_(cls.id == message.id, cls.root_id == message.id)
+        doomed_ids = db.session.query(cls.id).filter(doomed)
+        changed = [message_id for message_id, in (db.session
+                                                  .query(cls.id)
+                                                  .filter(db.or_(doomed,
+                                                                 cls.parent_id == message.id)))]
+
+        for model in (Likes, Repost, Notification):
+            (model.query
+             .filter(model.message_id.in_(doomed_ids))
+             .delete(synchronize_session=False))
+        (cls.query
+         .filter(cls.parent_id == message.id)
+         .update({cls.parent_id: None}, synchronize_session=False))
+        cls.query.filter(doomed).delete(synchronize_session=False)
+
+        return changed
+
+    @classmethod
+    def replies_page(cls, message, after=None, per_page=50, max_depth=None):
+        """A page of the replies below `message`, oldest first.
+
+        For the top of a conversation that is the whole thread, read in
+        one range scan over (root_id, timestamp, id) down to `max_depth`;
+        anything deeper is left for the reader to expand. For any other
+        message it is its direct replies.
+
+        Returns (replies, cursor of the next page or None).
+        """
+
+        query = cls.query.options(db.joinedload(cls.user))
+        if message.root_id is None:
+            query = query.filter(cls.root_id == message.id)
+            if max_depth is not None:
+                query = query.filter(cls.depth <= max_depth)
+        else:
+            query = query.filter(cls.parent_id == message.id)
+
+        if after:
+            query = query.filter(cls.after(after))
+
+        replies = (query
+                   .order_by(cls.timestamp, cls.id)
+                   .limit(per_page + 1)
+                   .all())
+        if len(replies) > per_page:
+            return replies[:per_page], replies[per_page - 1].cursor
+
+        return replies, None
+
+    @classmethod
+    def view(cls, message_id, viewer_id=None):
+        """(MessageView, whether `viewer_id` liked it) from a single query.
+
+        Returns (None, False) if there is no such message.
+        """
+
+        like_count = (db.select([db.func.count(Likes.id)])
+                      .where(Likes.message_id == cls.id)
+                      .scalar_subquery())
+        if viewer_id is None:
+            liked = db.literal(False)
+        else:
+            liked = (db.exists()
+                     .where(Likes.message_id == cls.id)
+                     .where(Likes.user_id == viewer_id))
+
+        row = (db.session
+               .query(cls.id, cls.text, cls.timestamp,
+                      User.id, User.username, User.image_url,
+                      like_count, cls.reply_count, cls.parent_id, cls.root_id,
+                      liked)
+               .join(User, User.id == cls.user_id)
+               .filter(cls.id == message_id)
+               .first())
+        if row is None:
+            return None, False
+
+        author = AuthorView(*row[3:6])
+        return MessageView(*row[0:3], author, *row[6:10]), bool(row[10])
+
+    @classmethod
+    def liked_by(cls, message_id, user_id):
+        """Has `user_id` liked `message_id`?"""
+
+        return db.session.query(
+            db.exists()
+            .where(Likes.message_id == message_id)
+            .where(Likes.user_id == user_id)).scalar()
+
+    @classmethod
+    def liked_among(cls, user_id, message_ids):
+        """The ids out of `message_ids` that `user_id` has liked."""
+
+        if not message_ids:
+            return set()
+
+        return {message_id for message_id, in (
+            db.session
+            .query(Likes.message_id)
+            .filter(Likes.user_id == user_id,
+                    Likes.message_id.in_(message_ids)))}
+
+    @classmethod
+    def insert_many(cls, rows):
+        """Insert `rows` (dicts of column values) in a single statement, and
+        return their ids, in order.
+
+        Skips the ORM, so nothing is loaded or tracked in the session.
+        """
+
+        table = cls.__table__
+        if not db.engine.dialect.implicit_returning:
+            # No RETURNING (SQLite): one statement per row
+            return [db.session.execute(table.insert(), row).inserted_primary_key[0]
+                    for row in rows]
+
+        inserted = db.session.execute(
+            table.insert().values(rows).returning(table.c.id, table.c.user_id, table.c.text))
+        # RETURNING doesn't promise the rows' order, so match them by content
+        ids = {}
+        for message_id, user_id, text in sorted(inserted):
+            ids.setdefault((user_id, text), []).append(message_id)
+        return [ids[(row['user_id'], row['text'])].pop(0) for row in rows]
+
+
+class Repost(db.Model):
+    """A user resharing a message with their followers."""
+
+    __tablename__ = 'reposts'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=utcnow(),
+    )
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'message_id'),
+        db.Index('ix_reposts_user_id_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_reposts_message_id', 'message_id'),
+    )
+
+    @classmethod
+    def toggle(cls, user_id, message_id):
+        """Repost `message_id` as `user_id`, or undo an earlier repost.
+
+        Returns whether the message is now reposted. Doesn't commit; the
+        caller does.
+        """
+
+        removed = (cls.query
+                   .filter_by(user_id=user_id, message_id=message_id)
+                   .delete(synchronize_session=False))
+        if not removed:
+            db.session.add(cls(user_id=user_id, message_id=message_id))
+
+        return not removed
+
+    @classmethod
+    def reposted_among(cls, user_id, message_ids):
+        """The ids out of `message_ids` that `user_id` has reposted."""
+
+        if not message_ids:
+            return set()
+
+        return {message_id for message_id, in (
+            db.session
+            .query(cls.message_id)
+            .filter(cls.user_id == user_id, cls.message_id.in_(message_ids)))}
+
+
+class Notification(db.Model):
+    """Something that happened to a user: a follow, a like, a mention.
+
+    Repeats coalesce while unread: one row stands for every like of a
+    message (or every new follower) since the user last looked, with a
+    count and the latest actor.
+    """
+
+    __tablename__ = 'notifications'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    kind = db.Column(
+        db.String(20),
+        nullable=False,
+    )
+
+    # The liked or mentioning message; no foreign key, as messages is
+    # partitioned (see Message.remove)
+    message_id = db.Column(
+        db.Integer,
+    )
+
+    actor_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='set null'),
+    )
+
+    actor_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=1,
+    )
+
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    read_at = db.Column(
+        db.DateTime,
+    )
+
+    actor = db.relationship('User', foreign_keys=[actor_id])
+
+    __table_args__ = (
+        db.Index('ix_notifications_user_id_updated_at', 'user_id', 'updated_at'),
+        # At most one unread row per recipient, kind and message, however
+        # many writers deliver at once (see notifications.deliver)
+        db.Index('uq_notifications_unread', user_id, kind,
+                 db.func.coalesce(message_id, db.literal_column('0')),
+                 unique=True,
+                 postgresql_where=read_at.is_(None),
+                 sqlite_where=read_at.is_(None)),
+    )
+
+    @classmethod
+    def unread_key(cls):
+        """The columns of the unread unique index, for ON CONFLICT."""
+
+        return [cls.user_id, cls.kind, db.func.coalesce(cls.message_id, db.literal_column('0'))]
+
+    @classmethod
+    def unread(cls, user_id):
+        """Filter for `user_id`'s unread notifications."""
+
+        return db.and_(cls.user_id == user_id, cls.read_at.is_(None))
+
+
+class NotificationActor(db.Model):
+    """Someone counted in one of a user's unread notifications.
+
+    Keyed like the unread notification (recipient, kind, and message, or 0
+    for none), so that liking, unliking and liking again counts once.
+    """
+
+    __tablename__ = 'notification_actors'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    kind = db.Column(
+        db.String(20),
+        primary_key=True,
+    )
+
+    message_key = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    actor_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+
+class Suggestion(db.Model):
+    """One of a user's stored "who to follow" suggestions, written by
+    `flask recommend-all` (see recommendations.py)."""
+
+    __tablename__ = 'suggestions'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    rank = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    suggested_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+
+ThreadNode = namedtuple('ThreadNode', 'message children')
+
+
+def thread_tree(replies):
+    """Nest a page of `replies` under their parents.
+
+    Replies whose parent isn't on the page come out at the top level.
+    """
+
+    nodes = {reply.id: ThreadNode(reply, []) for reply in replies}
+    top = []
+    for reply in replies:
+        parent = nodes.get(reply.parent_id)
+        (parent.children if parent else top).append(nodes[reply.id])
+
+    return top
+
+
+class AccountDeletion(db.Model):
+    """Progress of the batched purge of a soft-deleted account."""
+
+    __tablename__ = 'account_deletions'
+
+    # No foreign key: this row outlives the user it describes.
+    user_id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    requested_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    rows_deleted = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    finished_at = db.Column(
+        db.DateTime,
+    )
+
+
+##############################################################################
+# In-memory follow graph
+#
+# Follow changes are collected as they are made, through relationship
+# appends/removes or `Follows` rows, and applied to the graph once the
+# transaction commits.
+
+
+def _follow_pairs():
+    """(follower id, followed id) for every row of `follows`."""
+
+    return (db.session
+            .query(Follows.user_following_id, Follows.user_being_followed_id)
+            .yield_per(10000))
+
+
+follow_graph = FollowGraph(loader=_follow_pairs)
+
+
+def _pending_follows(session):
+    return session.info.setdefault('pending_follows', [])
+
+
+@event.listens_for(User.following, 'append')
+def _following_appended(user, followed_user, initiator):
+    _pending_follows(db.session()).append((True, user, followed_user))
+
+
+@event.listens_for(User.following, 'remove')
+def _following_removed(user, followed_user, initiator):
+    _pending_follows(db.session()).append((False, user, followed_user))
+
+
+@event.listens_for(User.followers, 'append')
+def _follower_appended(user, follower, initiator):
+    _pending_follows(db.session()).append((True, follower, user))
+
+
+@event.listens_for(User.followers, 'remove')
+def _follower_removed(user, follower, initiator):
+    _pending_follows(db.session()).append((False, follower, user))
+
+
+def _user_id(user):
+    """Id of a flushed `User` (or an id already), without emitting SQL."""
+
+    if isinstance(user, User):
+        return inspect(user).identity[0]
+    return user
+
+
+@event.listens_for(db.session, 'after_flush')
+def _follows_flushed(session, flush_context):
+    pending = _pending_follows(session)
+    # Users appended to a relationship have ids now that they are flushed
+    pending[:] = [(added, _user_id(follower), _user_id(followed))
+                  for added, follower, followed in pending]
+    for added, rows in ((True, session.new), (False, session.deleted)):
+        pending.extend((added, row.user_following_id, row.user_being_followed_id)
+                       for row in rows if isinstance(row, Follows))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _follows_committed(session):
+    pending = session.info.pop('pending_follows', [])
+    if not follow_graph.loaded:
+        return
+
+    for added, follower_id, followed_id in pending:
+        if added:
+            follow_graph.add_follow(follower_id, followed_id)
+        else:
+            follow_graph.remove_follow(follower_id, followed_id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _follows_rolled_back(session):
+    session.info.pop('pending_follows', None)
+
+
+@event.listens_for(User, 'expire')
+def _user_expired(user, attrs):
+    # Commits expire the user, and may have changed whom they follow. The
+    # session holds users weakly, so one may be gone by now.
+    if user is not None:
+        user.__dict__.pop('_following_ids', None)
+
+
+@event.listens_for(Follows.__table__, 'after_drop')
+def _follows_dropped(target, connection, **kw):
+    follow_graph.clear()
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -0,0 +1,214 @@
+"""Notifications for Warbler: follows, likes and mentions.
+
+Routes report what happened with `Notifier.notify` and move on; a writer
+thread (see write_batching.py) gathers the events that come in within
+NOTIFICATIONS_MAX_WAIT seconds and writes them in one transaction.
+
+Events coalesce twice. Within a batch, a burst of likes on one message
+becomes one row update. In the table, each recipient has at most one
+unread notification per kind and message (follows have no message), and
+new events bump its count and latest actor instead of adding rows, so
+the page reads "u7 and 41 others liked your warble". A unique index holds
+that even with several writers, which upsert against it. The actors
+counted so far are kept in `notification_actors` until the notification
+is read, so someone who likes, unlikes and likes again counts once. If a
+batch fails, its events are written one per transaction, so one bad event
+doesn't lose the rest.
+
+The unread count behind the navbar badge is cached per user, for a short
+time, and dropped whenever that user's notifications change here; other
+workers see a change once their copy expires.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from cache import cache
+from models import db, User, Notification, NotificationActor
+from trending import extract_tags
+from write_batching import GroupCommitter
+
+KINDS = ('follow', 'like', 'mention')
+
+Event = namedtuple('Event', 'user_id kind actor_id message_id')
+
+UNREAD_KEY = "unread:{}"
+
+
+def coalesce(events):
+    """{(user id, kind, message id): distinct actor ids, the latest last}."""
+
+    groups = {}
+    for event in events:
+        actors = groups.setdefault((event.user_id, event.kind, event.message_id), {})
+        actors.pop(event.actor_id, None)
+        actors[event.actor_id] = True
+
+    return {key: list(actors) for key, actors in groups.items()}
+
+
+ACTOR_KEY = (NotificationActor.user_id, NotificationActor.kind,
+             NotificationActor.message_key, NotificationActor.actor_id)
+
+
+# Dialects with INSERT ... ON CONFLICT
+UPSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def deliver(events):
+    """Add `events` to their recipients' unread notifications.
+
+    Doesn't commit; the caller does.
+    """
+
+    groups = coalesce(events)
+    candidates = [(user_id, kind, message_id or 0, actor_id)
+                  for (user_id, kind, message_id), actor_ids in groups.items()
+                  for actor_id in actor_ids]
+    counted = set(db.session.query(*ACTOR_KEY)
+                  .filter(db.tuple_(*ACTOR_KEY).in_(candidates)))
+
+    now = datetime.utcnow()
+    rows = []
+    actors = []
+    for (user_id, kind, message_id), actor_ids in groups.items():
+        new = [actor_id for actor_id in actor_ids
+               if (user_id, kind, message_id or 0, actor_id) not in counted]
+        if not new:
+            continue
+        rows.append({'user_id': user_id, 'kind': kind, 'message_id': message_id,
+                     'actor_id': new[-1], 'actor_count': len(new), 'updated_at': now})
+        actors += [{'user_id': user_id, 'kind': kind, 'message_key': message_id or 0,
+                    'actor_id': actor_id} for actor_id in new]
+    if not rows:
+        return
+
+    # A writer racing this one to count the same actor gets a primary key
+    # violation, and its batch is retried
+    db.session.execute(NotificationActor.__table__.insert(), actors)
+
+    upsert = UPSERTS.get(db.engine.dialect.name)
+    if upsert is None:
+        _update_or_add(rows)
+        return
+
+    table = Notification.__table__
+    statement = upsert(table).values(rows)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=Notification.unread_key(),
+        index_where=Notification.read_at.is_(None),
+        set_={'actor_count': table.c.actor_count + statement.excluded.actor_count,
+              'actor_id': statement.excluded.actor_id,
+              'updated_at': statement.excluded.updated_at}))
+
+
+def _update_or_add(rows):
+    """`deliver` without ON CONFLICT. A writer racing this one gets a
+    unique violation, and its batch is retried."""
+
+    for row in rows:
+        same_message = (Notification.message_id.is_(None) if row['message_id'] is None
+                        else Notification.message_id == row['message_id'])
+        updated = (Notification.query
+                   .filter(Notification.unread(row['user_id']),
+                           Notification.kind == row['kind'],
+                           same_message)
+                   .update({Notification.actor_count:
+                            Notification.actor_count + row['actor_count'],
+                            Notification.actor_id: row['actor_id'],
+                            Notification.updated_at: row['updated_at']},
+                           synchronize_session=False))
+        if not updated:
+            db.session.add(Notification(**row))
+
+
+def forget_unread(user_ids):
+    """Drop the cached unread counts of `user_ids`."""
+
+    for user_id in user_ids:
+        cache.delete(UNREAD_KEY.format(user_id))
+
+
+def unread_count(user_id, ttl=None):
+    """How many unread notifications `user_id` has, from the cache if it
+    can, cached for `ttl` seconds (or the cache's default)."""
+
+    key = UNREAD_KEY.format(user_id)
+    count = cache.get(key)
+    if count is None:
+        count = (db.session
+                 .query(db.func.count(Notification.id))
+                 .filter(Notification.unread(user_id))
+                 .scalar())
+        cache.set(key, count, ttl=ttl)
+
+    return count
+
+
+def mark_read(user_id, notification_ids, seen_at):
+    """Mark the notifications `notification_ids` of `user_id`, as they were
+    shown at `seen_at`, read. One that has had news since stays unread.
+
+    Doesn't commit; the caller does, then calls `forget_unread`.
+    """
+
+    if not notification_ids:
+        return
+
+    (Notification.query
+     .filter(Notification.unread(user_id),
+             Notification.id.in_(notification_ids),
+             Notification.updated_at <= seen_at)
+     .update({Notification.read_at: datetime.utcnow()}, synchronize_session=False))
+
+    # Actors are only kept while their notification can still coalesce
+    still_unread = db.exists().where(
+        Notification.unread(user_id),
+        Notification.kind == NotificationActor.kind,
+        db.func.coalesce(Notification.message_id, 0) == NotificationActor.message_key)
+    (NotificationActor.query
+     .filter(NotificationActor.user_id == user_id, ~still_unread)
+     .delete(synchronize_session=False))
+
+
+class Notifier:
+    """Records events off the request thread (or inline, if configured)."""
+
+    def __init__(self, app, max_batch=500, max_wait=1.0):
+        self.app = app
+        self._writer = GroupCommitter(app, deliver, max_batch, max_wait,
+                                      on_commit=self._delivered, split_failed=True)
+
+    @staticmethod
+    def _delivered(events):
+        forget_unread({event.user_id for event in events})
+
+    def notify(self, user_id, kind, actor_id, message_id=None):
+        """Tell `user_id` that `actor_id` did `kind` (to `message_id`)."""
+
+        if user_id == actor_id:
+            return
+
+        event = Event(user_id, kind, actor_id, message_id)
+        if self.app.config.get('NOTIFICATIONS_ASYNC', True):
+            self._writer.post(event)
+        else:
+            deliver([event])
+            db.session.commit()
+            self._delivered([event])
+
+    def notify_mentions(self, text, actor_id, message_id=None):
+        """Tell the users @mentioned in `text` about it."""
+
+        _, mentions = extract_tags(text)
+        if not mentions:
+            return
+
+        mentioned = (db.session
+                     .query(User.id)
+                     .filter(db.func.lower(User.username).in_(mentions),
+                             User.deleted_at.is_(None)))
+        for user_id, in mentioned:
+            self.notify(user_id, 'mention', actor_id, message_id)
@@ -0,0 +1,172 @@
+"""Monthly partitions of the messages table (Postgres only).
+
+migrations/0006_partition_messages.sql turns `messages` into a table
+partitioned by range of `timestamp`: everything written before the
+migration stays in one `messages_history` partition, and later rows go
+into a partition per month, named like `messages_p2024_05`. A default
+partition catches anything no month partition covers.
+
+Two jobs keep it that way, both meant to run from cron through the
+`flask partitions` commands:
+
+- `create_partitions` adds partitions for the coming months, so new rows
+  never land in the default partition (a month's partition can't be
+  created while the default partition holds rows for that month)
+- `detach_partitions` moves the messages older than the retention period
+  into the message archive (see archive.py), where profile pages still
+  read them, then detaches and drops the month partitions that leaves
+  empty. A month still holding messages, because they belong to a
+  conversation with newer messages, stays attached until the whole
+  conversation can be archived. So does `messages_history`, whose range
+  has no lower bound.
+
+Reads that bound `timestamp` (see `Message.newest`) only scan the
+partitions that bound covers.
+"""
+
+import re
+from collections import namedtuple
+from datetime import date, datetime
+
+from sqlalchemy import text
+
+from models import db
+
+PARENT = 'messages'
+
+# A partition and its range; `start` is None for MINVALUE, and both are
+# None for the default partition.
+Partition = namedtuple('Partition', 'name start end')
+
+BOUND_RE = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+def month_start(day):
+    """The first day of `day`'s month."""
+
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, count):
+    """The first day of the month `count` months after `month`."""
+
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"{PARENT}_p{month:%Y_%m}"
+
+
+def create_partition_sql(month):
+    """DDL for the partition holding `month`'s rows."""
+
+    return (f"CREATE TABLE IF NOT EXISTS {partition_name(month)} "
+            f"PARTITION OF {PARENT} "
+            f"FOR VALUES FROM ('{month.isoformat()}') "
+            f"TO ('{add_months(month, 1).isoformat()}')")
+
+
+def _parse_bound(value):
+    if value == 'MINVALUE':
+        return None
+    if value == 'MAXVALUE':
+        return datetime.max
+
+    return datetime.fromisoformat(value.strip("'"))
+
+
+def parse_partition(name, bound):
+    """Partition from a name and its `pg_get_expr(relpartbound)` text."""
+
+    match = BOUND_RE.search(bound)
+    if match is None:
+        return Partition(name, None, None)
+
+    return Partition(name, *map(_parse_bound, match.groups()))
+
+
+def expired(partitions, cutoff):
+    """The month partitions whose rows all predate `cutoff`, oldest first.
+
+    Never the history partition: it would take any row older than it.
+    """
+
+    return sorted((partition for partition in partitions
+                   if partition.start is not None
+                   and partition.end is not None and partition.end <= cutoff),
+                  key=lambda partition: partition.end)
+
+
+def is_partitioned():
+    """Is the messages table partitioned in the connected database?"""
+
+    if db.engine.dialect.name != 'postgresql':
+        return False
+
+    return db.session.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+        "WHERE partrelid = to_regclass(:parent))"), {'parent': PARENT}).scalar()
+
+
+def list_partitions():
+    """The partitions of the messages table, in no particular order."""
+
+    rows = db.session.execute(text(
+        "SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) "
+        "FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = to_regclass(:parent)"), {'parent': PARENT})
+
+    return [parse_partition(name, bound) for name, bound in rows]
+
+
+def create_partitions(months_ahead=3, today=None):
+    """Make sure this month and the next `months_ahead` have partitions.
+
+    Returns the names of the partitions that were missing.
+    """
+
+    first = month_start(today or datetime.utcnow().date())
+    existing = {partition.name for partition in list_partitions()}
+
+    created = []
+    for count in range(months_ahead + 1):
+        month = add_months(first, count)
+        if partition_name(month) not in existing:
+            db.session.execute(text(create_partition_sql(month)))
+            created.append(partition_name(month))
+    db.session.commit()
+
+    return created
+
+
+def is_empty(name):
+    """Does partition `name` hold no rows?"""
+
+    return not db.session.execute(text(f"SELECT EXISTS (SELECT 1 FROM {name})")).scalar()
+
+
+def detach_partitions(archive, keep_months, today=None):
+    """Move the messages older than the last `keep_months` months into
+    `archive` (a MessageArchive), then detach and drop the partitions
+    that leaves empty (see module doc).
+
+    Returns the names of the dropped partitions.
+    """
+
+    first = month_start(today or datetime.utcnow().date())
+    cutoff = datetime.combine(add_months(first, -keep_months), datetime.min.time())
+    archive.archive(cutoff)
+
+    dropped = []
+    for partition in expired(list_partitions(), cutoff):
+        if not is_empty(partition.name):
+            continue
+        db.session.execute(text(
+            f"ALTER TABLE {PARENT} DETACH PARTITION {partition.name}"))
+        db.session.execute(text(f"DROP TABLE {partition.name}"))
+        dropped.append(partition.name)
+    db.session.commit()
+
+    return dropped
@@ -0,0 +1,106 @@
+"""Rate limiting for Warbler.
+
+Each (route, client) pair gets a token bucket: it holds up to `burst`
+tokens, refills at `rate` tokens per second, and every request takes one.
+A request that finds the bucket empty is turned away, along with how long
+until a token will be back.
+
+A client is the logged-in user if there is one, and otherwise the remote
+address, so anonymous requests to /login and /signup are limited per IP.
+
+Buckets live in a backend. `MemoryBackend` keeps them in this process,
+which limits each worker separately; anything with the same `take()`
+method (a store shared between workers, say) can replace it.
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+PERIODS = {
+    'second': 1,
+    'minute': 60,
+    'hour': 60 * 60,
+    'day': 24 * 60 * 60,
+}
+
+
+class Quota(namedtuple('Quota', 'rate burst')):
+    """`burst` requests at once, refilled at `rate` per second."""
+
+    @classmethod
+    def parse(cls, spec):
+        """Quota from a string like "30/minute": up to 30 at once, and 30
+        a minute after that.
+        """
+
+        count, period = spec.split('/')
+        count = int(count)
+        return cls(count / PERIODS[period.strip()], count)
+
+
+class MemoryBackend:
+    """Token buckets in a dict, forgetting the least recently used ones
+    past `max_keys`.
+
+    A forgotten bucket comes back full, which is what an idle client's
+    bucket would have refilled to anyway.
+    """
+
+    def __init__(self, max_keys=100000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1):
+        """Take `cost` tokens from the bucket at `key`.
+
+        Returns 0 if they were taken, or else how many seconds until the
+        bucket will hold them.
+        """
+
+        now = self.clock()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+
+            wait = 0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+        return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class RateLimiter:
+    """Per-route quotas over a token bucket backend."""
+
+    def __init__(self, backend, quotas):
+        """`quotas` maps endpoint names to Quotas or strings like "30/minute"."""
+
+        self.backend = backend
+        self.quotas = {endpoint: quota if isinstance(quota, Quota) else Quota.parse(quota)
+                       for endpoint, quota in quotas.items()}
+
+    def check(self, endpoint, client):
+        """Count a request by `client` to `endpoint`.
+
+        Returns 0 if it is within quota (or the endpoint has none), or
+        else how many seconds the client should wait.
+        """
+
+        quota = self.quotas.get(endpoint)
+        if quota is None:
+            return 0
+
+        return self.backend.take(f"{endpoint}:{client}", quota.rate, quota.burst)
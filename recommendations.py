@@ -0,0 +1,158 @@
+""""Who to follow" suggestions for Warbler.
+
+Candidates come from two walks over the follow graph:
+
+- friends of friends: users followed by the people you follow
+- shared followers: users followed by the people who follow you
+
+The walks run over the in-memory `FollowGraph` (see follow_graph.py), and
+candidates are scored with vectorized NumPy operations.
+
+`flask recommend-all` scores every user in one batch and stores the
+results in the suggestions table, where every web worker finds them.
+Users the last batch has no suggestions for are scored on demand.
+Stored suggestions are filtered against who the user follows now, as
+they may predate a follow. Either way, results are cached per process and
+dropped whenever the graph reports a change that touches that user.
+"""
+
+import threading
+
+import numpy as np
+
+from models import db, follow_graph, Suggestion
+
+FRIEND_OF_FRIEND_WEIGHT = 2
+SHARED_FOLLOWER_WEIGHT = 1
+
+# Neighbours looked at per hop, so celebrities don't make a walk unbounded.
+MAX_FANOUT = 500
+
+
+class SuggestionStore:
+    """Suggestions kept in the suggestions table."""
+
+    def __init__(self, batch_size=10000):
+        self.batch_size = batch_size
+
+    def load(self, user_id):
+        """`user_id`'s stored suggestions, best first."""
+
+        return [suggested_id for suggested_id, in (db.session
+                                                   .query(Suggestion.suggested_id)
+                                                   .filter(Suggestion.user_id == user_id)
+                                                   .order_by(Suggestion.rank))]
+
+    def replace(self, suggestions):
+        """Store {user id: suggested ids} in place of all earlier
+        suggestions, in one transaction."""
+
+        Suggestion.query.delete(synchronize_session=False)
+        batch = []
+        for user_id, suggested_ids in suggestions.items():
+            batch.extend({'user_id': user_id, 'rank': rank, 'suggested_id': suggested_id}
+                         for rank, suggested_id in enumerate(suggested_ids))
+            if len(batch) >= self.batch_size:
+                db.session.execute(Suggestion.__table__.insert(), batch)
+                batch = []
+        if batch:
+            db.session.execute(Suggestion.__table__.insert(), batch)
+        db.session.commit()
+
+
+class FollowRecommender:
+    """Top-K suggestion cache over a `FollowGraph`, backed by `store`
+    (a `SuggestionStore`) if given."""
+
+    def __init__(self, graph, max_fanout=MAX_FANOUT, store=None):
+        self.graph = graph
+        self.max_fanout = max_fanout
+        self.store = store
+        self._suggestions = {}
+        self._lock = threading.Lock()
+        graph.listeners.append(self._graph_changed)
+
+    def _graph_changed(self, user_ids):
+        """Forget suggestions for `user_ids`, or for everyone if None."""
+
+        with self._lock:
+            if user_ids is None:
+                self._suggestions = {}
+            else:
+                for user_id in user_ids:
+                    self._suggestions.pop(user_id, None)
+
+    def scores(self, user_id):
+        """(candidate ids, scores) arrays for `user_id`."""
+
+        following = self.graph.following(user_id)
+        candidates = []
+        weights = []
+
+        for weight, hops in ((FRIEND_OF_FRIEND_WEIGHT, following),
+                             (SHARED_FOLLOWER_WEIGHT, self.graph.followers(user_id))):
+            for neighbour_id in hops[:self.max_fanout].tolist():
+                reached = self.graph.following(neighbour_id)[:self.max_fanout]
+                candidates.append(reached)
+                weights.append(np.full(len(reached), weight))
+
+        if not candidates:
+            return np.empty(0, dtype=np.int32), np.empty(0)
+
+        ids, inverse = np.unique(np.concatenate(candidates), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(weights))
+
+        keep = (ids != user_id) & ~np.isin(ids, following, assume_unique=True)
+        return ids[keep], totals[keep]
+
+    def top(self, user_id, k):
+        """The `k` best-scored candidates for `user_id`, best first."""
+
+        ids, totals = self.scores(user_id)
+        best = np.lexsort((ids, -totals))[:k]
+        return ids[best].tolist()
+
+    def suggest(self, user_id, k=5):
+        """Up to `k` user ids `user_id` might want to follow."""
+
+        with self._lock:
+            cached_k, cached = self._suggestions.get(user_id, (0, None))
+
+        if cached is None or cached_k < k:
+            cached = self.stored(user_id) or self.top(user_id, k)
+            with self._lock:
+                self._suggestions[user_id] = (k, cached)
+
+        return cached[:k]
+
+    def stored(self, user_id):
+        """`user_id`'s suggestions from the last batch, less anyone they
+        follow by now."""
+
+        if self.store is None:
+            return []
+
+        following = set(self.graph.following(user_id).tolist())
+        return [suggested_id for suggested_id in self.store.load(user_id)
+                if suggested_id not in following]
+
+    def recompute_all(self, k=5):
+        """Batch mode: reload the graph, score every user and store the
+        results for every process to read.
+
+        Returns how many users were scored.
+        """
+
+        self.graph.rebuild()
+        suggestions = {user_id: self.top(user_id, k)
+                       for user_id in self.graph.user_ids().tolist()}
+        if self.store is not None:
+            self.store.replace(suggestions)
+        with self._lock:
+            self._suggestions = {user_id: (k, suggested_ids)
+                                 for user_id, suggested_ids in suggestions.items()}
+
+        return len(suggestions)
+
+
+recommender = FollowRecommender(follow_graph, store=SuggestionStore())
@@ -1,6 +1,8 @@
 """Seed database with sample data from CSV Files."""
 
 from csv import DictReader
+from sqlalchemy import text
+
 from app import db
 from models import User, Message, Follows
 
@@ -18,3 +20,13 @@ with open('generator/follows.csv') as follows:
     db.session.bulk_insert_mappings(Follows, DictReader(follows))
 
 db.session.commit()
+
+# Rows from an export (see export.py) come with their ids, which Postgres
+# doesn't count against the id sequences; move those past the rows loaded
+# so the next signup or post doesn't collide with one of them
+if db.engine.dialect.name == 'postgresql':
+    for table in (User.__tablename__, Message.__tablename__):
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"coalesce(max(id), 0) + 1, false) FROM {table}"))
+    db.session.commit()
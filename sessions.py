@@ -0,0 +1,314 @@
+"""Server-side sessions for Warbler.
+
+Flask's default session lives in a signed cookie, so every request
+verifies and re-signs it, and a session can't be taken back: a deleted
+account stays logged in wherever its cookie survives. Here the cookie
+only holds a random session id, and the data lives in a backend:
+
+- `MemoryBackend`, a bounded LRU map; per process, so for one-process
+  setups and tests
+- `FileBackend`, a file per session in a local directory, shared by
+  every process on the machine
+
+A session is only read from the backend the first time a request
+touches it, and only written back if the request changed it. Payloads
+are Flask's tagged JSON (so flashes, which are tuples, round-trip),
+zlib-compressed once they get big.
+
+Each backend also indexes sessions by user, so `revoke_user` can end all
+of a user's sessions at once. Logging in or out issues a new session id,
+so an id seen before login is useless after it.
+
+A session expires PERMANENT_SESSION_LIFETIME after it was last written
+(a login, a flash), not after it was last used: reading a session never
+writes it, so it never renews it either.
+"""
+
+import os
+import re
+import secrets
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+
+# Payloads bigger than this are compressed
+COMPRESS_OVER = 256
+
+
+def dumps(data):
+    payload = session_json_serializer.dumps(data).encode()
+    if len(payload) > COMPRESS_OVER:
+        return b'z' + zlib.compress(payload)
+    return b'j' + payload
+
+
+def loads(blob):
+    payload = zlib.decompress(blob[1:]) if blob[:1] == b'z' else blob[1:]
+    return session_json_serializer.loads(payload.decode())
+
+
+SID_RE = re.compile(r'[A-Za-z0-9_-]{22}\Z')
+
+
+def new_sid():
+    """A compact, unguessable session id: 128 random bits, 22 characters."""
+
+    return secrets.token_urlsafe(16)
+
+
+def valid_sid(sid):
+    """Could `new_sid` have made `sid`? Session ids come from cookies."""
+
+    return bool(sid) and SID_RE.match(sid) is not None
+
+
+class MemoryBackend:
+    """Sessions in a bounded LRU map, with expiry."""
+
+    def __init__(self, max_entries=100000, clock=time.time):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._by_user = {}
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            blob, user_id, expires_at = entry
+            if expires_at <= self.clock():
+                self._remove(sid)
+                return None
+            self._entries.move_to_end(sid)
+            return blob
+
+    def set(self, sid, blob, user_id, ttl):
+        with self._lock:
+            self._remove(sid)
+            self._entries[sid] = (blob, user_id, self.clock() + ttl)
+            if user_id is not None:
+                self._by_user.setdefault(user_id, set()).add(sid)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, sid):
+        with self._lock:
+            self._remove(sid)
+
+    def delete_user(self, user_id):
+        with self._lock:
+            for sid in list(self._by_user.get(user_id, ())):
+                self._remove(sid)
+
+    def _remove(self, sid):
+        entry = self._entries.pop(sid, None)
+        if entry is not None and entry[1] is not None:
+            sids = self._by_user.get(entry[1])
+            sids.discard(sid)
+            if not sids:
+                del self._by_user[entry[1]]
+
+
+class FileBackend:
+    """Sessions as files in `directory`/sessions, each starting with its
+    expiry time; `directory`/users/<user id>/<sid> marker files index them
+    by user.
+    """
+
+    def __init__(self, directory, clock=time.time):
+        self.directory = directory
+        self.clock = clock
+        self._sessions = os.path.join(directory, 'sessions')
+        self._users = os.path.join(directory, 'users')
+        os.makedirs(self._sessions, exist_ok=True)
+        os.makedirs(self._users, exist_ok=True)
+
+    def _path(self, sid):
+        # Only ever a plain name in the sessions directory
+        if not valid_sid(sid):
+            return None
+        return os.path.join(self._sessions, sid)
+
+    def _user_dir(self, user_id):
+        return os.path.join(self._users, str(int(user_id)))
+
+    def get(self, sid):
+        path = self._path(sid)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                expires_at = float(f.readline())
+                blob = f.read()
+        except (OSError, ValueError):
+            return None
+        if expires_at <= self.clock():
+            self.delete(sid)
+            return None
+        return blob
+
+    def set(self, sid, blob, user_id, ttl):
+        path = self._path(sid)
+        if path is None:
+            raise ValueError(f"Not a session id: {sid!r}")
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(b'%f\n' % (self.clock() + ttl))
+            f.write(blob)
+        os.replace(tmp, path)
+        if user_id is not None:
+            os.makedirs(self._user_dir(user_id), exist_ok=True)
+            open(os.path.join(self._user_dir(user_id), sid), 'w').close()
+
+    def delete(self, sid):
+        path = self._path(sid)
+        if path is not None:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def delete_user(self, user_id):
+        try:
+            sids = os.listdir(self._user_dir(user_id))
+        except OSError:
+            return
+        for sid in sids:
+            self.delete(sid)
+            try:
+                os.remove(os.path.join(self._user_dir(user_id), sid))
+            except OSError:
+                pass
+
+    def sweep(self):
+        """Remove expired sessions and stale user markers. Returns how many
+        sessions were removed."""
+
+        removed = 0
+        for name in os.listdir(self._sessions):
+            if valid_sid(name) and self.get(name) is None:
+                removed += 1
+        for user_id in os.listdir(self._users):
+            for sid in os.listdir(os.path.join(self._users, user_id)):
+                if not os.path.exists(os.path.join(self._sessions, sid)):
+                    os.remove(os.path.join(self._users, user_id, sid))
+        return removed
+
+
+class ServerSession(SessionMixin, MutableMapping):
+    """A session whose data is fetched from the backend on first use."""
+
+    def __init__(self, sid, load, user_key):
+        self.sid = sid
+        self._load = load
+        self._user_key = user_key
+        self._data = None
+        self.loaded_user = None
+        self.modified = False
+
+    @property
+    def data(self):
+        if self._data is None:
+            data = self._load(self.sid) if self.sid else None
+            if data is None:
+                # Never adopt an id we didn't issue (or that has expired)
+                self.sid = None
+                data = {}
+            self._data = data
+            self.loaded_user = data.get(self._user_key)
+        return self._data
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self.data[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class ServerSessionInterface(SessionInterface):
+    """Keeps session data in `backend`; the cookie holds only its id."""
+
+    def __init__(self, backend, user_key):
+        """`user_key` is the session key holding the logged-in user's id."""
+
+        self.backend = backend
+        self.user_key = user_key
+
+    def _load(self, sid):
+        blob = self.backend.get(sid)
+        return loads(blob) if blob is not None else None
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.session_cookie_name)
+        return ServerSession(sid if valid_sid(sid) else None, self._load, self.user_key)
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session.loaded:
+            return
+        # The response depended on who asked
+        response.vary.add('Cookie')
+        if not session.modified:
+            return
+
+        if not session:
+            if session.sid:
+                self.backend.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+
+        user_id = session.get(self.user_key)
+        if session.sid and user_id != session.loaded_user:
+            # Logging in or out: a new id, so an old one can't be replayed
+            self.backend.delete(session.sid)
+            session.sid = None
+        if session.sid is None:
+            session.sid = new_sid()
+
+        ttl = app.permanent_session_lifetime.total_seconds()
+        self.backend.set(session.sid, dumps(dict(session)), user_id, ttl)
+        response.set_cookie(app.session_cookie_name, session.sid,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+    def revoke_user(self, user_id):
+        """End every session `user_id` is logged in with."""
+
+        self.backend.delete_user(user_id)
+
+
+def session_interface_for(config, user_key):
+    """The session interface SESSION_BACKEND asks for."""
+
+    if config['SESSION_BACKEND'] == 'file':
+        backend = FileBackend(config['SESSION_DIR'])
+    else:
+        backend = MemoryBackend(config['SESSION_MAX_ENTRIES'])
+
+    return ServerSessionInterface(backend, user_key)
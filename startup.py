@@ -0,0 +1,86 @@
+"""Startup warm-up and timing for Warbler.
+
+Jinja compiles a template the first time it is rendered, so a freshly
+started worker serves its first requests slowly. To avoid that:
+
+- compiled templates go to a bytecode cache on disk, which every worker
+  pointed at the same directory shares, so only the first worker after a
+  deploy compiles anything
+- `warm_up` compiles every template (and opens a database connection)
+  before the first request instead of during it
+
+`StartupTimer` records how long each step of startup took; app.py logs it
+and `flask startup-report` prints it.
+"""
+
+import os
+import time
+
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy.exc import SQLAlchemyError
+
+# Taken when this module is first imported, which app.py does before
+# anything else, so the first phase covers importing the app's modules.
+STARTED = time.perf_counter()
+
+
+class StartupTimer:
+    """Durations of consecutive startup phases."""
+
+    def __init__(self, started=STARTED, clock=time.perf_counter):
+        self.clock = clock
+        self.phases = []
+        self._last = started
+
+    def lap(self, name):
+        """Record the time since the previous lap as phase `name`."""
+
+        now = self.clock()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    @property
+    def total(self):
+        return sum(seconds for name, seconds in self.phases)
+
+    def report(self):
+        """One line per phase, then the total, in milliseconds."""
+
+        lines = [f"{name:<12} {seconds * 1000:>8.1f} ms" for name, seconds in self.phases]
+        lines.append(f"{'total':<12} {self.total * 1000:>8.1f} ms")
+        return "\n".join(lines)
+
+
+def enable_bytecode_cache(app, directory):
+    """Keep `app`'s compiled templates in `directory`."""
+
+    os.makedirs(directory, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+
+def compile_templates(app):
+    """Load every template, compiling any the bytecode cache lacks.
+
+    Returns how many templates were loaded.
+    """
+
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+
+    return len(names)
+
+
+def warm_up(app, db, timer):
+    """Connect to the database and compile templates, timing both."""
+
+    with app.app_context():
+        try:
+            db.engine.connect().close()
+        except SQLAlchemyError as exc:
+            # Requests will retry; don't keep the worker from starting
+            app.logger.warning("Database not reachable at startup: %s", exc)
+    timer.lap('connect')
+
+    compile_templates(app)
+    timer.lap('templates')
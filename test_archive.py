@@ -0,0 +1,205 @@
+"""Message archive tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_archive.py
+
+
+# First, so that app loads the testing profile (see testing.py)
+import testing
+
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+import app as warbler
+from app import app
+import archive as warbler_archive
+from archive import MessageArchive
+from deletion import soft_delete_user, purge_user
+from export import export
+from models import db, User, Message, Likes
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+class ArchiveTestCase(TestCase):
+    """Test archiving old messages and reading them back."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        self.u1 = User.signup("u1", "u1@test.com", "password", None)
+        self.u2 = User.signup("u2", "u2@test.com", "password", None)
+        db.session.commit()
+        self.u1_id = self.u1.id
+        self.u2_id = self.u2.id
+
+        # Ten old messages each, a day apart, and one recent one for u1
+        self.old = datetime(2020, 1, 1)
+        for user_id in (self.u1_id, self.u2_id):
+            db.session.add_all([Message(text=f"old {day}", user_id=user_id,
+                                        timestamp=self.old + timedelta(days=day))
+                                for day in range(10)])
+        db.session.add(Message(text="brand new", user_id=self.u1_id))
+        db.session.commit()
+
+        self.directory = tempfile.mkdtemp()
+        self.archive = MessageArchive(self.directory, block_size=3)
+        self.cutoff = datetime(2021, 1, 1)
+
+    def tearDown(self):
+        db.session.rollback()
+        db.session.remove()
+        shutil.rmtree(self.directory)
+
+    def test_archive_and_page(self):
+        """Testing that old messages move to the archive and page back in order"""
+        liked = Message.query.filter_by(text="old 9", user_id=self.u1_id).one()
+        db.session.add(Likes(user_id=self.u2_id, message_id=liked.id))
+        db.session.commit()
+
+        self.assertEqual(self.archive.archive(self.cutoff), 20)
+        self.assertEqual([m.text for m in Message.query.all()], ["brand new"])
+        self.assertEqual(Likes.query.count(), 0)
+
+        page = self.archive.user_page(self.u1_id, limit=4)
+        self.assertEqual([m.text for m in page], ["old 9", "old 8", "old 7", "old 6"])
+        self.assertEqual(page[0].like_count, 1)
+
+        page = self.archive.user_page(self.u1_id, page[-1].cursor, limit=4)
+        self.assertEqual([m.text for m in page], ["old 5", "old 4", "old 3", "old 2"])
+        self.assertTrue(all(m.user_id == self.u1_id for m in page))
+
+        page = self.archive.user_page(self.u2_id, page[-1].cursor, limit=10)
+        self.assertEqual([m.text for m in page], ["old 1", "old 0"])
+
+        # Nothing left to archive
+        self.assertEqual(self.archive.archive(self.cutoff), 0)
+
+    def test_live_conversations_stay(self):
+        """Testing that an old message with a recent reply isn't archived"""
+        parent = Message.query.filter_by(text="old 0", user_id=self.u1_id).one()
+        Message.add_reply(parent, "recent reply", self.u2_id)
+        db.session.commit()
+
+        self.assertEqual(self.archive.archive(self.cutoff), 19)
+        self.assertEqual(Message.query.filter_by(id=parent.id).count(), 1)
+
+    def test_interrupted_run(self):
+        """Testing that a segment written but not deleted is finished next run"""
+        finish = self.archive._finish
+        self.archive._finish = lambda name, batch_size: 0
+        self.archive.archive(self.cutoff)
+        self.assertEqual(self.archive.user_page(self.u1_id), [])
+        self.assertEqual(Message.query.count(), 21)
+
+        self.archive._finish = finish
+        self.archive.archive(self.cutoff + timedelta(days=1))
+        self.assertEqual(Message.query.count(), 1)
+        self.assertEqual(len(self.archive.user_page(self.u1_id)), 10)
+        self.assertEqual(len([name for name in os.listdir(self.directory)
+                              if name.endswith('.ndjson.gz')]), 1)
+
+    def test_count_and_export(self):
+        """Testing that archived messages are counted and exported"""
+        self.archive.archive(self.cutoff)
+        self.assertEqual(self.archive.count(self.u1_id), 10)
+        self.assertEqual(self.archive.count(12345), 0)
+
+        lines = ''.join(export('messages', 'csv', self.u1_id,
+                               archive=self.archive)).splitlines()
+        self.assertEqual(lines[0], "id,text,timestamp,user_id")
+        self.assertEqual(len(lines), 12)
+        self.assertIn("old 0", lines[-1])
+        everyone = ''.join(export('messages', 'csv', archive=self.archive))
+        self.assertEqual(len(everyone.splitlines()), 22)
+
+    def test_purge(self):
+        """Testing that purging an account takes its archived messages and
+        the replies to them, first from reads and then from the files"""
+        parent = Message.query.filter_by(text="old 0", user_id=self.u1_id).one()
+        reply = Message.add_reply(parent, "old reply", self.u2_id)
+        reply.timestamp = self.old + timedelta(days=1)
+        db.session.commit()
+        self.archive.archive(self.cutoff)
+        self.assertEqual(self.archive.count(self.u2_id), 11)
+
+        soft_delete_user(User.query.get(self.u1_id))
+        db.session.commit()
+        purge_user(self.u1_id, archive=self.archive)
+
+        self.assertEqual(self.archive.user_page(self.u1_id), [])
+        self.assertEqual(self.archive.count(self.u1_id), 0)
+        self.assertEqual(self.archive.count(self.u2_id), 10)
+        self.assertNotIn("old reply",
+                         [m.text for m in self.archive.user_page(self.u2_id)])
+        self.assertEqual({m.user_id for m in self.archive.rows()}, {self.u2_id})
+
+        # The next run rewrites the segment without them
+        self.archive.archive(self.cutoff)
+        self.assertEqual(self.archive._tombstones(), (set(), set()))
+        rows = [row for segment in self.archive._manifest()['segments']
+                for row in self.archive._segment_rows(segment['name'])]
+        self.assertEqual(len(rows), 10)
+        self.assertEqual({row.user_id for row in rows}, {self.u2_id})
+        self.assertEqual(len(self.archive.user_page(self.u2_id)), 10)
+        self.assertEqual(len([name for name in os.listdir(self.directory)
+                              if name.endswith('.ndjson.gz')]), 1)
+
+    def test_interrupted_rewrite(self):
+        """Testing that a rewrite cut short is cleaned up and redone"""
+        self.archive.archive(self.cutoff)
+        self.archive.purge_user(self.u1_id)
+
+        # Written, but stopped before the manifest switched over
+        write_json = warbler_archive._write_json
+
+        def crash(path, value):
+            if path.endswith(warbler_archive.MANIFEST):
+                raise OSError("disk full")
+            write_json(path, value)
+
+        warbler_archive._write_json = crash
+        try:
+            with self.assertRaises(OSError):
+                self.archive.archive(self.cutoff)
+        finally:
+            warbler_archive._write_json = write_json
+        self.assertEqual(len([name for name in os.listdir(self.directory)
+                              if name.endswith('.ndjson.gz')]), 2)
+        self.assertEqual(self.archive.count(self.u2_id), 10)
+
+        self.archive.archive(self.cutoff)
+        self.assertEqual(self.archive.count(self.u1_id), 0)
+        self.assertEqual(self.archive.count(self.u2_id), 10)
+        self.assertEqual(len(os.listdir(self.directory)), 4)
+
+    def test_profile_reads_archive(self):
+        """Testing that the profile page carries on into the archive"""
+        self.archive.archive(self.cutoff)
+        warbler.message_archive, saved = self.archive, warbler.message_archive
+        per_page, app.config['MESSAGES_PER_PAGE'] = app.config['MESSAGES_PER_PAGE'], 5
+        try:
+            with app.test_client() as c:
+                html = c.get(f"/users/{self.u1_id}").get_data(as_text=True)
+                self.assertIn("brand new", html)
+                self.assertIn("old 6", html)
+                self.assertNotIn("old 5", html)
+                self.assertIn("Older", html)
+                # The "Messages" stat counts the archived ones too
+                self.assertIn(f'<a href="/users/{self.u1_id}">11</a>', html)
+
+                before = self.archive.user_page(self.u1_id, limit=4)[-1].cursor
+                resp = c.get(f"/users/{self.u1_id}", query_string={'before': before})
+                self.assertIn("old 1", resp.get_data(as_text=True))
+        finally:
+            warbler.message_archive = saved
+            app.config['MESSAGES_PER_PAGE'] = per_page
@@ -0,0 +1,129 @@
+"""Static asset pipeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_assets.py
+
+# First, so that app loads the testing profile (see testing.py)
+import testing
+
+import gzip
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from app import app
+import app as warbler
+from assets import Assets, VENDOR, build, minify_css, vendor
+
+STYLE = b"""/* the navbar */
+.navbar {
+  background-image: url("/static/images/nav-bg.png");
+  color: #000;
+}
+
+.card > img,
+.card-hero {
+  width: 100%;
+}
+"""
+
+
+class AssetsTestCase(TestCase):
+    """Test building, linking and serving static assets."""
+
+    def setUp(self):
+        self.static = tempfile.TemporaryDirectory()
+        self.out = tempfile.TemporaryDirectory()
+        for path, data in [('images/nav-bg.png', b'\x89PNG fake'),
+                           ('stylesheets/style.css', STYLE * 20)]:
+            os.makedirs(os.path.join(self.static.name, os.path.dirname(path)), exist_ok=True)
+            with open(os.path.join(self.static.name, path), 'wb') as f:
+                f.write(data)
+
+    def tearDown(self):
+        self.static.cleanup()
+        self.out.cleanup()
+
+    def read(self, path):
+        with open(os.path.join(self.out.name, path), 'rb') as f:
+            return f.read()
+
+    def test_minify_css(self):
+        """Testing that comments and needless whitespace go"""
+        self.assertEqual(minify_css(STYLE.decode()),
+                         '.navbar{background-image:url("/static/images/nav-bg.png");'
+                         'color:#000}.card>img,.card-hero{width:100%}')
+
+    def test_build(self):
+        """Testing fingerprinted names, rewritten urls and precompression"""
+        built = build(self.static.name, self.out.name)
+        image = built['images/nav-bg.png']
+        style = built['stylesheets/style.css']
+        self.assertRegex(image, r'^images/nav-bg\.[0-9a-f]{10}\.png$')
+        self.assertRegex(style, r'^stylesheets/style\.[0-9a-f]{10}\.css$')
+
+        css = self.read(style)
+        self.assertIn(f'url("../{image}")'.encode(), css)
+        self.assertEqual(gzip.decompress(self.read(style + '.gz')), css)
+        self.assertFalse(os.path.exists(os.path.join(self.out.name, image + '.gz')))
+
+        manifest = json.loads(self.read('manifest.json'))
+        self.assertEqual(manifest['assets'], built)
+        self.assertIn('gzip', manifest['encodings'][style])
+
+        # A changed image renames the stylesheet that uses it
+        with open(os.path.join(self.static.name, 'images/nav-bg.png'), 'wb') as f:
+            f.write(b'\x89PNG other')
+        self.assertNotEqual(build(self.static.name, self.out.name)['stylesheets/style.css'],
+                            style)
+
+    def test_vendor(self):
+        """Testing that vendored CSS brings the fonts it uses along"""
+        fetched = []
+
+        def fetch(url):
+            fetched.append(url)
+            if url.endswith('all.css'):
+                return b"@font-face{src:url(../webfonts/fa-solid-900.woff2?v=1#fa)}"
+            return b"data"
+
+        written = vendor(self.static.name, fetch)
+        self.assertIn('vendor/fontawesome/webfonts/fa-solid-900.woff2', written)
+        self.assertIn('https://use.fontawesome.com/releases/v5.3.1/webfonts/fa-solid-900.woff2',
+                      fetched)
+        self.assertEqual(len(fetched), len(VENDOR) + 1)
+
+    def test_route(self):
+        """Testing asset_url and the immutable, precompressed responses"""
+        built = build(self.static.name, self.out.name)
+        saved = warbler.static_assets
+        warbler.static_assets = Assets(self.out.name, self.static.name)
+        try:
+            with app.test_request_context():
+                url = warbler.asset_url('stylesheets/style.css')
+                self.assertEqual(url, '/assets/' + built['stylesheets/style.css'])
+                self.assertEqual(warbler.asset_url('vendor/jquery.min.js'),
+                                 VENDOR['vendor/jquery.min.js'])
+                self.assertEqual(warbler.asset_url('favicon.ico'), '/static/favicon.ico')
+                self.assertEqual(warbler.image_url('/static/images/nav-bg.png', 'thumb'),
+                                 '/assets/' + built['images/nav-bg.png'])
+
+            with app.test_client() as c:
+                resp = c.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+                self.assertEqual(resp.status_code, 200)
+                self.assertEqual(resp.mimetype, 'text/css')
+                self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+                self.assertEqual(resp.headers['Vary'], 'Accept-Encoding')
+                self.assertIn('immutable', resp.headers['Cache-Control'])
+                self.assertEqual(gzip.decompress(resp.data), self.read(url[len('/assets/'):]))
+
+                resp = c.get(url)
+                self.assertNotIn('Content-Encoding', resp.headers)
+                self.assertIn(b'.navbar{', resp.data)
+
+                self.assertEqual(c.get("/assets/manifest.json").status_code, 404)
+                self.assertEqual(c.get("/assets/../app.py").status_code, 404)
+        finally:
+            warbler.static_assets = saved
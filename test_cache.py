@@ -0,0 +1,47 @@
+"""Cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_cache.py
+
+from unittest import TestCase
+
+from cache import Cache
+from testing import Clock
+
+
+class CacheTestCase(TestCase):
+    """Test the in-process LRU cache."""
+
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = Cache(max_entries=2, ttl=10, clock=self.clock)
+
+    def test_get_set(self):
+        """Testing that values come back until they expire"""
+        self.cache.set("a", 1)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertIsNone(self.cache.get("b"))
+
+        self.clock.now += 10
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_lru_eviction(self):
+        """Testing that the least recently used entry is evicted"""
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("c"), 3)
+
+    def test_invalidate_tag(self):
+        """Testing that invalidating a tag drops every entry carrying it"""
+        self.cache.set("a", 1, tags=["user:1"])
+        self.cache.set("b", 2, tags=["user:2"])
+        self.cache.invalidate_tag("user:1")
+
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.get("b"), 2)
@@ -0,0 +1,129 @@
+"""Response compression tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_compression.py
+
+# First, so that app loads the testing profile (see testing.py)
+import testing
+
+import gzip
+import zlib
+from unittest import TestCase
+
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+from app import app
+from compression import CompressionMiddleware, choose_encoding
+from models import db, User
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+PAGE = b"<li class='message'>Warble warble</li>\n" * 100
+
+
+def wsgi_app(body, content_type='text/html; charset=utf-8', length=True, headers=()):
+    """A WSGI app answering with `body`, a list of chunks."""
+
+    def application(environ, start_response):
+        response_headers = [('Content-Type', content_type), ('ETag', '"abc"')]
+        if length:
+            response_headers.append(('Content-Length', str(sum(map(len, body)))))
+        start_response('200 OK', response_headers + list(headers))
+        return iter(body)
+
+    return application
+
+
+def call(application, accept_encoding='gzip'):
+    environ = EnvironBuilder(path='/', headers={'Accept-Encoding': accept_encoding}).get_environ()
+    chunks, status, headers = run_wsgi_app(application, environ, buffered=False)
+    return list(chunks), headers
+
+
+class CompressionTestCase(TestCase):
+    """Test which responses are compressed, and how."""
+
+    def test_choose_encoding(self):
+        """Testing that the client's preference and q=0 are respected"""
+        self.assertEqual(choose_encoding('gzip, deflate', ('br', 'gzip')), 'gzip')
+        self.assertEqual(choose_encoding('gzip;q=0.5, br', ('br', 'gzip')), 'br')
+        self.assertEqual(choose_encoding('br, gzip', ('gzip',)), 'gzip')
+        self.assertIsNone(choose_encoding('gzip;q=0, identity', ('br', 'gzip')))
+        self.assertIsNone(choose_encoding(None))
+
+    def test_compresses(self):
+        """Testing headers and body of a compressed page"""
+        middleware = CompressionMiddleware(wsgi_app([PAGE], headers=[('Vary', 'Cookie')]))
+        chunks, headers = call(middleware)
+
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Vary'], 'Cookie, Accept-Encoding')
+        self.assertEqual(headers['ETag'], 'W/"abc"')
+        self.assertNotIn('Content-Length', headers)
+        self.assertEqual(gzip.decompress(b''.join(chunks)), PAGE)
+        self.assertLess(len(b''.join(chunks)), len(PAGE) / 10)
+
+    def test_left_alone(self):
+        """Testing that small, binary, encoded and unasked-for responses pass"""
+        cases = [
+            (wsgi_app([b"<p>short</p>"]), 'gzip'),
+            (wsgi_app([b"<p>short</p>"], length=False), 'gzip'),
+            (wsgi_app([PAGE], content_type='image/png'), 'gzip'),
+            (wsgi_app([PAGE], headers=[('Content-Encoding', 'br')]), 'gzip'),
+            (wsgi_app([PAGE], headers=[('Cache-Control', 'no-transform')]), 'gzip'),
+            (wsgi_app([PAGE]), 'identity'),
+        ]
+        for application, accept_encoding in cases:
+            chunks, headers = call(CompressionMiddleware(application), accept_encoding)
+            self.assertNotEqual(headers.get('Content-Encoding'), 'gzip')
+            self.assertNotIn('Accept-Encoding', headers.get('Vary', ''))
+
+    def test_streaming(self):
+        """Testing that each chunk of a stream can be read as it arrives"""
+        body = [b"id,text\n" + PAGE] + [b"%d,warble\n" % n for n in range(5)]
+        chunks, headers = call(CompressionMiddleware(wsgi_app(body, length=False)))
+
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        received = [decompressor.decompress(chunk) for chunk in chunks]
+        # Every source chunk is readable once its own compressed chunk is in
+        self.assertEqual(received[:len(body)], body)
+        self.assertEqual(b''.join(received), b''.join(body))
+
+    def test_app(self):
+        """Testing that pages from the app come compressed when asked for"""
+        db.drop_all()
+        db.create_all()
+        for n in range(30):
+            User.signup(f"user{n}", f"user{n}@test.com", "password", None)
+        db.session.commit()
+
+        with app.test_client() as c:
+            resp = c.get("/users", headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+            self.assertIn(b'@user29', gzip.decompress(resp.data))
+
+            resp = c.get("/users")
+            self.assertNotIn('Content-Encoding', resp.headers)
+            self.assertIn(b'@user29', resp.data)
+
+        db.session.remove()
+
+    def test_csrf_pages_left_alone(self):
+        """Testing that pages carrying a CSRF token aren't compressed"""
+        app.config['WTF_CSRF_ENABLED'] = True
+        try:
+            with app.test_client() as c:
+                resp = c.get("/signup", headers={'Accept-Encoding': 'gzip'})
+        finally:
+            app.config['WTF_CSRF_ENABLED'] = False
+
+        self.assertIn(b'name="csrf_token"', resp.data)
+        self.assertGreater(len(resp.data), 500)
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertIn('no-transform', resp.headers['Cache-Control'])
@@ -0,0 +1,45 @@
+"""Configuration profile tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_config.py
+
+import os
+from unittest import TestCase, mock
+
+from config import (config_for, DevelopmentConfig, TestingConfig,
+                    ProductionConfig)
+
+
+class ConfigTestCase(TestCase):
+    """Test picking a configuration profile."""
+
+    def test_config_for(self):
+        """Testing that the profile comes from the environment"""
+        self.assertIs(config_for('testing'), TestingConfig)
+
+        with mock.patch.dict(os.environ, {'WARBLER_ENV': 'development'}):
+            self.assertIs(config_for(), DevelopmentConfig)
+
+        with mock.patch.dict(os.environ, {'WARBLER_ENV': '', 'FLASK_ENV': ''}):
+            with mock.patch.object(ProductionConfig, 'SECRET_KEY', "from the environment"):
+                self.assertIs(config_for(), ProductionConfig)
+
+        with self.assertRaises(KeyError):
+            config_for('staging')
+
+    def test_debug_tooling(self):
+        """Testing that only development turns on debug tooling"""
+        self.assertTrue(DevelopmentConfig.DEBUG_TB_ENABLED)
+        for config in (TestingConfig, ProductionConfig):
+            self.assertFalse(config.DEBUG)
+            self.assertFalse(config.DEBUG_TB_ENABLED)
+            self.assertFalse(config.SQLALCHEMY_RECORD_QUERIES)
+
+    def test_production_secret_key(self):
+        """Testing that production won't start with no SECRET_KEY of its own"""
+        with mock.patch.object(ProductionConfig, 'SECRET_KEY', None):
+            with self.assertRaises(RuntimeError):
+                config_for('production')
+
+        self.assertTrue(config_for('development').SECRET_KEY)
@@ -0,0 +1,106 @@
+"""Export tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_export.py
+
+
+# First, so that app loads the testing profile (see testing.py)
+import testing
+
+from app import app, CURR_USER_KEY
+import json
+from csv import DictReader
+from datetime import datetime
+from io import StringIO
+from unittest import TestCase
+
+from export import export, chunked
+from models import db, User, Message, Follows
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+class ExportTestCase(TestCase):
+    """Test streaming exports."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        self.u1 = User.signup("u1", "u1@test.com", "password", None)
+        self.u2 = User.signup("u2", "u2@test.com", "password", None)
+        db.session.commit()
+
+        self.u1.following.append(self.u2)
+        db.session.add_all([
+            Message(text="first, with a comma", user_id=self.u1.id),
+            Message(text="second", user_id=self.u2.id),
+        ])
+        db.session.commit()
+
+        self.u1_id = self.u1.id
+        self.u2_id = self.u2.id
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        db.session.remove()
+
+    def test_full_export_seeds(self):
+        """Testing that a full CSV export loads back the way seed.py loads"""
+        dumps = {dataset: ''.join(export(dataset, 'csv'))
+                 for dataset in ('users', 'messages', 'follows')}
+
+        db.drop_all()
+        db.create_all()
+        rows = {dataset: list(DictReader(StringIO(dump)))
+                for dataset, dump in dumps.items()}
+        # Postgres parses timestamp strings itself; SQLite needs datetimes
+        for row in rows['messages']:
+            row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+
+        for model, dataset in ((User, 'users'), (Message, 'messages'),
+                               (Follows, 'follows')):
+            db.session.bulk_insert_mappings(model, rows[dataset])
+        db.session.commit()
+
+        u1 = User.query.filter_by(username="u1").one()
+        self.assertEqual([u.username for u in u1.following], ["u2"])
+        self.assertEqual(u1.messages[0].text, "first, with a comma")
+        self.assertTrue(User.authenticate("u1", "password"))
+
+    def test_user_export(self):
+        """Testing that a user's export has only their rows, and no hash"""
+        rows = [json.loads(line) for line in
+                ''.join(export('messages', 'ndjson', self.u1_id)).splitlines()]
+        self.assertEqual([row['text'] for row in rows], ["first, with a comma"])
+
+        users = ''.join(export('users', 'csv', self.u1_id))
+        self.assertNotIn('password', users)
+        self.assertNotIn('u2', users)
+
+    def test_chunked(self):
+        """Testing that lines are grouped into chunks of about the given size"""
+        self.assertEqual(list(chunked(["ab", "cd", "e"], size=3)), ["abcd", "e"])
+
+    def test_export_route(self):
+        """Testing the export endpoint for the logged-in user"""
+        with self.client as c:
+            resp = c.get("/users/export/messages.csv")
+            self.assertEqual(resp.status_code, 302)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u2_id
+
+            resp = c.get("/users/export/messages.csv")
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(resp.is_streamed)
+            self.assertEqual(resp.mimetype, 'text/csv')
+            self.assertIn("second", resp.get_data(as_text=True))
+
+            self.assertEqual(c.get("/users/export/passwords.csv").status_code, 404)
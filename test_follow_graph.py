@@ -0,0 +1,61 @@
+"""Follow graph tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_follow_graph.py
+
+from unittest import TestCase
+
+from follow_graph import FollowGraph
+
+
+class FollowGraphTestCase(TestCase):
+    """Test the in-memory follow graph."""
+
+    def setUp(self):
+        """Build a small follow graph in memory."""
+
+        # compact_after=2 so that the tests go through compaction too
+        self.graph = FollowGraph(compact_after=2)
+        # (follower, followed)
+        self.graph.load([(1, 2), (1, 3), (2, 1), (3, 2), (4, 1)])
+
+    def test_membership(self):
+        """Testing is_following in both directions"""
+        self.assertTrue(self.graph.is_following(1, 2))
+        self.assertFalse(self.graph.is_following(2, 3))
+        self.assertFalse(self.graph.is_following(99, 1))
+        self.assertEqual(self.graph.is_following_many(1, [2, 3, 4]).tolist(),
+                         [True, True, False])
+
+    def test_degrees(self):
+        """Testing following and follower counts"""
+        self.assertEqual(self.graph.following_count(1), 2)
+        self.assertEqual(self.graph.follower_count(1), 2)
+        self.assertEqual(self.graph.follower_count(4), 0)
+
+    def test_set_operations(self):
+        """Testing mutual follows and shared followees"""
+        self.assertEqual(self.graph.mutual_follows(1).tolist(), [2])
+        self.assertEqual(self.graph.common_following(1, 3).tolist(), [2])
+
+    def test_incremental_updates(self):
+        """Testing follows and unfollows before and after compaction"""
+        self.graph.add_follow(2, 3)
+        self.graph.remove_follow(1, 2)
+        self.assertTrue(self.graph.is_following(2, 3))
+        self.assertFalse(self.graph.is_following(1, 2))
+        self.assertEqual(self.graph.followers(3).tolist(), [1, 2])
+
+        self.graph.add_follow(5, 1)
+        self.graph.add_follow(5, 2)
+        self.assertEqual(self.graph.following(5).tolist(), [1, 2])
+        self.assertEqual(self.graph.followers(1).tolist(), [2, 4, 5])
+        self.assertEqual(self.graph.following(1).tolist(), [3])
+
+    def test_remove_user(self):
+        """Testing that removing a user drops all of their edges"""
+        self.graph.remove_user(1)
+        self.assertEqual(self.graph.following(1).tolist(), [])
+        self.assertEqual(self.graph.followers(1).tolist(), [])
+        self.assertEqual(self.graph.followers(2).tolist(), [3])
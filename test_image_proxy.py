@@ -0,0 +1,157 @@
+"""Image proxy tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_image_proxy.py
+
+# First, so that app loads the testing profile (see testing.py)
+import testing
+
+import io
+import tempfile
+from unittest import TestCase
+
+from PIL import Image
+
+from app import app
+import app as warbler
+from image_proxy import (DiskCache, ImageProxy, ImageProxyError, check_url,
+                         _PublicHTTPConnection)
+
+ORIGIN = "https://images.example.com/avatar.jpg"
+PAGE = "https://images.example.com/index.html"
+
+
+def jpeg(width, height):
+    out = io.BytesIO()
+    Image.new('RGB', (width, height), 'red').save(out, 'JPEG')
+    return out.getvalue()
+
+
+class StandInOrigin:
+    """Fetcher serving fixed images, counting requests per URL."""
+
+    def __init__(self, images):
+        self.images = images
+        self.fetches = {}
+
+    def __call__(self, url):
+        self.fetches[url] = self.fetches.get(url, 0) + 1
+        if url not in self.images:
+            raise ImageProxyError(f"No image at {url}")
+        return self.images[url]
+
+
+class DiskCacheTestCase(TestCase):
+    """Test the on-disk LRU cache."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = DiskCache(self.directory.name, max_bytes=10)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_lru_eviction(self):
+        """Testing that the least recently used files go once over budget"""
+        self.cache.set("aa01", b"12345")
+        self.cache.set("bb02", b"12345")
+        self.cache.get("aa01")
+        self.cache.set("cc03", b"12345")
+
+        self.assertEqual(self.cache.get("aa01"), b"12345")
+        self.assertIsNone(self.cache.get("bb02"))
+        self.assertEqual(self.cache.total_bytes, 10)
+
+        # A fresh instance picks up what is on disk
+        self.assertEqual(DiskCache(self.directory.name).total_bytes, 10)
+
+
+class ImageProxyTestCase(TestCase):
+    """Test thumbnailing and the proxy route."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.origin = StandInOrigin({ORIGIN: jpeg(1000, 500)})
+        self.origin.images[PAGE] = b"<html>not an image</html>"
+        self.clock = testing.Clock()
+        self.proxy = ImageProxy(DiskCache(self.directory.name), "secret",
+                                fetch=self.origin, clock=self.clock)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_thumbnail(self):
+        """Testing that each size is made once from a single fetch"""
+        data, mimetype, etag = self.proxy.thumbnail(ORIGIN, 'avatar')
+        self.assertEqual(mimetype, 'image/jpeg')
+        self.assertEqual(Image.open(io.BytesIO(data)).size, (300, 150))
+
+        self.proxy.thumbnail(ORIGIN, 'avatar')
+        self.proxy.thumbnail(ORIGIN, 'thumb')
+        self.assertEqual(self.origin.fetches[ORIGIN], 1)
+
+        with self.assertRaises(ImageProxyError):
+            self.proxy.thumbnail("https://images.example.com/missing.jpg", 'thumb')
+
+    def test_failures_cached(self):
+        """Testing that a URL that failed isn't fetched again for a while"""
+        missing = "https://images.example.com/missing.jpg"
+        for size in ('thumb', 'avatar', 'thumb'):
+            with self.assertRaises(ImageProxyError):
+                self.proxy.thumbnail(missing, size)
+        self.assertEqual(self.origin.fetches[missing], 1)
+
+        # The origin comes back; the proxy notices once the failure expires
+        self.origin.images[missing] = jpeg(100, 100)
+        with self.assertRaises(ImageProxyError):
+            self.proxy.thumbnail(missing, 'thumb')
+        self.clock.now += 61
+        self.proxy.thumbnail(missing, 'thumb')
+        self.assertEqual(self.origin.fetches[missing], 2)
+
+    def test_not_an_image(self):
+        """Testing that what isn't an image is never cached"""
+        with self.assertRaises(ImageProxyError):
+            self.proxy.thumbnail(PAGE, 'thumb')
+        self.assertEqual(self.proxy.cache.total_bytes, 0)
+
+    def test_check_url(self):
+        """Testing that only public http(s) URLs are fetched"""
+        for url in ["file:///etc/passwd", "http://127.0.0.1/a.png",
+                    "http://localhost:5432/", "http://169.254.169.254/latest"]:
+            with self.assertRaises(ImageProxyError):
+                check_url(url)
+
+        # The address is checked again as the connection is made, and
+        # that is the address connected to
+        with self.assertRaises(ImageProxyError):
+            _PublicHTTPConnection("127.0.0.1", 80, timeout=1).connect()
+
+    def test_route(self):
+        """Testing the proxy route's caching headers and errors"""
+        proxy = warbler.image_proxy
+        warbler.image_proxy = self.proxy
+        try:
+            with app.test_request_context():
+                url = warbler.image_url(ORIGIN, 'thumb')
+
+            with app.test_client() as c:
+                resp = c.get(url)
+                self.assertEqual(resp.status_code, 200)
+                self.assertEqual(resp.mimetype, 'image/jpeg')
+                self.assertIn('immutable', resp.headers['Cache-Control'])
+
+                resp = c.get(url, headers={'If-None-Match': resp.headers['ETag']})
+                self.assertEqual(resp.status_code, 304)
+
+                self.assertEqual(c.get(url.replace('/thumb?', '/huge?')).status_code, 404)
+                self.assertEqual(c.get("/images/thumb").status_code, 400)
+
+                # Only URLs the app signed
+                self.assertEqual(c.get("/images/thumb?url=" + ORIGIN).status_code, 403)
+                forged = url.replace('avatar.jpg', 'other.jpg')
+                self.assertEqual(c.get(forged).status_code, 403)
+                self.assertEqual(self.origin.fetches, {ORIGIN: 1})
+        finally:
+            warbler.image_proxy = proxy
@@ -5,23 +5,16 @@
 #    python -m unittest test_message_model.py
 
 
+# First, so that app loads the testing profile (see testing.py)
+import testing
+
 from app import app
-import os
 from unittest import TestCase
-from sqlalchemy import exc
-
-from models import db, User, Message, Follows, Likes
-
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
-
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
-
-
-# Now we can import app
+from datetime import datetime, timedelta
+from sqlalchemy import exc, event
 
+from models import db, User, Message, Follows, Likes, Repost
+from timeline import home_timeline
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -50,6 +43,9 @@ class MessageModelTestCase(TestCase):
         """Clean up any fouled transaction."""
 
         db.session.rollback()
+        # The next test recreates the tables and reuses ids, so don't let
+        # this test's objects linger in the session's identity map
+        db.session.remove()
 
     def test_message_model(self):
         """Does basic model work?"""
@@ -101,3 +97,209 @@ class MessageModelTestCase(TestCase):
         self.assertEqual(likes[0].message_id, message1.id)
         # We are checking that the message is not the one we set
         self.assertIsNot(likes[0].message_id, message2.id)
+
+    def test_message_timestamps(self):
+        """Each message gets its own timestamp from the database"""
+        message1 = Message(text="first", user_id=self.user.id)
+        db.session.add(message1)
+        db.session.commit()
+        message2 = Message(text="second", user_id=self.user.id)
+        db.session.add(message2)
+        db.session.commit()
+
+        self.assertIsNotNone(message1.timestamp)
+        self.assertLessEqual(message1.timestamp, message2.timestamp)
+
+        # Newest first, with ties broken by id
+        newest = Message.query.order_by(*Message.newest_first()).first()
+        self.assertEqual(newest.id, message2.id)
+
+    def test_message_cursor(self):
+        """Paging with cursors returns every message exactly once"""
+        Message.insert_many([{"text": f"warble {i}", "user_id": self.user.id}
+                             for i in range(5)])
+        db.session.commit()
+
+        seen = []
+        query = Message.query.order_by(*Message.newest_first())
+        page = query.limit(2).all()
+        while page:
+            seen.extend(msg.id for msg in page)
+            page = query.filter(Message.before(page[-1].cursor)).limit(2).all()
+
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(len(set(seen)), 5)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+    def test_newest_windows(self):
+        """Recent pages come from the first window; short ones widen it"""
+        now = datetime.utcnow()
+        Message.insert_many([
+            {"text": "today", "user_id": self.user.id, "timestamp": now},
+            {"text": "last year", "user_id": self.user.id,
+             "timestamp": now - timedelta(days=300)},
+            {"text": "ancient", "user_id": self.user.id,
+             "timestamp": now - timedelta(days=3000)},
+        ])
+        db.session.commit()
+
+        statements = []
+        record = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            recent = Message.newest(Message.query, 1)
+            everything = Message.newest(Message.query, 5)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertEqual([msg.text for msg in recent], ["today"])
+        self.assertEqual([msg.text for msg in everything],
+                         ["today", "last year", "ancient"])
+        # One query for the full page, three as the window widened
+        self.assertEqual(len(statements), 4)
+
+        older = Message.newest(Message.query, 5, before=recent[0].cursor)
+        self.assertEqual([msg.text for msg in older], ["last year", "ancient"])
+
+    def test_remove(self):
+        """Removing a message removes its likes, reposts and conversation"""
+        other = User.signup("other", "other@email.com", "password", None)
+        db.session.commit()
+        root = Message(text="root", user_id=self.user.id)
+        db.session.add(root)
+        db.session.commit()
+        reply = Message.add_reply(root, "reply", other.id)
+        db.session.commit()
+        nested = Message.add_reply(reply, "nested", self.user.id)
+        db.session.add_all([Likes(user_id=other.id, message_id=root.id),
+                            Likes(user_id=self.user.id, message_id=reply.id),
+                            Repost(user_id=other.id, message_id=root.id)])
+        db.session.commit()
+        nested_id = nested.id
+
+        Message.remove(reply)
+        db.session.commit()
+        self.assertEqual(Message.query.get(nested_id).parent_id, None)
+        self.assertEqual(Likes.query.count(), 1)
+
+        Message.remove(root)
+        db.session.commit()
+        self.assertEqual(Message.query.count(), 0)
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(Repost.query.count(), 0)
+
+    def test_replies(self):
+        """Replies point at their parent and root and bump reply counts"""
+        root = Message(text="root", user_id=self.user.id)
+        db.session.add(root)
+        db.session.commit()
+
+        reply = Message.add_reply(root, "first reply", self.user.id)
+        db.session.commit()
+        nested = Message.add_reply(reply, "nested reply", self.user.id)
+        db.session.commit()
+
+        self.assertEqual(reply.root_id, root.id)
+        self.assertEqual(nested.root_id, root.id)
+        self.assertEqual(nested.parent_id, reply.id)
+        self.assertEqual(nested.depth, 2)
+
+        db.session.refresh(root)
+        db.session.refresh(reply)
+        self.assertEqual(root.reply_count, 1)
+        self.assertEqual(reply.reply_count, 1)
+
+    def test_thread_pages(self):
+        """A thread pages through in order, down to the maximum depth"""
+        root = Message(text="root", user_id=self.user.id)
+        db.session.add(root)
+        db.session.commit()
+
+        parent = root
+        for i in range(5):
+            parent = Message.add_reply(parent, f"reply {i}", self.user.id)
+            db.session.commit()
+
+        replies, after = Message.replies_page(root, per_page=2, max_depth=3)
+        self.assertEqual([reply.text for reply in replies], ["reply 0", "reply 1"])
+
+        replies, after = Message.replies_page(root, after, per_page=2, max_depth=3)
+        self.assertEqual([reply.text for reply in replies], ["reply 2"])
+        self.assertIsNone(after)
+
+        # Deeper replies are read from the message they hang off
+        replies, after = Message.replies_page(replies[0])
+        self.assertEqual([reply.text for reply in replies], ["reply 3"])
+
+    def test_home_timeline_reposts(self):
+        """A message reposted by several followees shows up once, credited
+        to the latest reposter, from a fixed number of queries"""
+        author = User.signup("author", "author@email.com", "password", None)
+        first = User.signup("first", "first@email.com", "password", None)
+        second = User.signup("second", "second@email.com", "password", None)
+        db.session.commit()
+
+        popular = Message(text="popular", user_id=author.id)
+        own = Message(text="own", user_id=self.user.id)
+        db.session.add_all([popular, own])
+        db.session.commit()
+
+        Repost.toggle(first.id, popular.id)
+        db.session.commit()
+        Repost.toggle(second.id, popular.id)
+        db.session.commit()
+
+        user_id, followee_ids = self.user.id, [first.id, second.id]
+        db.session.expire_all()
+
+        statements = []
+        record = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            items = home_timeline(user_id, followee_ids)
+            [(item.message.user.username, item.message.text) for item in items]
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertEqual([item.message.text for item in items], ["popular", "own"])
+        self.assertEqual(items[0].reposted_by, "second")
+        self.assertEqual(items[0].reposts, 2)
+        self.assertIsNone(items[1].reposted_by)
+        # Originals (widening the time window twice, as the timeline is
+        # short of a page), reposts, messages with authors, reposters
+        self.assertEqual(len(statements), 6)
+
+        # Undoing both reposts takes the message off the timeline
+        self.assertFalse(Repost.toggle(first.id, popular.id))
+        self.assertFalse(Repost.toggle(second.id, popular.id))
+        db.session.commit()
+        items = home_timeline(user_id, followee_ids)
+        self.assertEqual([item.message.text for item in items], ["own"])
+
+    def test_home_timeline_buckets(self):
+        """Reading followees in parallel buckets gives the same timeline"""
+        users = [User.signup(f"f{n}", f"f{n}@email.com", "password", None)
+                 for n in range(5)]
+        db.session.commit()
+
+        for n, user in enumerate(users):
+            db.session.add(Message(text=f"by f{n}", user_id=user.id,
+                                   timestamp=datetime.utcnow() - timedelta(minutes=n)))
+        db.session.commit()
+        popular = Message.query.filter_by(text="by f4").one()
+        for user in users[:3]:
+            Repost.toggle(user.id, popular.id)
+            db.session.commit()
+
+        user_id, followee_ids = self.user.id, [user.id for user in users]
+        whole = home_timeline(user_id, followee_ids, limit=4)
+        bucketed = home_timeline(user_id, followee_ids, limit=4, bucket_size=2)
+
+        self.assertEqual([item.message.text for item in bucketed],
+                         ["by f4", "by f0", "by f1", "by f2"])
+        self.assertEqual([(item.message.id, item.reposts, item.reposted_by)
+                          for item in bucketed],
+                         [(item.message.id, item.reposts, item.reposted_by)
+                          for item in whole])
+        self.assertEqual(bucketed[0].reposts, 3)
+        self.assertEqual(bucketed[0].message.user.username, "f4")
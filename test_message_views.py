@@ -2,25 +2,18 @@
 
 # run these tests like:
 #
-#    FLASK_ENV=production python -m unittest test_message_views.py
+#    python -m unittest test_message_views.py
 
 
+# First, so that app loads the testing profile (see testing.py)
+import testing
+
 from app import app, CURR_USER_KEY
-import os
 from unittest import TestCase
 
-from models import db, connect_db, Message, User
-
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
-
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
-
-
-# Now we can import app
-
+from cache import cache
+from models import db, connect_db, Message, User, Repost, Notification
+from write_batching import GroupCommitter
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -39,8 +32,10 @@ class MessageViewTestCase(TestCase):
     def setUp(self):
         """Create test client, add sample data."""
 
+        Repost.query.delete()
         User.query.delete()
         Message.query.delete()
+        cache.clear()
 
         self.client = app.test_client()
 
@@ -73,6 +68,47 @@ class MessageViewTestCase(TestCase):
             msg = Message.query.one()
             self.assertEqual(msg.text, "Hello")
 
+    def test_add_message_group_commit(self):
+        """Can user add a message through the group-commit writer?"""
+
+        alice = User.signup("alice", "alice@test.com", "password", None)
+        db.session.commit()
+        alice_id = alice.id
+
+        app.config['MESSAGE_GROUP_COMMIT'] = True
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.testuser.id
+
+                resp = c.post("/messages/new", data={"text": "Batched @alice"})
+                self.assertEqual(resp.status_code, 302)
+        finally:
+            app.config['MESSAGE_GROUP_COMMIT'] = False
+
+        # The row is committed by the time the request returns
+        msg = Message.query.one()
+        self.assertEqual(msg.text, "Batched @alice")
+        self.assertEqual(msg.user_id, self.testuser.id)
+
+        # And the mention points at it
+        self.assertEqual(Notification.query.filter_by(user_id=alice_id).one().message_id,
+                         msg.id)
+
+    def test_group_commit_callback_fails(self):
+        """Testing that a failing after-commit callback doesn't stop the writer"""
+
+        def fail(rows):
+            raise RuntimeError("callback failed")
+
+        writer = GroupCommitter(app, Message.insert_many, on_commit=fail)
+        with self.assertLogs(app.logger, 'ERROR'):
+            first = writer.submit({'text': "one", 'user_id': self.testuser.id})
+            second = writer.submit({'text': "two", 'user_id': self.testuser.id})
+
+        self.assertEqual(Message.query.get(first).text, "one")
+        self.assertEqual(Message.query.get(second).text, "two")
+
     def test_add_message_no_session(self):
         """Testing that we don't add a message when there is no user in session"""
         with self.client as c:
@@ -115,6 +151,89 @@ class MessageViewTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertIn(message.text, str(resp.data))
 
+    def test_message_show_likes(self):
+        """Testing the like count on the message page, before and after a like"""
+
+        fan = User.signup(username="fan", email="fan@test.com",
+                          password="password", image_url=None)
+        message = Message(id=1234, text="a likable message",
+                          user_id=self.testuser.id)
+        db.session.add_all([fan, message])
+        db.session.commit()
+        fan_id = fan.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = fan_id
+
+            resp = c.get('/messages/1234')
+            self.assertIn('id="like-count">0<', str(resp.data))
+
+            # Liking invalidates the cached page
+            c.post('/users/add_like/1234')
+            resp = c.get('/messages/1234')
+            self.assertIn('id="like-count">1<', str(resp.data))
+            self.assertIn('btn-primary', str(resp.data))
+
+    def test_message_reply(self):
+        """Testing replying to a message and seeing the reply in the thread"""
+
+        message = Message(id=1234, text="a test message",
+                          user_id=self.testuser.id)
+        db.session.add(message)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.post("/messages/1234/reply", data={"text": "a reply"},
+                          follow_redirects=True)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("a reply", str(resp.data))
+            self.assertIn('id="reply-count">1<', str(resp.data))
+
+        reply = Message.query.filter_by(parent_id=1234).one()
+        self.assertEqual(reply.root_id, 1234)
+
+    def test_message_repost(self):
+        """Testing that a repost shows up once on a follower's home timeline"""
+
+        author = User.signup(username="author", email="author@test.com",
+                             password="password", image_url=None)
+        fan = User.signup(username="fan", email="fan@test.com",
+                          password="password", image_url=None)
+        db.session.commit()
+        db.session.add(Message(id=1234, text="worth sharing", user_id=author.id))
+        db.session.commit()
+        fan_id = fan.id
+        testuser_id = self.testuser.id
+        self.testuser.following.append(fan)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = fan_id
+
+            resp = c.post("/messages/1234/repost")
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(Repost.query.count(), 1)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = testuser_id
+
+            resp = c.get("/")
+            html = str(resp.data)
+            self.assertEqual(html.count("worth sharing"), 1)
+            self.assertIn("Reposted by @fan", html)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = fan_id
+
+            # Posting again undoes the repost
+            c.post("/messages/1234/repost")
+            self.assertEqual(Repost.query.count(), 0)
+
     def test_invalid_message_show(self):
         """Testing to get a 404 when we try to se a emssage that doesn't exist"""
         with self.client as c:
@@ -146,6 +265,22 @@ class MessageViewTestCase(TestCase):
             message = Message.query.get(1234)
             self.assertIsNone(message)
 
+    def test_thread_delete_drops_cached_replies(self):
+        """Testing that replies deleted with their thread aren't served from the cache"""
+
+        db.session.add(Message(id=1234, text="a test message", user_id=self.testuser.id))
+        db.session.add(Message(id=1235, text="a reply", user_id=self.testuser.id,
+                               parent_id=1234, root_id=1234, depth=1))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            self.assertEqual(c.get("/messages/1235").status_code, 200)
+            c.post("/messages/1234/delete")
+            self.assertEqual(c.get("/messages/1235").status_code, 404)
+
     def test_unauthorized_message_delete(self):
         """Testing when a user tries to delete a message that is not his"""
 
@@ -0,0 +1,219 @@
+"""Notification tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_notifications.py
+
+
+# First, so that app loads the testing profile (see testing.py)
+import testing
+
+import time
+from unittest import TestCase
+
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+
+from app import app, CURR_USER_KEY
+from cache import cache
+from models import db, User, Message, Notification, NotificationActor
+from notifications import Notifier, Event, coalesce, deliver, unread_count
+from write_batching import GroupCommitter
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class NotificationsTestCase(TestCase):
+    """Test recording, coalescing and showing notifications."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        cache.clear()
+
+        users = [User.signup(f"u{n}", f"u{n}@test.com", "password", None)
+                 for n in range(4)]
+        db.session.commit()
+        self.ids = [user.id for user in users]
+
+        message = Message(text="hello", user_id=self.ids[0])
+        db.session.add(message)
+        db.session.commit()
+        self.message_id = message.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        db.session.remove()
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_coalesce(self):
+        """Testing that a burst of events for one target becomes one count"""
+        events = [Event(1, 'like', actor_id, 7) for actor_id in (2, 3, 4, 2)]
+        events.append(Event(1, 'follow', 2, None))
+        self.assertEqual(coalesce(events), {(1, 'like', 7): [3, 4, 2],
+                                            (1, 'follow', None): [2]})
+
+    def test_likes_and_follows(self):
+        """Testing that likes coalesce while unread and reading clears them"""
+        with self.client as c:
+            for actor_id in self.ids[1:]:
+                self.login(c, actor_id)
+                c.post(f"/users/add_like/{self.message_id}")
+                c.post(f"/users/follow/{self.ids[0]}")
+
+            like = Notification.query.filter_by(kind='like').one()
+            self.assertEqual((like.actor_count, like.actor_id), (3, self.ids[3]))
+            self.assertEqual(Notification.query.filter_by(kind='follow').one().actor_count, 3)
+
+            self.login(c, self.ids[0])
+            html = c.get("/").get_data(as_text=True)
+            self.assertIn('id="notification-badge">2<', html)
+
+            html = c.get("/notifications").get_data(as_text=True)
+            self.assertIn("and 2 others", html)
+            self.assertIn("liked", html)
+            self.assertEqual(unread_count(self.ids[0]), 0)
+
+            # Unliking notifies nobody; liking again after the read does,
+            # in a new notification
+            self.login(c, self.ids[1])
+            c.post(f"/users/add_like/{self.message_id}")
+            self.assertEqual(Notification.query.filter_by(kind='like').count(), 1)
+            c.post(f"/users/add_like/{self.message_id}")
+            self.assertEqual(Notification.query.filter_by(kind='like').count(), 2)
+
+    def test_distinct_actors(self):
+        """Testing that liking, unliking and liking again counts once"""
+        with self.client as c:
+            self.login(c, self.ids[1])
+            for _ in range(3):
+                c.post(f"/users/add_like/{self.message_id}")
+            self.login(c, self.ids[2])
+            c.post(f"/users/add_like/{self.message_id}")
+
+        # In one batch, too
+        deliver([Event(self.ids[0], 'like', actor_id, self.message_id)
+                 for actor_id in (self.ids[3], self.ids[1], self.ids[3])])
+        db.session.commit()
+
+        like = Notification.query.filter_by(kind='like').one()
+        self.assertEqual((like.actor_count, like.actor_id), (3, self.ids[3]))
+
+        with self.client as c:
+            self.login(c, self.ids[0])
+            html = c.get("/notifications").get_data(as_text=True)
+            self.assertIn("and 2 others", html)
+        self.assertEqual(NotificationActor.query.count(), 0)
+
+    def test_mentions(self):
+        """Testing that @mentions notify the mentioned users, not the author"""
+        with self.client as c:
+            self.login(c, self.ids[0])
+            c.post("/messages/new", data={"text": "hi @U1 and @u2, and @u0"})
+
+        mentioned = {note.user_id: note.message_id for note in
+                     Notification.query.filter_by(kind='mention')}
+        message = Message.query.filter(Message.text.startswith("hi")).one()
+        self.assertEqual(mentioned, {self.ids[1]: message.id, self.ids[2]: message.id})
+
+    def test_unread_count_cached(self):
+        """Testing that the badge count comes from the cache after one query"""
+        self.assertEqual(unread_count(self.ids[0]), 0)
+
+        statements = []
+        record = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            self.assertEqual(unread_count(self.ids[0]), 0)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertEqual(statements, [])
+
+        # Not past its TTL, so other workers' changes show up
+        unread_count(self.ids[1], ttl=0)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            unread_count(self.ids[1], ttl=0)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertEqual(len(statements), 1)
+
+    def test_async_delivery(self):
+        """Testing that events posted together land in one coalesced write"""
+        unread_count(self.ids[0])
+        app.config['NOTIFICATIONS_ASYNC'] = True
+        try:
+            notifier = Notifier(app, max_wait=0.2)
+            for actor_id in self.ids[1:]:
+                notifier.notify(self.ids[0], 'like', actor_id, self.message_id)
+
+            deadline = time.monotonic() + 5
+            while unread_count(self.ids[0]) == 0 and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            app.config['NOTIFICATIONS_ASYNC'] = False
+
+        db.session.remove()
+        self.assertEqual(unread_count(self.ids[0]), 1)
+        self.assertEqual(Notification.query.one().actor_count, 3)
+
+    def test_one_unread_row(self):
+        """Testing that writers can't add a second unread row for one target"""
+        for actor_id in self.ids[1:3]:
+            deliver([Event(self.ids[0], 'like', actor_id, self.message_id)])
+            db.session.commit()
+        self.assertEqual(Notification.query.one().actor_count, 2)
+
+        db.session.add(Notification(user_id=self.ids[0], kind='like',
+                                    message_id=self.message_id, actor_id=self.ids[3]))
+        with self.assertRaises(IntegrityError):
+            db.session.commit()
+
+    def test_failed_batch_split(self):
+        """Testing that one bad row in a batch doesn't lose the others"""
+        written = []
+
+        def insert(rows):
+            if 'bad' in rows:
+                raise ValueError("bad row")
+            written.extend(rows)
+
+        writer = GroupCommitter(app, insert, max_wait=0.2, split_failed=True)
+        with self.assertLogs(app.logger, 'WARNING'):
+            for row in ['good', 'bad', 'better']:
+                writer.post(row)
+            deadline = time.monotonic() + 5
+            while len(written) < 2 and time.monotonic() < deadline:
+                time.sleep(0.05)
+
+        self.assertEqual(written, ['good', 'better'])
+
+    def test_mark_shown_read(self):
+        """Testing that only the notifications on the page are marked read"""
+        for kind, message_id in [('like', self.message_id), ('follow', None)]:
+            deliver([Event(self.ids[0], kind, self.ids[1], message_id)])
+            db.session.commit()
+
+        per_page = app.config['NOTIFICATIONS_PER_PAGE']
+        app.config['NOTIFICATIONS_PER_PAGE'] = 1
+        try:
+            with self.client as c:
+                self.login(c, self.ids[0])
+                c.get("/notifications")
+        finally:
+            app.config['NOTIFICATIONS_PER_PAGE'] = per_page
+
+        self.assertEqual(unread_count(self.ids[0]), 1)
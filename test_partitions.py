@@ -0,0 +1,44 @@
+"""Message partition tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_partitions.py
+
+from datetime import date, datetime
+from unittest import TestCase
+
+from partitions import (add_months, partition_name, create_partition_sql,
+                        parse_partition, expired, Partition)
+
+
+class PartitionsTestCase(TestCase):
+    """Test partition naming, bounds and retention."""
+
+    def test_months(self):
+        """Testing month arithmetic and partition DDL"""
+        self.assertEqual(add_months(date(2023, 11, 1), 3), date(2024, 2, 1))
+        self.assertEqual(add_months(date(2024, 1, 1), -1), date(2023, 12, 1))
+        self.assertEqual(partition_name(date(2024, 2, 1)), "messages_p2024_02")
+        self.assertEqual(
+            create_partition_sql(date(2024, 12, 1)),
+            "CREATE TABLE IF NOT EXISTS messages_p2024_12 PARTITION OF messages "
+            "FOR VALUES FROM ('2024-12-01') TO ('2025-01-01')")
+
+    def test_parse_and_expire(self):
+        """Testing that only partitions wholly before the cutoff expire"""
+        partitions = [
+            parse_partition("messages_p2024_02", "FOR VALUES FROM "
+                            "('2024-02-01 00:00:00') TO ('2024-03-01 00:00:00')"),
+            parse_partition("messages_history", "FOR VALUES FROM "
+                            "(MINVALUE) TO ('2024-01-01 00:00:00')"),
+            parse_partition("messages_p2024_01", "FOR VALUES FROM "
+                            "('2024-01-01 00:00:00') TO ('2024-02-01 00:00:00')"),
+            parse_partition("messages_default", "DEFAULT"),
+        ]
+        self.assertEqual(partitions[1],
+                         Partition("messages_history", None, datetime(2024, 1, 1)))
+        self.assertEqual(partitions[3], Partition("messages_default", None, None))
+
+        # Never the history partition
+        names = [partition.name for partition in expired(partitions, datetime(2024, 3, 1))]
+        self.assertEqual(names, ["messages_p2024_01", "messages_p2024_02"])
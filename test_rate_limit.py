@@ -0,0 +1,75 @@
+"""Rate limiting tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_rate_limit.py
+
+# First, so that app loads the testing profile (see testing.py)
+from testing import Clock
+
+from unittest import TestCase, mock
+
+from app import app
+import app as warbler
+from rate_limit import Quota, MemoryBackend, RateLimiter
+
+
+class RateLimitTestCase(TestCase):
+    """Test token buckets and the request hook."""
+
+    def setUp(self):
+        self.clock = Clock()
+        self.backend = MemoryBackend(max_keys=2, clock=self.clock)
+
+    def test_quota_parse(self):
+        """Testing quota strings"""
+        self.assertEqual(Quota.parse("30/minute"), Quota(0.5, 30))
+        with self.assertRaises(KeyError):
+            Quota.parse("30/fortnight")
+
+    def test_bucket(self):
+        """Testing that a bucket allows a burst, then refills over time"""
+        limiter = RateLimiter(self.backend, {'login': "2/minute"})
+
+        self.assertEqual(limiter.check('login', "ip:1"), 0)
+        self.assertEqual(limiter.check('login', "ip:1"), 0)
+        self.assertEqual(limiter.check('login', "ip:1"), 30)
+
+        # Other clients and unlimited endpoints are unaffected
+        self.assertEqual(limiter.check('login', "ip:2"), 0)
+        self.assertEqual(limiter.check('homepage', "ip:1"), 0)
+
+        self.clock.now += 30
+        self.assertEqual(limiter.check('login', "ip:1"), 0)
+        self.assertEqual(limiter.check('login', "ip:1"), 30)
+
+    def test_eviction(self):
+        """Testing that the store forgets the least recently used buckets"""
+        for key in ("a", "b", "c"):
+            self.backend.take(key, 1, 1)
+
+        # "a" was forgotten, so it starts over with a full bucket
+        self.assertEqual(self.backend.take("a", 1, 1), 0)
+        self.assertEqual(self.backend.take("c", 1, 1), 1)
+
+    def test_login_limited(self):
+        """Testing that an over-quota login is rejected before any bcrypt work"""
+        limiter = warbler.rate_limiter
+        warbler.rate_limiter = RateLimiter(MemoryBackend(), {'login': "1/minute"})
+        enabled = app.config['RATE_LIMIT_ENABLED']
+        app.config['RATE_LIMIT_ENABLED'] = True
+        try:
+            with app.test_client() as c:
+                c.post("/login", data={"username": "nobody", "password": "wrong"})
+
+                with mock.patch.object(warbler.User, 'authenticate') as authenticate:
+                    resp = c.post("/login", data={"username": "nobody", "password": "wrong"})
+                    self.assertEqual(resp.status_code, 429)
+                    self.assertEqual(resp.headers['Retry-After'], "60")
+                    authenticate.assert_not_called()
+
+                # Only POSTs count
+                self.assertEqual(c.get("/login").status_code, 200)
+        finally:
+            warbler.rate_limiter = limiter
+            app.config['RATE_LIMIT_ENABLED'] = enabled
@@ -0,0 +1,74 @@
+"""Recommendation tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_recommendations.py
+
+# First, so that app loads the testing profile (see testing.py)
+import testing
+
+from unittest import TestCase
+
+from app import app
+from follow_graph import FollowGraph
+from models import db, User
+from recommendations import FollowRecommender, SuggestionStore
+
+
+class FollowRecommenderTestCase(TestCase):
+    """Test "who to follow" suggestions."""
+
+    def setUp(self):
+        """Build a small follow graph in memory."""
+
+        self.graph = FollowGraph()
+        self.recommender = FollowRecommender(self.graph)
+        # (follower, followed): 1 follows 2 and 3, who both follow 4;
+        # 5 follows 1 and also follows 6
+        self.graph.load([(1, 2), (1, 3), (2, 4), (3, 4), (3, 5),
+                         (5, 1), (5, 6)])
+
+    def test_friends_of_friends(self):
+        """Users followed by several of your followees rank first"""
+        self.assertEqual(self.recommender.suggest(1, 1), [4])
+
+    def test_shared_followers(self):
+        """Users followed by your followers are suggested too"""
+        self.assertIn(6, self.recommender.suggest(1, 5))
+
+    def test_excludes_self_and_followed(self):
+        """Never suggest yourself or someone you already follow"""
+        suggestions = self.recommender.suggest(1, 10)
+        self.assertNotIn(1, suggestions)
+        self.assertNotIn(2, suggestions)
+        self.assertNotIn(3, suggestions)
+
+    def test_incremental_updates(self):
+        """Follow and unfollow events refresh the suggestions"""
+        self.graph.add_follow(1, 4)
+        self.assertNotIn(4, self.recommender.suggest(1, 10))
+
+        self.graph.remove_follow(1, 4)
+        self.graph.remove_user(6)
+        self.assertEqual(self.recommender.suggest(1, 10), [4, 5])
+
+    def test_stored_suggestions(self):
+        """Batch results are stored for other processes, which drop users
+        followed since"""
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            for n in range(1, 7):
+                User.signup(f"u{n}", f"u{n}@test.com", "password", None)
+            db.session.commit()
+
+            pairs = [(1, 2), (1, 3), (2, 4), (3, 4), (3, 5), (5, 1), (5, 6)]
+            batch = FollowRecommender(FollowGraph(loader=lambda: pairs), store=SuggestionStore())
+            self.assertEqual(batch.recompute_all(5), 6)
+
+            # A worker whose graph already has 1 following 4
+            graph = FollowGraph()
+            graph.load([(1, 2), (1, 3), (1, 4)])
+            worker = FollowRecommender(graph, store=SuggestionStore())
+            self.assertEqual(worker.suggest(1, 5), [5, 6])
+            db.session.remove()
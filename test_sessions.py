@@ -0,0 +1,157 @@
+"""Server-side session tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_sessions.py
+
+
+# First, so that app loads the testing profile (see testing.py)
+from testing import Clock
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from app import app, CURR_USER_KEY
+from models import db, User
+from sessions import (MemoryBackend, FileBackend, ServerSessionInterface,
+                      dumps, loads, new_sid)
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+class CountingBackend(MemoryBackend):
+    """A memory backend that counts reads and writes."""
+
+    def __init__(self):
+        super().__init__()
+        self.gets = self.sets = 0
+
+    def get(self, sid):
+        self.gets += 1
+        return super().get(sid)
+
+    def set(self, sid, blob, user_id, ttl):
+        self.sets += 1
+        super().set(sid, blob, user_id, ttl)
+
+
+class SessionsTestCase(TestCase):
+    """Test lazy loading, write-back, rotation and revocation."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        User.signup("u1", "u1@test.com", "password", None)
+        db.session.commit()
+
+        self.backend = CountingBackend()
+        self.saved = app.session_interface
+        app.session_interface = ServerSessionInterface(self.backend, CURR_USER_KEY)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.session_interface = self.saved
+        db.session.rollback()
+        db.session.remove()
+
+    def sid(self):
+        cookie = next((cookie for cookie in self.client.cookie_jar
+                       if cookie.name == app.session_cookie_name), None)
+        return cookie and cookie.value
+
+    def test_payloads(self):
+        """Testing that payloads round-trip, tuples included, and big ones shrink"""
+        data = {CURR_USER_KEY: 3, '_flashes': [('danger', 'Nope')]}
+        self.assertEqual(loads(dumps(data)), data)
+        self.assertEqual(dumps(data)[:1], b'j')
+
+        big = {'_flashes': [('info', 'x' * 1000)]}
+        self.assertEqual(dumps(big)[:1], b'z')
+        self.assertLess(len(dumps(big)), 200)
+        self.assertEqual(loads(dumps(big)), big)
+
+    def test_login_rotate_revoke(self):
+        """Testing that only changes are written, logins get a new id, and
+        revoking ends the session"""
+        with self.client as c:
+            c.get("/login")
+            self.assertIsNone(self.sid())
+            self.assertEqual((self.backend.gets, self.backend.sets), (0, 0))
+
+            # A flash kept for the next page gets a session id...
+            c.get("/users/1/following")
+            anonymous = self.sid()
+            self.assertEqual(len(anonymous), 22)
+
+            # ...which logging in replaces
+            self.assertIn("Access unauthorized", c.get("/login").get_data(as_text=True))
+            c.post("/login", data={"username": "u1", "password": "password"})
+            logged_in = self.sid()
+            self.assertNotEqual(logged_in, anonymous)
+            self.assertIsNone(self.backend.get(anonymous))
+
+            # Reading the session doesn't write it back
+            c.get("/")
+            sets = self.backend.sets
+            c.get("/users")
+            self.assertEqual(self.backend.sets, sets)
+            self.assertIn("Log out", c.get("/users").get_data(as_text=True))
+
+            app.session_interface.revoke_user(User.query.one().id)
+            self.assertIn("Log in", c.get("/users").get_data(as_text=True))
+
+    def test_unknown_id(self):
+        """Testing that a made-up session id is never adopted"""
+        with self.client as c:
+            c.set_cookie('localhost', app.session_cookie_name, "chosen-by-attacker")
+            c.post("/login", data={"username": "u1", "password": "password"})
+            self.assertNotEqual(self.sid(), "chosen-by-attacker")
+            self.assertIsNone(self.backend.get("chosen-by-attacker"))
+
+
+class FileBackendTestCase(TestCase):
+    """Test the file session store."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.clock = Clock(1000.0)
+        self.backend = FileBackend(self.directory, clock=self.clock)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_file_backend(self):
+        """Testing storage, expiry, per-user revocation and sweeping"""
+        a, b, c = new_sid(), new_sid(), new_sid()
+        self.backend.set(a, b"ja", 1, ttl=60)
+        self.backend.set(b, b"jb", 1, ttl=60)
+        self.backend.set(c, b"jc", 2, ttl=10)
+        self.assertEqual(self.backend.get(a), b"ja")
+
+        self.backend.delete_user(1)
+        self.assertIsNone(self.backend.get(a))
+        self.assertIsNone(self.backend.get(b))
+        self.assertEqual(self.backend.get(c), b"jc")
+
+        self.clock.now += 11
+        self.assertEqual(self.backend.sweep(), 1)
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'users', '2')), [])
+
+    def test_not_session_ids(self):
+        """Testing that only names new_sid could have made are looked up"""
+        for sid in ["users", "sessions", "../etc/passwd", "a" * 21, "a" * 23, "", None]:
+            self.assertIsNone(self.backend.get(sid))
+            self.backend.delete(sid)
+            with self.assertRaises(ValueError):
+                self.backend.set(sid, b"j", None, ttl=60)
+
+        # Nor does a session file that can't be read break anything
+        sid = new_sid()
+        os.makedirs(os.path.join(self.directory, 'sessions', sid))
+        self.assertIsNone(self.backend.get(sid))
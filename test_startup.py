@@ -0,0 +1,48 @@
+"""Startup warm-up tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_startup.py
+
+import os
+import tempfile
+from unittest import TestCase
+
+from flask import Flask
+
+from startup import StartupTimer, enable_bytecode_cache, compile_templates
+from testing import Clock
+
+
+class StartupTestCase(TestCase):
+    """Test startup timing and template precompilation."""
+
+    def test_timer(self):
+        """Testing that each lap records the time since the previous one"""
+        clock = Clock()
+        timer = StartupTimer(started=0.0, clock=clock)
+
+        clock.now = 0.25
+        timer.lap('import')
+        clock.now = 0.5
+        timer.lap('templates')
+
+        self.assertEqual(timer.phases, [('import', 0.25), ('templates', 0.25)])
+        self.assertEqual(timer.total, 0.5)
+        self.assertIn("total", timer.report())
+
+    def test_compile_templates(self):
+        """Testing that warm-up compiles every template into the shared cache"""
+        with tempfile.TemporaryDirectory() as directory:
+            app = Flask(__name__)
+            enable_bytecode_cache(app, directory)
+
+            count = compile_templates(app)
+            self.assertEqual(count, len(app.jinja_env.list_templates(extensions=['html'])))
+            self.assertEqual(len(os.listdir(directory)), count)
+
+            # Another worker loads the compiled templates from the cache
+            other = Flask(__name__)
+            enable_bytecode_cache(other, directory)
+            compile_templates(other)
+            self.assertEqual(len(os.listdir(directory)), count)
@@ -0,0 +1,101 @@
+"""Trending tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_trending.py
+
+import os
+import tempfile
+from unittest import TestCase
+
+from trending import extract_tags, DecayingTopK, Trends
+from testing import Clock
+
+
+class TrendingTestCase(TestCase):
+    """Test hashtag extraction and decayed top-K counting."""
+
+    def setUp(self):
+        self.clock = Clock(1000.0)
+
+    def test_extract_tags(self):
+        """Hashtags and mentions are found and lowercased"""
+        hashtags, mentions = extract_tags("Go #Warbler! cc @Alice, mail a@b.com")
+        self.assertEqual(hashtags, ["warbler"])
+        self.assertEqual(mentions, ["alice"])
+
+    def test_top_tags(self):
+        """The most used tags rank first"""
+        trends = Trends(windows={'hour': 3600}, clock=self.clock)
+        for text in ["#a #b", "#a", "#a #c", "#b"]:
+            trends.record_message(text)
+
+        top = trends.top_tags('hour', 2)
+        self.assertEqual([tag for tag, count in top], ["a", "b"])
+        self.assertAlmostEqual(top[0][1], 3)
+
+    def test_decay(self):
+        """Older counts fade: a half-life later they count half"""
+        tracker = DecayingTopK(half_life=60, clock=self.clock)
+        for i in range(4):
+            tracker.add("old")
+
+        self.clock.now += 60
+        tracker.add("new")
+        tracker.add("new")
+        tracker.add("new")
+
+        self.assertEqual(tracker.top(2)[0][0], "new")
+        self.assertAlmostEqual(dict(tracker.top(2))["old"], 2)
+
+        # Far in the future, past a rescale of the landmark
+        self.clock.now += 60 * 100
+        tracker.add("newest")
+        self.assertEqual(tracker.top(1)[0][0], "newest")
+
+    def test_bounded_candidates(self):
+        """Only `capacity` candidates are kept, the heaviest ones"""
+        tracker = DecayingTopK(half_life=60, capacity=2, clock=self.clock)
+        for key, times in [("x", 5), ("y", 1), ("z", 3)]:
+            for i in range(times):
+                tracker.add(key)
+
+        self.assertEqual([key for key, count in tracker.top(5)], ["x", "z"])
+
+    def test_top_messages(self):
+        """Likes rank messages and unlikes take them back"""
+        trends = Trends(windows={'hour': 3600}, clock=self.clock)
+        trends.record_like(1)
+        trends.record_like(2)
+        trends.record_like(2)
+        trends.record_like(1, liked=False)
+
+        self.assertEqual(trends.top_messages(), [2])
+
+    def test_shared(self):
+        """Workers sharing a directory see each other's counts"""
+        with tempfile.TemporaryDirectory() as directory:
+            workers = [Trends(windows={'hour': 3600}, clock=self.clock) for i in range(2)]
+            for n, worker in enumerate(workers):
+                worker.worker = f"worker{n}"
+                worker.share(directory, interval=30)
+
+            workers[0].record_message("#a #b")
+            workers[1].record_message("#a")
+            workers[1].record_like(7)
+            # Each has synced once, before its first count
+            self.assertEqual(dict(workers[0].top_tags('hour')), {"a": 1, "b": 1})
+
+            self.clock.now += 30
+            workers[0].top_messages()
+            top = dict(workers[1].top_tags('hour'))
+            self.assertAlmostEqual(top["a"], 2 * 0.5 ** (30 / 3600))
+            self.assertAlmostEqual(top["b"], 0.5 ** (30 / 3600))
+
+            self.clock.now += 30
+            self.assertEqual(workers[0].top_messages(), [7])
+
+            # A worker long gone stops counting
+            self.clock.now += 3600 * 10 + 1
+            workers[1].top_messages()
+            self.assertEqual(os.listdir(directory), ["worker1.npz"])
@@ -4,22 +4,15 @@
 #
 #    python -m unittest test_user_model.py
 
+# First, so that app loads the testing profile (see testing.py)
+import testing
+
 from app import app
-import os
 from unittest import TestCase
-from sqlalchemy import exc
-
-from models import db, User, Message, Follows, Likes
-
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
-
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+from sqlalchemy import exc, event
 
-
-# Now we can import app
+from availability import availability, BloomFilter
+from models import db, User, Message, Follows, Likes, follow_graph
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -57,6 +50,9 @@ class UserModelTestCase(TestCase):
         """Clean up any fouled transaction."""
 
         db.session.rollback()
+        # The next test recreates the tables and reuses ids, so don't let
+        # this test's objects linger in the session's identity map
+        db.session.remove()
 
     def test_user_model(self):
         """Does basic model work?"""
@@ -158,3 +154,112 @@ class UserModelTestCase(TestCase):
         self.assertFalse(bad_user)
         bad_password = User.authenticate(self.u1.username, "wrong")
         self.assertFalse(bad_password)
+
+    def test_following_page(self):
+        """Testing the paginated projection of followed users"""
+        u3 = User.signup(
+            "test_user3", "test_email3@email.com", "test_password", None)
+        db.session.commit()
+        self.u1.following.append(self.u2)
+        self.u1.following.append(u3)
+        self.u2.following.append(u3)
+        db.session.commit()
+
+        # Seen by user 2, one card per page
+        rows, after = User.following_page(self.u1.id, self.u2.id, per_page=1)
+        self.assertEqual([row.username for row in rows], ["test_user2"])
+        self.assertFalse(rows[0].is_followed)
+        self.assertEqual(after, self.u2.id)
+
+        rows, after = User.following_page(
+            self.u1.id, self.u2.id, after=after, per_page=1)
+        self.assertEqual([row.username for row in rows], ["test_user3"])
+        self.assertTrue(rows[0].is_followed)
+        self.assertIsNone(after)
+
+        rows, after = User.followers_page(u3.id, self.u1.id)
+        self.assertEqual(len(rows), 2)
+        self.assertIsNone(after)
+
+    def test_follow_graph_sync(self):
+        """Testing that committed follow changes reach the in-memory graph"""
+        u1_id, u2_id = self.u1.id, self.u2.id
+        follow_graph.ensure_loaded()
+        self.assertFalse(follow_graph.is_following(u1_id, u2_id))
+
+        self.u1.following.append(self.u2)
+        db.session.commit()
+        self.assertTrue(follow_graph.is_following(u1_id, u2_id))
+        self.assertEqual(follow_graph.follower_count(u2_id), 1)
+
+        self.u1.following.remove(self.u2)
+        db.session.commit()
+        self.assertFalse(follow_graph.is_following(u1_id, u2_id))
+
+        db.session.add(Follows(user_being_followed_id=u1_id,
+                               user_following_id=u2_id))
+        db.session.commit()
+        self.assertTrue(follow_graph.is_following(u2_id, u1_id))
+
+        # Rolled back follows never reach the graph
+        self.u1.followers.remove(self.u2)
+        db.session.flush()
+        db.session.rollback()
+        self.assertTrue(follow_graph.is_following(u2_id, u1_id))
+
+    def test_follows_from_other_processes(self):
+        """Testing that follow buttons and counts don't wait for the graph
+        to reload"""
+        follow_graph.ensure_loaded()
+        self.assertFalse(self.u1.is_following(self.u2))
+
+        # As another worker would: the row, but not this process's graph
+        db.session.execute(Follows.__table__.insert().values(
+            user_being_followed_id=self.u2.id, user_following_id=self.u1.id))
+        db.session.commit()
+
+        self.assertFalse(follow_graph.is_following(self.u1.id, self.u2.id))
+        self.assertTrue(self.u1.is_following(self.u2))
+        self.assertTrue(self.u2.is_followed_by(self.u1))
+        self.assertEqual(self.u1.following_count(), 1)
+        self.assertEqual(self.u2.follower_count(), 1)
+
+    def test_bloom_filter(self):
+        """Testing that a Bloom filter has no false negatives, and few false
+        positives"""
+        bloom = BloomFilter(1000)
+        for n in range(1000):
+            bloom.add(f"user{n}")
+
+        self.assertTrue(all(f"user{n}" in bloom for n in range(1000)))
+        false_positives = sum(f"other{n}" in bloom for n in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_availability(self):
+        """Testing that taken names are found in any case, and free ones
+        without a query"""
+        availability.clear()
+        self.assertTrue(availability.is_taken('username', "TEST_User1"))
+        self.assertTrue(availability.is_taken('email', "Test_Email2@email.com"))
+        self.assertFalse(availability.is_taken('username', "test_user1", self.u1.id))
+
+        # New users are added as they are inserted
+        User.signup("newcomer", "new@email.com", "password", None)
+        db.session.commit()
+
+        statements = []
+        record = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            self.assertFalse(availability.is_taken('username', "nobody"))
+            free = len(statements)
+            self.assertTrue(availability.is_taken('username', "Newcomer"))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertEqual(free, 0)
+
+    def test_case_insensitive_unique(self):
+        """Testing that the database rejects a username differing only in case"""
+        User.signup("TEST_USER1", "other@email.com", "password", None)
+        with self.assertRaises(exc.IntegrityError):
+            db.session.commit()
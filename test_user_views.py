@@ -2,25 +2,23 @@
 
 # run these tests like:
 #
-#    FLASK_ENV=production python -m unittest test_user_views.py
+#    python -m unittest test_user_views.py
 
 
-from app import app, CURR_USER_KEY
-import os
-from unittest import TestCase
-
-from models import db, connect_db, Message, User, Likes, Follows
-
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
-
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# First, so that app loads the testing profile (see testing.py)
+import testing
 
+from app import app, CURR_USER_KEY
+import warnings
+from datetime import datetime
+from unittest import TestCase, mock
 
-# Now we can import app
+from sqlalchemy import event
+from sqlalchemy.exc import SAWarning
 
+from cache import cache
+from models import (db, connect_db, Message, User, Likes, Follows, AccountDeletion,
+                    follow_graph)
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -32,6 +30,10 @@ db.create_all()
 
 app.config['WTF_CSRF_ENABLED'] = False
 
+# Purge deleted accounts in small batches, so tests see several
+
+app.config['ACCOUNT_PURGE_BATCH_SIZE'] = 2
+
 
 class UserViewTestCase(TestCase):
     """Test views for messages."""
@@ -41,6 +43,7 @@ class UserViewTestCase(TestCase):
 
         db.drop_all()
         db.create_all()
+        cache.clear()
 
         self.client = app.test_client()
 
@@ -61,6 +64,9 @@ class UserViewTestCase(TestCase):
     def tearDown(self):
 
         db.session.rollback()
+        # The next test recreates the tables and reuses ids, so don't let
+        # this test's objects linger in the session's identity map
+        db.session.remove()
 
     def test_users_index(self):
         """Testing for the users we created to show"""
@@ -215,6 +221,33 @@ class UserViewTestCase(TestCase):
             self.assertNotIn("@hij", str(resp.data))
             self.assertNotIn("@testing", str(resp.data))
 
+    def test_follow_stale_graph(self):
+        """Testing that following and unfollowing again, as a stale follow
+        graph invites, is harmless"""
+        follower_id, followed_id = self.testuser.id, self.u1.id
+        self.assertFalse(follow_graph.is_following(follower_id, followed_id))
+
+        # Another process follows: this process's graph doesn't hear of it
+        db.session.execute(Follows.__table__.insert(),
+                           {'user_following_id': follower_id,
+                            'user_being_followed_id': followed_id})
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = follower_id
+
+            resp = c.post(f"/users/follow/{followed_id}")
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(Follows.query.count(), 1)
+            self.assertTrue(follow_graph.is_following(follower_id, followed_id))
+
+            for _ in range(2):
+                resp = c.post(f"/users/stop-following/{followed_id}")
+                self.assertEqual(resp.status_code, 302)
+            self.assertEqual(Follows.query.count(), 0)
+            self.assertFalse(follow_graph.is_following(follower_id, followed_id))
+
     def test_unauthorized_following_page_access(self):
         """Testing if the following list is displayed when unauthorized"""
         self.setup_followers()
@@ -236,3 +269,138 @@ class UserViewTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertNotIn("@abc", str(resp.data))
             self.assertIn("Access unauthorized", str(resp.data))
+
+    def test_delete_user(self):
+        """Testing that deleting a user purges all of their rows"""
+        self.setup_followers()
+        self.setup_likes()
+        user_id = self.testuser.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            resp = c.post("/users/delete")
+            self.assertEqual(resp.status_code, 302)
+
+        self.assertIsNone(User.query.get(user_id))
+        self.assertEqual(Message.query.filter_by(user_id=user_id).count(), 0)
+        self.assertEqual(Likes.query.filter_by(user_id=user_id).count(), 0)
+        self.assertEqual(Follows.query.count(), 0)
+        # The other users' messages are untouched
+        self.assertEqual(Message.query.count(), 1)
+
+        progress = AccountDeletion.query.get(user_id)
+        self.assertIsNotNone(progress.finished_at)
+        # 2 messages, 1 like, 3 follows and the user itself
+        self.assertEqual(progress.rows_deleted, 7)
+
+    def test_delete_user_replies(self):
+        """Testing that purging a user's replies fixes up the rest of the thread"""
+        user_id = self.testuser.id
+        root = Message(text="root", user_id=self.u1.id)
+        db.session.add(root)
+        db.session.flush()
+        reply = Message.add_reply(root, "reply", user_id)
+        db.session.flush()
+        answer = Message.add_reply(reply, "answer", self.u2.id)
+        db.session.commit()
+        root_id, answer_id = root.id, answer.id
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', SAWarning)
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = user_id
+
+                resp = c.post("/users/delete")
+                self.assertEqual(resp.status_code, 302)
+
+        db.session.expire_all()
+        self.assertEqual(Message.query.get(root_id).reply_count, 0)
+        answer = Message.query.get(answer_id)
+        self.assertIsNone(answer.parent_id)
+        self.assertEqual(answer.root_id, root_id)
+
+    def test_soft_deleted_user_hidden(self):
+        """Testing that a soft-deleted user disappears before being purged"""
+        self.testuser.deleted_at = datetime.utcnow()
+        db.session.commit()
+
+        with self.client as c:
+            resp = c.get("/users")
+            self.assertNotIn("@testuser", str(resp.data))
+            self.assertIn("@abc", str(resp.data))
+
+            resp = c.get(f"/users/{self.testuser.id}")
+            self.assertEqual(resp.status_code, 404)
+
+        self.assertFalse(User.authenticate("testuser", "testuser"))
+
+    def test_edit_profile(self):
+        """Testing that a profile edit checks the loaded hash and updates
+        only the changed columns"""
+        user_id = self.testuser.id
+        message = Message(text="cached", user_id=user_id)
+        db.session.add(message)
+        db.session.commit()
+        cache.set(f"message:{message.id}", "stale", tags=[f"user:{user_id}"])
+
+        # As pre-filled by the edit page, with a new bio
+        form = {"username": "testuser", "email": "test@test.com",
+                "image_url": self.testuser.image_url,
+                "header_image_url": self.testuser.header_image_url,
+                "bio": "new bio", "password": "testuser"}
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            resp = c.post("/users/profile", data=dict(form, password="wrong!"))
+            self.assertIn("Invalid credentials", str(resp.data))
+
+            statements = []
+            record = lambda *args: statements.append(args[2])
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                resp = c.post("/users/profile", data=form)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+            self.assertEqual(resp.status_code, 302)
+
+            # Loading g.user, then one UPDATE of the one changed column
+            self.assertEqual(len(statements), 2)
+            self.assertTrue(statements[1].startswith("UPDATE users SET bio="))
+
+            self.assertEqual(User.query.get(user_id).bio, "new bio")
+            self.assertIsNone(cache.get(f"message:{message.id}"))
+
+            resp = c.post("/users/profile", data=dict(form, username="abc"))
+            self.assertIn("already taken", str(resp.data))
+
+    def test_signup_taken(self):
+        """Testing that a taken username is refused before hashing the password"""
+        with mock.patch('models.bcrypt.generate_password_hash') as hash_password:
+            with self.client as c:
+                resp = c.post("/signup", data={"username": "TestUser",
+                                               "email": "new@test.com",
+                                               "password": "password"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Username already taken", str(resp.data))
+        hash_password.assert_not_called()
+        self.assertEqual(User.query.count(), 5)
+
+    def test_availability_endpoint(self):
+        """Testing the live availability check"""
+        u1_id = self.u1.id
+        with self.client as c:
+            self.assertEqual(c.get("/users/available?username=ABC").json,
+                             {"field": "username", "value": "ABC", "available": False})
+            self.assertEqual(c.get("/users/available").status_code, 400)
+            # Emails aren't answered for
+            self.assertEqual(c.get("/users/available?email=test1@test.com").status_code, 400)
+
+            # Your own username counts as available to you
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = u1_id
+            self.assertTrue(c.get("/users/available?username=abc").json["available"])
@@ -0,0 +1,24 @@
+"""Helpers shared by the test modules.
+
+Importing this module selects the testing configuration profile (see
+config.py). It must be imported before app, which loads the profile at
+import time. The testing profile uses the warbler-test database unless
+DATABASE_URL says otherwise:
+
+    python -m unittest test_user_views.py
+    DATABASE_URL=sqlite:////tmp/warbler-test.db python -m unittest test_user_views.py
+"""
+
+import os
+
+os.environ['WARBLER_ENV'] = 'testing'
+
+
+class Clock:
+    """Fake clock the tests can move forward."""
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
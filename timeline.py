@@ -0,0 +1,193 @@
+"""Home timeline for Warbler.
+
+A home timeline mixes two streams: messages written by the people you
+follow (and by you), and messages they reposted. A message shows up once
+however many of them reposted it, at its most recent appearance, credited
+to the latest reposter.
+
+The timeline is built in a fixed number of queries however long it is:
+the two streams are read as bare (message id, timestamp) keys, merged and
+cut to a page in Python, and only then are the messages on the page, their
+authors and their reposters fetched, each in one batched query.
+
+Following a great many people makes for a huge `IN (...)` list, which the
+database plans and runs poorly. Past `bucket_size` users, the key reads
+are split into buckets of that many users each, which run concurrently
+on a `BucketPool` and whose results, each newest first, are merged; the
+merge stops as soon as it has a page.
+"""
+
+import heapq
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
+
+from sqlalchemy.orm import Session
+
+from models import db, User, Message, Repost
+
+# `reposted_by` is the latest reposter's username (None for an original
+# message), `reposts` how many of the people you follow reposted it.
+TimelineItem = namedtuple('TimelineItem', 'message timestamp reposted_by reposts')
+
+
+class BucketPool:
+    """Runs a timeline's bucketed reads on a bounded thread pool."""
+
+    def __init__(self, max_workers=8):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='timeline')
+            return self._executor
+
+    @staticmethod
+    def _run(engine, fn, arg):
+        session = Session(bind=engine)
+        try:
+            return fn(session, arg)
+        finally:
+            # Leaves the loaded objects usable, detached
+            session.close()
+
+    def gather(self, fn, args):
+        """[fn(session, arg) for arg in `args`], run at once, each with its
+        own connection.
+
+        A lone arg runs in the calling thread on `db.session`. Otherwise
+        objects `fn` returns are detached, so it should eager-load what the
+        caller needs.
+        """
+
+        args = list(args)
+        if len(args) == 1:
+            return [fn(db.session, args[0])]
+
+        pool = self._pool()
+        futures = [pool.submit(self._run, db.engine, fn, arg) for arg in args]
+        return [future.result() for future in futures]
+
+
+DEFAULT_POOL = BucketPool()
+
+
+def _original_keys(session, user_ids, limit):
+    """(message id, timestamp) of the newest messages by `user_ids`."""
+
+    return Message.newest(session
+                          .query(Message.id, Message.timestamp)
+                          .filter(Message.user_id.in_(user_ids)),
+                          limit)
+
+
+def _repost_keys(session, user_ids, limit):
+    """(message id, latest repost time, repost count) of the messages
+    most recently reposted by `user_ids`, one row per message.
+    """
+
+    latest = db.func.max(Repost.timestamp)
+    return (session
+            .query(Repost.message_id, latest, db.func.count(Repost.id))
+            .filter(Repost.user_id.in_(user_ids))
+            .group_by(Repost.message_id)
+            .order_by(latest.desc(), Repost.message_id.desc())
+            .limit(limit)
+            .all())
+
+
+def _messages(session, message_ids):
+    """The messages with `message_ids` by undeleted users, with their authors."""
+
+    return (session
+            .query(Message)
+            .join(User, User.id == Message.user_id)
+            .options(db.contains_eager(Message.user))
+            .filter(Message.id.in_(message_ids), User.deleted_at.is_(None))
+            .all())
+
+
+def _reposts(session, message_ids, user_ids):
+    """(timestamp, id, message id, username) of the reposts of
+    `message_ids` by undeleted `user_ids`."""
+
+    return (session
+            .query(Repost.timestamp, Repost.id, Repost.message_id, User.username)
+            .join(User, User.id == Repost.user_id)
+            .filter(Repost.message_id.in_(message_ids),
+                    Repost.user_id.in_(user_ids),
+                    User.deleted_at.is_(None))
+            .all())
+
+
+def _newest(pages, limit):
+    """The first `limit` (id, timestamp) rows of `pages`, each sorted
+    newest first, merged."""
+
+    return list(islice(heapq.merge(*pages, key=lambda row: (row[1], row[0]),
+                                   reverse=True),
+                       limit))
+
+
+def _buckets(user_ids, size):
+    """`user_ids` in lists of at most `size`."""
+
+    return [user_ids[start:start + size] for start in range(0, len(user_ids), size)]
+
+
+def home_timeline(user_id, followee_ids, limit=100, pool=DEFAULT_POOL,
+                  bucket_size=None):
+    """The newest `limit` TimelineItems for `user_id`, newest first.
+
+    With `bucket_size`, users are read that many at a time, in parallel
+    on `pool`.
+    """
+
+    user_ids = [user_id, *followee_ids]
+    buckets = (_buckets(user_ids, bucket_size) if bucket_size and len(user_ids) > bucket_size
+               else [user_ids])
+
+    streams = pool.gather(
+        lambda session, ids: (_original_keys(session, ids, limit),
+                              _repost_keys(session, ids, limit)),
+        buckets)
+    originals = _newest([stream[0] for stream in streams], limit)
+
+    # The same message can be reposted by users in different buckets
+    reposts = {}
+    for message_id, timestamp, count in chain.from_iterable(
+            stream[1] for stream in streams):
+        latest, total = reposts.get(message_id, (timestamp, 0))
+        reposts[message_id] = (max(latest, timestamp), total + count)
+
+    # message id -> (sort timestamp, repost count); a repost newer than
+    # the original (or than another copy) moves the message up
+    keys = {message_id: (timestamp, 0) for message_id, timestamp in originals}
+    for message_id, (timestamp, count) in reposts.items():
+        if message_id not in keys or keys[message_id][0] <= timestamp:
+            keys[message_id] = (timestamp, count)
+
+    page = sorted(keys, key=lambda message_id: (keys[message_id][0], message_id),
+                  reverse=True)[:limit]
+    if not page:
+        return []
+
+    messages = {message.id: message for message in _messages(db.session, page)}
+
+    reposted = [message_id for message_id in page if keys[message_id][1]]
+    reposters = {}
+    if reposted:
+        rows = chain.from_iterable(pool.gather(
+            lambda session, ids: _reposts(session, reposted, ids), buckets))
+        # Later reposts overwrite earlier ones, leaving the latest reposter
+        reposters = {message_id: username
+                     for _, _, message_id, username in sorted(rows)}
+
+    return [TimelineItem(messages[message_id], keys[message_id][0],
+                         reposters.get(message_id), keys[message_id][1])
+            for message_id in page if message_id in messages]
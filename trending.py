@@ -0,0 +1,275 @@
+"""Trending hashtags, mentions and messages for Warbler.
+
+Every counter here decays exponentially, so a count reflects roughly the
+last `half_life` seconds: an event counts 1 when it happens, 1/2 one
+half-life later, and so on. That gives each window (see `WINDOWS`) a
+sliding view without ever re-reading old messages.
+
+Counts live in a count-min sketch, whose memory is fixed no matter how
+many distinct tags show up, plus a bounded set of heavy-hitter
+candidates (Space-Saving style) that `top()` ranks. Everything is
+updated incrementally as messages are written and liked.
+
+Decay uses a moving landmark: an event at time t adds exp(rate * (t - t0))
+instead of 1, and reads scale back by exp(-rate * (now - t0)). Nothing
+has to be touched as time passes; the sketch is rescaled only when the
+weights grow too large.
+
+The counters live in each worker process, and count only what that
+worker saw. `Trends.share(directory)` has workers pool them: every
+`interval` seconds a worker writes its sketches to a file in `directory`
+and merges in the files of the others (count-min sketches add up). Until
+then, the other workers' latest events are missing from its rankings.
+A stopped worker's file keeps counting, decaying, until it's too old to
+matter.
+"""
+
+import hashlib
+import io
+import json
+import math
+import os
+import re
+import socket
+import threading
+import time
+
+import numpy as np
+
+HASHTAG_RE = re.compile(r'(?<!\w)#(\w+)')
+MENTION_RE = re.compile(r'(?<!\w)@(\w+)')
+
+WINDOWS = {
+    'hour': 60 * 60,
+    'day': 24 * 60 * 60,
+}
+
+# Rescale the landmark before weights get anywhere near float overflow.
+MAX_EXPONENT = 50
+
+
+def extract_tags(text):
+    """(hashtags, mentions) in `text`, lowercased, without # and @."""
+
+    return ([tag.lower() for tag in HASHTAG_RE.findall(text)],
+            [name.lower() for name in MENTION_RE.findall(text)])
+
+
+class DecayingTopK:
+    """Decayed counts in a count-min sketch, plus the top candidates."""
+
+    def __init__(self, half_life, width=2048, depth=4, capacity=200,
+                 clock=time.time):
+        self.rate = math.log(2) / half_life
+        self.width = width
+        self.depth = depth
+        self.capacity = capacity
+        self.clock = clock
+        self._sketch = np.zeros((depth, width))
+        self._candidates = {}
+        self._landmark = clock()
+        self._lock = threading.Lock()
+        # The other workers' sketch and candidates, at our landmark
+        self._shared = None
+        self._shared_candidates = ()
+
+    def _columns(self, key):
+        digest = hashlib.blake2b(str(key).encode(), digest_size=4 * self.depth).digest()
+        return [int.from_bytes(digest[i:i + 4], 'little') % self.width
+                for i in range(0, len(digest), 4)]
+
+    def _rescale(self, now):
+        factor = math.exp(-self.rate * (now - self._landmark))
+        self._sketch *= factor
+        if self._shared is not None:
+            self._shared *= factor
+        for key in self._candidates:
+            self._candidates[key] *= factor
+        self._landmark = now
+
+    def add(self, key, amount=1):
+        """Count `amount` (which may be negative) occurrences of `key` now."""
+
+        now = self.clock()
+        with self._lock:
+            if self.rate * (now - self._landmark) > MAX_EXPONENT:
+                self._rescale(now)
+
+            weight = amount * math.exp(self.rate * (now - self._landmark))
+            rows = np.arange(self.depth)
+            columns = self._columns(key)
+            self._sketch[rows, columns] += weight
+            estimate = self._sketch[rows, columns].min()
+
+            if key in self._candidates or len(self._candidates) < self.capacity:
+                self._candidates[key] = estimate
+                return
+
+            # Space-Saving: a newcomer replaces the weakest candidate only
+            # once its estimate overtakes it.
+            weakest = min(self._candidates, key=self._candidates.get)
+            if estimate > self._candidates[weakest]:
+                del self._candidates[weakest]
+                self._candidates[key] = estimate
+
+    def top(self, k):
+        """The `k` keys with the highest decayed counts, as (key, count)."""
+
+        now = self.clock()
+        with self._lock:
+            scale = math.exp(-self.rate * (now - self._landmark))
+            if self._shared is None:
+                counts = self._candidates
+            else:
+                sketch = self._sketch + self._shared
+                rows = np.arange(self.depth)
+                counts = {key: sketch[rows, self._columns(key)].min()
+                          for key in set(self._candidates).union(self._shared_candidates)}
+            ranked = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+
+        return [(key, count * scale) for key, count in ranked[:k] if count > 0]
+
+    def snapshot(self):
+        """This tracker's own counts: (landmark, sketch, candidate keys)."""
+
+        with self._lock:
+            return self._landmark, self._sketch.copy(), list(self._candidates)
+
+    def merge(self, snapshots):
+        """Count the `snapshot()`s of other workers' trackers alongside ours,
+        in place of the ones merged before."""
+
+        now = self.clock()
+        with self._lock:
+            # From now, so their weights only ever scale down to ours
+            self._rescale(now)
+            shared = np.zeros((self.depth, self.width))
+            keys = set()
+            for landmark, sketch, candidates in snapshots:
+                shared += sketch * math.exp(self.rate * (landmark - now))
+                keys.update(candidates)
+            self._shared = shared
+            self._shared_candidates = keys
+
+
+class Trends:
+    """Trending hashtags and mentions per window, and most-liked messages."""
+
+    def __init__(self, windows=WINDOWS, clock=time.time):
+        self.tags = {name: DecayingTopK(half_life, clock=clock)
+                     for name, half_life in windows.items()}
+        self.mentions = {name: DecayingTopK(half_life, clock=clock)
+                         for name, half_life in windows.items()}
+        self.likes = DecayingTopK(min(windows.values()), clock=clock)
+        self.clock = clock
+        # Files older than this many longest half-lives count for nothing
+        self.expiry = 10 * max(windows.values())
+        self.directory = None
+        self.interval = None
+        self.worker = f"{socket.gethostname()}-{os.getpid()}"
+        self._synced = None
+        self._sync_lock = threading.Lock()
+
+    def _trackers(self):
+        yield 'likes', self.likes
+        for name, tracker in self.tags.items():
+            yield f"tags.{name}", tracker
+        for name, tracker in self.mentions.items():
+            yield f"mentions.{name}", tracker
+
+    def share(self, directory, interval=30):
+        """Pool counts with the other workers using `directory` (see module
+        doc), every `interval` seconds."""
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.interval = interval
+
+    def _maybe_sync(self):
+        if self.directory is None:
+            return
+        if self._synced is not None and self.clock() - self._synced < self.interval:
+            return
+        # One thread syncs; the others go on with what was merged last
+        if self._sync_lock.acquire(blocking=False):
+            try:
+                self.sync()
+            finally:
+                self._sync_lock.release()
+
+    def sync(self):
+        """Write this worker's counts to the shared directory and merge in
+        the other workers'."""
+
+        now = self._synced = self.clock()
+        meta = {'time': now, 'trackers': {}}
+        arrays = {}
+        for name, tracker in self._trackers():
+            landmark, sketch, candidates = tracker.snapshot()
+            meta['trackers'][name] = {'landmark': landmark, 'candidates': candidates}
+            arrays[name] = sketch
+
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, meta=np.array(json.dumps(meta)), **arrays)
+        path = os.path.join(self.directory, f"{self.worker}.npz")
+        with open(path + '.tmp', 'wb') as f:
+            f.write(buffer.getvalue())
+        os.replace(path + '.tmp', path)
+
+        snapshots = {name: [] for name, tracker in self._trackers()}
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.npz') or filename == f"{self.worker}.npz":
+                continue
+            other = os.path.join(self.directory, filename)
+            try:
+                with np.load(other, allow_pickle=False) as data:
+                    other_meta = json.loads(str(data['meta']))
+                    if now - other_meta['time'] > self.expiry:
+                        os.remove(other)
+                        continue
+                    for name, found in snapshots.items():
+                        if name in other_meta['trackers'] and name in data:
+                            tracker_meta = other_meta['trackers'][name]
+                            found.append((tracker_meta['landmark'], data[name],
+                                          tracker_meta['candidates']))
+            except (OSError, ValueError, KeyError):
+                # Being replaced or removed under us; next time
+                continue
+
+        for name, tracker in self._trackers():
+            tracker.merge(snapshots[name])
+
+    def record_message(self, text):
+        """Count the hashtags and mentions of a newly written message."""
+
+        self._maybe_sync()
+        hashtags, mentions = extract_tags(text)
+        for tracker in self.tags.values():
+            for tag in hashtags:
+                tracker.add(tag)
+        for tracker in self.mentions.values():
+            for name in mentions:
+                tracker.add(name)
+
+    def record_like(self, message_id, liked=True):
+        """Count a like (or take one back) on `message_id`."""
+
+        self._maybe_sync()
+        self.likes.add(message_id, 1 if liked else -1)
+
+    def top_tags(self, window, k=10):
+        self._maybe_sync()
+        return self.tags[window].top(k)
+
+    def top_mentions(self, window, k=10):
+        self._maybe_sync()
+        return self.mentions[window].top(k)
+
+    def top_messages(self, k=10):
+        """Ids of the most-liked recent messages, best first."""
+
+        self._maybe_sync()
+        return [message_id for message_id, count in self.likes.top(k)]
+
+
+trends = Trends()
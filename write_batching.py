@@ -0,0 +1,140 @@
+"""Group commit for Warbler's write path.
+
+Under bursts of traffic, committing one row per request spends most of
+its time waiting on the database's transaction flush. A `GroupCommitter`
+lets concurrent requests share that cost: each request hands over its row
+and waits, while a single writer thread gathers every row submitted
+within `max_wait` seconds (up to `max_batch` of them), inserts them all
+in one transaction and commits it.
+
+`submit()` only returns once the transaction holding its row has
+committed, so a request that was acknowledged is as durable as one that
+committed on its own. If the batch fails, every request in it gets the
+exception, unless the committer was made with `split_failed`: then each
+row is tried again in a transaction of its own, and only the rows that
+fail on their own fail. `post()` is the fire-and-forget version, for rows
+the request doesn't need to wait for; failures are only logged.
+
+Whatever goes wrong with a batch, the writer thread logs it and goes on
+to the next one, and every request in the batch gets an answer.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from models import db
+
+
+class GroupCommitter:
+    """Writer thread that commits submitted rows in shared transactions."""
+
+    def __init__(self, app, insert, max_batch=100, max_wait=0.005, on_commit=None,
+                 split_failed=False):
+        """`insert(rows)` adds a list of rows to the current session, and
+        may return a list with a result for each (like its id);
+        `on_commit(rows)`, if given, runs after they are committed."""
+
+        self.app = app
+        self.insert = insert
+        self.on_commit = on_commit
+        self.split_failed = split_failed
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def submit(self, row, timeout=10):
+        """Queue `row` and block until it has been committed. Returns the
+        result `insert` gave for it, if any."""
+
+        self._ensure_started()
+        future = Future()
+        self._queue.put((row, future))
+        return future.result(timeout)
+
+    def post(self, row):
+        """Queue `row` without waiting for it to be committed."""
+
+        self._ensure_started()
+        future = Future()
+        future.add_done_callback(self._log_failure)
+        self._queue.put((row, future))
+
+    def _log_failure(self, future):
+        if future.exception() is not None:
+            self.app.logger.error("Batched write failed: %r", future.exception())
+
+    def _next_batch(self):
+        """Wait for a row, then gather more until the batch is due."""
+
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._write(batch)
+            except Exception as exc:
+                # Nothing may stop the thread, or every later row would
+                # wait forever
+                self.app.logger.exception("Batched write failed")
+                for row, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+
+    def _write(self, batch):
+        rows = [row for row, future in batch]
+        error = None
+        with self.app.app_context():
+            try:
+                results = self.insert(rows)
+                db.session.commit()
+            except Exception as exc:
+                db.session.rollback()
+                error = exc
+            finally:
+                db.session.remove()
+
+        if error is not None:
+            if self.split_failed and len(batch) > 1:
+                self.app.logger.warning("Batch of %d failed, writing its rows one by one",
+                                        len(batch))
+                for item in batch:
+                    self._write([item])
+            else:
+                for row, future in batch:
+                    future.set_exception(error)
+            return
+
+        # The rows are in: whatever on_commit does, their requests succeeded
+        if self.on_commit:
+            try:
+                with self.app.app_context():
+                    self.on_commit(rows)
+            except Exception:
+                self.app.logger.exception("After-commit callback failed")
+
+        if results is None:
+            results = [None] * len(batch)
+        for (row, future), result in zip(batch, results):
+            future.set_result(result)